@@ -18,7 +18,7 @@ try:
 except ModuleNotFoundError:
     setproctitle = None
 
-from linuxpy.video.device import Device, PixelFormat, VideoOutput
+from linuxpy.video.device import Device, PacedOutput, PixelFormat, VideoOutput
 
 STOP = False
 
@@ -49,29 +49,27 @@ def run(device_config):
         sink.set_format(width, height, fmt)
         sink.set_fps(frame_rate)
         with sink:
+            paced = PacedOutput(sink, frame_rate)
             start = time.monotonic()
-            last, last_n, skipped = 0, 0, 0
+            last, last_n = 0, 0
             for i in itertools.count():
                 if STOP:
                     print(f"STOPPING {device}....")
                     return
                 frame_n = i + 1
-                sink.write(frames[i % N])
-                next = start + (frame_n / frame_rate)
+                paced.write(frames[i % N])
                 now = time.monotonic()
                 if now - last > 0.5:
                     elapsed = now - last
                     n = frame_n - last_n
                     rate = n / elapsed
+                    stats = paced.stats
                     print(
-                        f"Frame: {i:>8} | Elapsed: {now-start:>8.1f} s | Rate: {rate:>8.1f} fps | Skipped: {skipped:>8}"
+                        f"Frame: {i:>8} | Elapsed: {now - start:>8.1f} s | Rate: {rate:>8.1f} fps | "
+                        f"Late: {stats.late:>8} | Skipped: {stats.skipped:>8} | Jitter: {stats.jitter * 1e3:>6.2f} ms"
                     )
                     last = now
                     last_n = frame_n
-                if now < next:
-                    time.sleep(next - now)
-                else:
-                    skipped += 1
 
 
 def safe_run(device_config):
@@ -22,6 +22,7 @@ MOUNT_PATH = pathlib.Path("/sys")
 DEVICE_PATH = MOUNT_PATH / "bus/usb/devices"
 CLASS_PATH = MOUNT_PATH / "class"
 THERMAL_PATH = CLASS_PATH / "thermal"
+VIDEO4LINUX_PATH = CLASS_PATH / "video4linux"
 
 
 class Mode(enum.Enum):
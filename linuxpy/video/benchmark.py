@@ -0,0 +1,165 @@
+#
+# This file is part of the linuxpy project
+#
+# Copyright (c) 2023 Tiago Coutinho
+# Distributed under the GPLv3 license. See LICENSE for more info.
+
+"""
+Capture benchmark on top of the fake camera of `linuxpy.video.testing` (no
+hardware needed) to catch performance regressions.
+
+For every capture mode it measures:
+
+* frames per second
+* CPU time per frame spent in the consumer thread (includes the small cost
+  of the fake driver when frames are produced on demand)
+* memory allocated per frame (peak growth traced by tracemalloc while
+  getting a frame, measured in a separate run)
+* latency: time between the frame capture timestamp and its delivery
+  (memory map modes only; read mode has no capture timestamp)
+
+Run `python -m linuxpy.video.benchmark --help` for the options. With the
+default `--fps 0` frames are produced as fast as they are consumed.
+"""
+
+import argparse
+import asyncio
+import collections
+import sys
+import time
+import tracemalloc
+
+from linuxpy.types import Callable, Optional, Sequence
+
+from .device import Capability, DropPolicy, Frame, VideoCapture
+from .testing import FakeCamera
+
+MODES = ("read", "mmap", "lease", "async", "gevent")
+
+# fps; cpu, latency, max_latency: seconds; alloc: bytes
+Result = collections.namedtuple("Result", "mode frames fps cpu alloc latency max_latency")
+
+
+def _consume(mode: str, camera: FakeCamera, count: int, probe: Callable[[Frame], None]) -> None:
+    """Capture *count* frames with the given mode calling probe(frame) for each"""
+    if mode == "gevent":
+        from linuxpy.io import GeventIO
+
+        device = camera.device(io=GeventIO)
+    else:
+        device = camera.device()
+    if mode == "read":
+        camera.start_reading()
+        capture = VideoCapture(device, source=Capability.READWRITE)
+    else:
+        # BLOCK: an async consumer behind leaves frames in the driver instead of dropping them
+        capture = VideoCapture(
+            device, size=camera.max_buffers, lease=mode in {"lease", "async"}, drop_policy=DropPolicy.BLOCK
+        )
+    with device, capture:
+        if mode == "async":
+
+            async def consume():
+                index = 0
+                async for frame in capture:
+                    probe(frame)
+                    frame.release()
+                    index += 1
+                    if index == count:
+                        break
+
+            asyncio.run(consume())
+            return
+        for index, frame in enumerate(capture, start=1):
+            probe(frame)
+            if mode == "lease":
+                frame.release()
+            if index == count:
+                break
+
+
+def benchmark(mode: str, frames: int = 1000, alloc_frames: int = 100, **camera_options) -> Result:
+    """
+    Benchmark a capture mode (one of `MODES`). *camera_options* are given to
+    `FakeCamera` (default fps is None: frames are produced on demand)
+    """
+    camera_options.setdefault("fps", None)
+    latencies = []
+
+    def timing_probe(frame):
+        if mode != "read":
+            latencies.append(time.monotonic() - frame.timestamp)
+
+    with FakeCamera(**camera_options) as camera:
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        _consume(mode, camera, frames, timing_probe)
+        elapsed, cpu = time.perf_counter() - start, time.thread_time() - cpu_start
+
+    allocated = 0
+
+    def alloc_probe(frame):
+        nonlocal allocated, base
+        current, peak = tracemalloc.get_traced_memory()
+        allocated += peak - base
+        tracemalloc.reset_peak()
+        base = current
+
+    with FakeCamera(**camera_options) as camera:
+        tracemalloc.start()
+        try:
+            base = tracemalloc.get_traced_memory()[0]
+            _consume(mode, camera, alloc_frames, alloc_probe)
+        finally:
+            tracemalloc.stop()
+
+    latency = sum(latencies) / len(latencies) if latencies else None
+    max_latency = max(latencies) if latencies else None
+    return Result(mode, frames, frames / elapsed, cpu / frames, allocated / alloc_frames, latency, max_latency)
+
+
+def _ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1e3:.3f}"
+
+
+def report(results: Sequence[Result], stream=sys.stdout) -> None:
+    header = f"{'mode':<8}{'frames/s':>12}{'cpu/frame (us)':>16}{'alloc/frame (KiB)':>19}{'latency (ms)':>14}{'max (ms)':>10}"
+    print(header, file=stream)
+    for result in results:
+        print(
+            f"{result.mode:<8}{result.fps:>12.1f}{result.cpu * 1e6:>16.1f}{result.alloc / 1024:>19.2f}"
+            f"{_ms(result.latency):>14}{_ms(result.max_latency):>10}",
+            file=stream,
+        )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="linuxpy video capture benchmark (uses a fake camera)")
+    parser.add_argument("--frames", default=1000, type=int, help="frames per mode (default: 1000)")
+    parser.add_argument("--alloc-frames", default=100, type=int, help="frames for the allocation run (default: 100)")
+    parser.add_argument("--width", default=640, type=int)
+    parser.add_argument("--height", default=480, type=int)
+    parser.add_argument("--format", default="YUYV", help="pixel format (default: YUYV)")
+    parser.add_argument("--fps", default=0, type=float, help="frame rate (default: 0, as fast as possible)")
+    parser.add_argument("--buffers", default=4, type=int, help="number of buffers (default: 4)")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"comma separated modes (default: {','.join(MODES)})")
+    args = parser.parse_args(args)
+    options = {
+        "width": args.width,
+        "height": args.height,
+        "pixel_format": args.format,
+        "fps": args.fps or None,
+        "buffers": args.buffers,
+    }
+    results = []
+    for mode in args.modes.split(","):
+        if mode not in MODES:
+            parser.error(f"unknown mode {mode!r}")
+        try:
+            results.append(benchmark(mode, args.frames, args.alloc_frames, **options))
+        except ModuleNotFoundError as error:
+            print(f"{mode}: skipped ({error})", file=sys.stderr)
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
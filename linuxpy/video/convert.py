@@ -0,0 +1,236 @@
+#
+# This file is part of the linuxpy project
+#
+# Copyright (c) 2023 Tiago Coutinho
+# Distributed under the GPLv3 license. See LICENSE for more info.
+
+"""
+Pixel format conversion for V4L2 (Video 4 Linux 2) frames.
+
+Conversions are vectorized with numpy (ex: `$pip install numpy`); OpenCV is
+not needed. Every conversion accepts a preallocated `out` array so a capture
+loop can run without allocating a new image for each frame.
+
+Supported targets are "RGB", "BGR" (both (height, width, 3) arrays) and
+"GRAY" ((height, width) array). YUV formats are decoded with the ITU-R BT.601
+limited range coefficients. 4:2:0 formats of odd width or height have
+their chroma planes rounded up ((width + 1) // 2 samples per row). Bayer
+patterns are demosaiced per 2x2 cell (each cell gives one RGB value shared
+by its 4 pixels).
+"""
+
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+from linuxpy.types import Callable, Optional
+
+from .raw import PixelFormat
+
+RGB, BGR, GRAY = "RGB", "BGR", "GRAY"
+TARGETS = (RGB, BGR, GRAY)
+
+_CHANNELS = {RGB: (0, 1, 2), BGR: (2, 1, 0)}
+
+
+def _plane(data, offset: int, rows: int, row_bytes: int, stride: int) -> numpy.ndarray:
+    """Read only (rows, row_bytes) view of data starting at offset with the given stride"""
+    size = (rows - 1) * stride + row_bytes
+    flat = numpy.frombuffer(data, dtype=numpy.uint8, count=size, offset=offset)
+    return as_strided(flat, shape=(rows, row_bytes), strides=(stride, 1), writeable=False)
+
+
+def _output(out: Optional[numpy.ndarray], height: int, width: int, to: str) -> numpy.ndarray:
+    shape = (height, width) if to == GRAY else (height, width, 3)
+    if out is None:
+        return numpy.empty(shape, dtype=numpy.uint8)
+    if out.shape != shape or out.dtype != numpy.uint8 or not out.flags.c_contiguous:
+        raise ValueError(f"out must be a C contiguous uint8 array of shape {shape}")
+    return out
+
+
+def _store_rgb(out, r, g, b, to):
+    ri, gi, bi = _CHANNELS[to]
+    out[..., ri] = r
+    out[..., gi] = g
+    out[..., bi] = b
+
+
+def _store_gray(out, r, g, b):
+    r, g, b = (channel.astype(numpy.int32) for channel in (r, g, b))
+    out[...] = (77 * r + 150 * g + 29 * b + 128) >> 8
+
+
+def _yuv_to_rgb(out, y, u, v, to):
+    c = 298 * (y.astype(numpy.int32) - 16) + 128
+    d = u.astype(numpy.int32) - 128
+    e = v.astype(numpy.int32) - 128
+    r = (c + 409 * e) >> 8
+    g = (c - 100 * d - 208 * e) >> 8
+    b = (c + 516 * d) >> 8
+    for channel in (r, g, b):
+        numpy.clip(channel, 0, 255, out=channel)
+    _store_rgb(out, r, g, b, to)
+
+
+def _packed_yuv422(y_offset, u_offset, v_offset):
+    def convert(data, width, height, stride, out, to):
+        if width % 2:
+            raise ValueError(f"packed YUV 4:2:2 needs an even width (got {width})")
+        pixels = _plane(data, 0, height, 2 * width, stride or 2 * width)
+        y = pixels[:, y_offset::2]
+        if to == GRAY:
+            out[...] = y
+            return
+        # each (u, v) pair is shared by 2 horizontal pixels
+        half = width // 2
+        u = pixels[:, u_offset::4, None]
+        v = pixels[:, v_offset::4, None]
+        _yuv_to_rgb(out.reshape(height, half, 2, 3), y.reshape(height, half, 2), u, v, to)
+
+    return convert
+
+
+def _yuv420(chroma_planes):
+    def convert(data, width, height, stride, out, to):
+        stride = stride or width
+        y = _plane(data, 0, height, width, stride)
+        if to == GRAY:
+            out[...] = y
+            return
+        u, v = chroma_planes(data, width, height, stride)
+        # each (u, v) pair is shared by a 2x2 pixel cell
+        if width % 2 or height % 2:
+            # the last cells are cut: upsample the chroma and crop it
+            u = u.repeat(2, axis=0).repeat(2, axis=1)[:height, :width]
+            v = v.repeat(2, axis=0).repeat(2, axis=1)[:height, :width]
+            _yuv_to_rgb(out, y, u, v, to)
+            return
+        rows, cols = height // 2, width // 2
+        y = y.reshape(rows, 2, cols, 2)
+        u = u[:, None, :, None]
+        v = v[:, None, :, None]
+        _yuv_to_rgb(out.reshape(rows, 2, cols, 2, 3), y, u, v, to)
+
+    return convert
+
+
+def _semi_planar(u_offset, v_offset):
+    def chroma_planes(data, width, height, stride):
+        rows, cols = (height + 1) // 2, (width + 1) // 2
+        # an odd width without padding still needs room for the last (u, v) pair
+        uv = _plane(data, stride * height, rows, 2 * cols, max(stride, 2 * cols))
+        return uv[:, u_offset::2], uv[:, v_offset::2]
+
+    return chroma_planes
+
+
+def _planar_chroma_planes(data, width, height, stride):
+    rows, cols, chroma_stride = (height + 1) // 2, (width + 1) // 2, (stride + 1) // 2
+    u_offset = stride * height
+    v_offset = u_offset + chroma_stride * rows
+    return (
+        _plane(data, u_offset, rows, cols, chroma_stride),
+        _plane(data, v_offset, rows, cols, chroma_stride),
+    )
+
+
+def _grey(data, width, height, stride, out, to):
+    y = _plane(data, 0, height, width, stride or width)
+    out[...] = y if to == GRAY else y[..., None]
+
+
+def _packed_rgb(r_offset, g_offset, b_offset):
+    def convert(data, width, height, stride, out, to):
+        pixels = _plane(data, 0, height, 3 * width, stride or 3 * width).reshape(height, width, 3)
+        r, g, b = pixels[..., r_offset], pixels[..., g_offset], pixels[..., b_offset]
+        if to == GRAY:
+            _store_gray(out, r, g, b)
+        else:
+            _store_rgb(out, r, g, b, to)
+
+    return convert
+
+
+def _rgb565(data, width, height, stride, out, to):
+    pixels = _plane(data, 0, height, 2 * width, stride or 2 * width)
+    # little endian: gggbbbbb rrrrrggg
+    pixel = pixels[:, 0::2].astype(numpy.uint16) | (pixels[:, 1::2].astype(numpy.uint16) << 8)
+    r, g, b = pixel >> 11, (pixel >> 5) & 0x3F, pixel & 0x1F
+    r = (r << 3) | (r >> 2)
+    g = (g << 2) | (g >> 4)
+    b = (b << 3) | (b >> 2)
+    if to == GRAY:
+        _store_gray(out, r, g, b)
+    else:
+        _store_rgb(out, r, g, b, to)
+
+
+def _bayer(pattern: str):
+    red, blue = pattern.index("R"), pattern.index("B")
+    green1, green2 = (index for index, color in enumerate(pattern) if color == "G")
+
+    def convert(data, width, height, stride, out, to):
+        if width % 2 or height % 2:
+            raise ValueError(f"bayer patterns need an even width and height (got {width}x{height})")
+        pixels = _plane(data, 0, height, width, stride or width)
+        cells = pixels[0::2, 0::2], pixels[0::2, 1::2], pixels[1::2, 0::2], pixels[1::2, 1::2]
+        rows, cols = height // 2, width // 2
+        r = cells[red][:, None, :, None]
+        g = ((cells[green1].astype(numpy.uint16) + cells[green2]) >> 1)[:, None, :, None]
+        b = cells[blue][:, None, :, None]
+        if to == GRAY:
+            _store_gray(out.reshape(rows, 2, cols, 2), r, g, b)
+        else:
+            _store_rgb(out.reshape(rows, 2, cols, 2, 3), r, g, b, to)
+
+    return convert
+
+
+CONVERTERS: dict[PixelFormat, Callable] = {
+    PixelFormat.YUYV: _packed_yuv422(0, 1, 3),
+    PixelFormat.UYVY: _packed_yuv422(1, 0, 2),
+    PixelFormat.NV12: _yuv420(_semi_planar(0, 1)),
+    PixelFormat.NV12M: _yuv420(_semi_planar(0, 1)),
+    PixelFormat.NV21: _yuv420(_semi_planar(1, 0)),
+    PixelFormat.NV21M: _yuv420(_semi_planar(1, 0)),
+    PixelFormat.YUV420: _yuv420(_planar_chroma_planes),
+    PixelFormat.YUV420M: _yuv420(_planar_chroma_planes),
+    PixelFormat.GREY: _grey,
+    PixelFormat.RGB24: _packed_rgb(0, 1, 2),
+    PixelFormat.BGR24: _packed_rgb(2, 1, 0),
+    PixelFormat.RGB565: _rgb565,
+    PixelFormat.SBGGR8: _bayer("BGGR"),
+    PixelFormat.SGBRG8: _bayer("GBRG"),
+    PixelFormat.SGRBG8: _bayer("GRBG"),
+    PixelFormat.SRGGB8: _bayer("RGGB"),
+}
+
+PIXEL_FORMATS = frozenset(CONVERTERS)
+
+
+def convert(
+    data,
+    width: int,
+    height: int,
+    pixel_format: PixelFormat,
+    to: str = RGB,
+    out: Optional[numpy.ndarray] = None,
+    bytesperline: int = 0,
+) -> numpy.ndarray:
+    """
+    Convert an image buffer in the given V4L2 pixel format to "RGB", "BGR" or "GRAY".
+
+    data can be any object supporting the buffer protocol (bytes, memoryview,
+    mmap...). bytesperline is the stride of the (first) image plane; when not
+    given lines are assumed to have no padding.
+    The result is written in `out` (if given) which is returned.
+    """
+    try:
+        converter = CONVERTERS[pixel_format]
+    except KeyError:
+        raise ValueError(f"Unsupported pixel format {pixel_format!r}") from None
+    if to not in TARGETS:
+        raise ValueError(f"Unsupported target {to!r}. Choose one of {TARGETS}")
+    out = _output(out, height, width, to)
+    converter(data, width, height, bytesperline, out, to)
+    return out
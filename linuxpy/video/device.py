@@ -6,6 +6,7 @@
 
 """Human friendly interface to V4L2 (Video 4 Linux 2) subsystem."""
 
+import abc
 import asyncio
 import collections
 import contextlib
@@ -14,24 +15,42 @@ import ctypes
 import enum
 import errno
 import fractions
+import functools
+import hashlib
+import json
 import logging
 import mmap
 import os
 import select
+import threading
 import time
+import weakref
 from collections import UserDict
 from pathlib import Path
 
-from linuxpy.ctypes import cast, cenum, create_string_buffer, memcpy, string_at
+from linuxpy import sysfs
+from linuxpy.ctypes import byref, c, cast, cenum, create_string_buffer, memcpy, string_at, timespec, timeval
 from linuxpy.device import (
     BaseDevice,
     ReentrantOpen,
+    device_number,
     iter_device_files,
 )
 from linuxpy.io import IO
-from linuxpy.ioctl import ioctl
-from linuxpy.types import AsyncIterator, Buffer, Callable, Iterable, Iterator, Optional, PathLike, Self
-from linuxpy.util import add_reader_asyncio, make_find
+from linuxpy.ioctl import IO as _IO, IOR as _IOR, ioctl
+from linuxpy.types import (
+    AsyncIterator,
+    Buffer,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+    PathLike,
+    Self,
+    Sequence,
+    Union,
+)
+from linuxpy.util import make_find
 
 from . import raw
 
@@ -76,6 +95,57 @@ TimeCodeType = raw.TimeCodeType
 TimeCodeFlag = raw.TimeCodeFlag
 EventSubscriptionFlag = raw.EventSubscriptionFlag
 
+VIDEO_MAX_PLANES = 8
+
+# numpy (dtype, channels) per pixel of packed formats. Used to shape `Frame.array`
+PACKED_PIXEL_FORMATS = {
+    PixelFormat.GREY: ("u1", 1),
+    PixelFormat.SBGGR8: ("u1", 1),
+    PixelFormat.SGBRG8: ("u1", 1),
+    PixelFormat.SGRBG8: ("u1", 1),
+    PixelFormat.SRGGB8: ("u1", 1),
+    PixelFormat.Y10: ("<u2", 1),
+    PixelFormat.Y12: ("<u2", 1),
+    PixelFormat.Y16: ("<u2", 1),
+    PixelFormat.Y16_BE: (">u2", 1),
+    PixelFormat.Z16: ("<u2", 1),
+    PixelFormat.SBGGR16: ("<u2", 1),
+    PixelFormat.SGBRG16: ("<u2", 1),
+    PixelFormat.SGRBG16: ("<u2", 1),
+    PixelFormat.SRGGB16: ("<u2", 1),
+    PixelFormat.YUYV: ("u1", 2),
+    PixelFormat.YVYU: ("u1", 2),
+    PixelFormat.UYVY: ("u1", 2),
+    PixelFormat.VYUY: ("u1", 2),
+    PixelFormat.RGB565: ("u1", 2),
+    PixelFormat.RGB565X: ("u1", 2),
+    PixelFormat.RGB555: ("u1", 2),
+    PixelFormat.XRGB555: ("u1", 2),
+    PixelFormat.ARGB555: ("u1", 2),
+    PixelFormat.RGB24: ("u1", 3),
+    PixelFormat.BGR24: ("u1", 3),
+    PixelFormat.RGB32: ("u1", 4),
+    PixelFormat.BGR32: ("u1", 4),
+    PixelFormat.ABGR32: ("u1", 4),
+    PixelFormat.XBGR32: ("u1", 4),
+    PixelFormat.ARGB32: ("u1", 4),
+    PixelFormat.XRGB32: ("u1", 4),
+    PixelFormat.RGBA32: ("u1", 4),
+    PixelFormat.RGBX32: ("u1", 4),
+    PixelFormat.BGRA32: ("u1", 4),
+    PixelFormat.BGRX32: ("u1", 4),
+    PixelFormat.YUV32: ("u1", 4),
+}
+
+# YUV 4:2:0 formats stored as a luma plane followed by half height chroma
+YUV420_PIXEL_FORMATS = {PixelFormat.NV12, PixelFormat.NV21, PixelFormat.YUV420, PixelFormat.YVU420}
+
+MULTI_PLANE_BUFFER_TYPES = {BufferType.VIDEO_CAPTURE_MPLANE, BufferType.VIDEO_OUTPUT_MPLANE}
+
+CAPTURE_BUFFER_TYPES = {BufferType.VIDEO_CAPTURE, BufferType.VIDEO_CAPTURE_MPLANE}
+
+OUTPUT_BUFFER_TYPES = {BufferType.VIDEO_OUTPUT, BufferType.VIDEO_OUTPUT_MPLANE}
+
 
 def V4L2_CTRL_ID2CLASS(id_):
     return id_ & 0x0FFF0000  # unsigned long
@@ -96,7 +166,9 @@ Info = collections.namedtuple(
 
 ImageFormat = collections.namedtuple("ImageFormat", "type description flags pixel_format")
 
-Format = collections.namedtuple("Format", "width height pixel_format")
+# bytesperline is 0 when unknown (ex: compressed formats)
+# size: image size in bytes (sizeimage, all planes included)
+Format = collections.namedtuple("Format", "width height pixel_format bytesperline size", defaults=[0, 0])
 
 CropCapability = collections.namedtuple("CropCapability", "type bounds defrect pixel_aspect")
 
@@ -106,7 +178,75 @@ Size = collections.namedtuple("Size", "width height")
 
 FrameType = collections.namedtuple("FrameType", "type pixel_format width height min_fps max_fps step_fps")
 
-Input = collections.namedtuple("InputType", "index name type audioset tuner std status capabilities")
+Input = collections.namedtuple("Input", "index name type audioset tuner std status capabilities")
+
+FrameStats = collections.namedtuple("FrameStats", "frames dropped lost")
+
+SubscriberStats = collections.namedtuple("SubscriberStats", "frames dropped lag")
+
+# late: frames queued more than half a period after their deadline; skipped:
+# frame slots given up to catch up; jitter, max_jitter: queue time error (seconds)
+PacingStats = collections.namedtuple("PacingStats", "frames late skipped jitter max_jitter")
+
+# queued: frames dequeued but not yet consumed; delay, max_delay: age (seconds)
+# of the frames when handed to the consumer
+LagStats = collections.namedtuple("LagStats", "queued delay max_delay")
+
+
+class DropPolicy(enum.Enum):
+    """What to do with a new frame when the async consumer is behind"""
+
+    LATEST = "latest"  # keep only the most recent frame
+    DROP_OLDEST = "drop-oldest"  # discard the oldest queued frame
+    DROP_NEWEST = "drop-newest"  # discard the new frame
+    BLOCK = "block"  # stop dequeuing until the consumer catches up
+
+
+class ControlWhich(enum.IntEnum):
+    """Which control value the extended control API reads or writes"""
+
+    CURRENT = 0  # V4L2_CTRL_WHICH_CUR_VAL
+    DEFAULT = 0x0F000000  # V4L2_CTRL_WHICH_DEF_VAL
+    REQUEST = 0x0F010000  # V4L2_CTRL_WHICH_REQUEST_VAL
+
+
+class ControlChange(enum.IntFlag):
+    """What changed in a control event (V4L2_EVENT_CTRL_CH_*)"""
+
+    VALUE = 1 << 0
+    FLAGS = 1 << 1
+    RANGE = 1 << 2
+    DIMENSIONS = 1 << 3
+
+
+# event subscription flags (V4L2_EVENT_SUB_FL_*)
+EVENT_SUB_SEND_INITIAL = 1 << 0
+EVENT_SUB_ALLOW_FEEDBACK = 1 << 1
+
+
+# media request ioctls (linux/media.h)
+MEDIA_IOC_REQUEST_ALLOC = _IOR("|", 0x05, ctypes.c_int)
+MEDIA_REQUEST_IOC_QUEUE = _IO("|", 0x80)
+MEDIA_REQUEST_IOC_REINIT = _IO("|", 0x81)
+
+
+class EncoderCommand(enum.IntEnum):
+    """Memory to memory encoder commands (V4L2_ENC_CMD_*)"""
+
+    START = 0
+    STOP = 1
+    PAUSE = 2
+    RESUME = 3
+
+
+class DecoderCommand(enum.IntEnum):
+    """Memory to memory decoder commands (V4L2_DEC_CMD_*)"""
+
+    START = 0
+    STOP = 1
+    PAUSE = 2
+    RESUME = 3
+    FLUSH = 4
 
 
 INFO_REPR = """\
@@ -125,6 +265,15 @@ def mem_map(fd, length, offset):
     return mmap.mmap(fd, length, offset=offset)
 
 
+def lease_view(buffer: Buffer, size: int, offset: int = 0) -> memoryview:
+    """
+    Writable view of *size* bytes of *buffer* from *offset*. The view has its
+    own exporter (`view.obj`) which lives as long as any view derived from
+    it (ex: a numpy array) so that a lease can tell if it is still referenced
+    """
+    return memoryview((ctypes.c_ubyte * size).from_buffer(buffer, offset)).cast("B")
+
+
 def flag_items(flag):
     return [item for item in type(flag) if item in flag]
 
@@ -320,17 +469,20 @@ def iter_read_menu(fd, ctrl):
         yield copy.deepcopy(menu)
 
 
-def read_info(fd):
-    caps = read_capabilities(fd)
+def version_str(caps: raw.v4l2_capability) -> str:
     version_tuple = (
         (caps.version & 0xFF0000) >> 16,
         (caps.version & 0x00FF00) >> 8,
         (caps.version & 0x0000FF),
     )
-    version_str = ".".join(map(str, version_tuple))
-    device_capabilities = Capability(caps.device_caps)
-    buffers = [typ for typ in BufferType if Capability[typ.name] in device_capabilities]
+    return ".".join(map(str, version_tuple))
 
+
+def capability_buffers(device_capabilities: Capability) -> list[BufferType]:
+    return [typ for typ in BufferType if Capability[typ.name] in device_capabilities]
+
+
+def read_formats(fd, buffers: Iterable[BufferType]) -> list[ImageFormat]:
     img_fmt_stream_types = {
         BufferType.VIDEO_CAPTURE,
         BufferType.VIDEO_CAPTURE_MPLANE,
@@ -340,12 +492,12 @@ def read_info(fd):
     } & set(buffers)
 
     image_formats = []
-    pixel_formats = set()
     for stream_type in img_fmt_stream_types:
-        for image_format in iter_read_formats(fd, stream_type):
-            image_formats.append(image_format)
-            pixel_formats.add(image_format.pixel_format)
+        image_formats.extend(iter_read_formats(fd, stream_type))
+    return image_formats
+
 
+def read_crop_capabilities(fd, buffers: Iterable[BufferType]) -> list[CropCapability]:
     crop = raw.v4l2_cropcap()
     crop_stream_types = {
         BufferType.VIDEO_CAPTURE,
@@ -361,15 +513,24 @@ def read_info(fd):
             continue
         crop_cap = CropCapability.from_raw(stream_type, crop)
         crop_caps.append(crop_cap)
+    return crop_caps
+
+
+def read_info(fd):
+    caps = read_capabilities(fd)
+    device_capabilities = Capability(caps.device_caps)
+    buffers = capability_buffers(device_capabilities)
+    image_formats = read_formats(fd, buffers)
+    pixel_formats = {image_format.pixel_format for image_format in image_formats}
 
     return Info(
         driver=caps.driver.decode(),
         card=caps.card.decode(),
         bus_info=caps.bus_info.decode(),
-        version=version_str,
+        version=version_str(caps),
         capabilities=Capability(caps.capabilities),
         device_capabilities=device_capabilities,
-        crop_capabilities=crop_caps,
+        crop_capabilities=read_crop_capabilities(fd, buffers),
         buffers=buffers,
         formats=image_formats,
         frame_sizes=frame_sizes(fd, pixel_formats),
@@ -378,40 +539,312 @@ def read_info(fd):
     )
 
 
-def query_buffer(fd, buffer_type: BufferType, memory: Memory, index: int) -> raw.v4l2_buffer:
+class LazyInfo:
+    """
+    Device information read on demand (same fields as `Info`).
+
+    Only QUERYCAP is issued on creation. Each of the other sections
+    (crop capabilities, formats, frame sizes, inputs and controls) is read
+    from the device the first time it is accessed and cached afterwards.
+    The device must be open when a section is read for the first time.
+    """
+
+    def __init__(self, device: "Device"):
+        self.device = device
+        caps = read_capabilities(device.fileno())
+        self.driver = caps.driver.decode()
+        self.card = caps.card.decode()
+        self.bus_info = caps.bus_info.decode()
+        self.version = version_str(caps)
+        self.capabilities = Capability(caps.capabilities)
+        self.device_capabilities = Capability(caps.device_caps)
+        self.buffers = capability_buffers(self.device_capabilities)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} driver={self.driver!r}, card={self.card!r}, bus_info={self.bus_info!r}>"
+
+    @functools.cached_property
+    def crop_capabilities(self) -> list[CropCapability]:
+        return read_crop_capabilities(self.device.fileno(), self.buffers)
+
+    @functools.cached_property
+    def formats(self) -> list[ImageFormat]:
+        return read_formats(self.device.fileno(), self.buffers)
+
+    @functools.cached_property
+    def frame_sizes(self) -> list[FrameType]:
+        pixel_formats = {image_format.pixel_format for image_format in self.formats}
+        return frame_sizes(self.device.fileno(), pixel_formats)
+
+    @functools.cached_property
+    def inputs(self) -> list[Input]:
+        return list(iter_read_inputs(self.device.fileno()))
+
+    @functools.cached_property
+    def controls(self) -> list[raw.v4l2_query_ext_ctrl]:
+        return list(iter_read_controls(self.device.fileno()))
+
+    def materialize(self) -> Info:
+        """Read all missing sections and return them as an `Info`"""
+        return Info(*(getattr(self, field) for field in Info._fields))
+
+
+# control flags which change at runtime are not stored in the info cache
+DYNAMIC_CONTROL_FLAGS = ControlFlag.INACTIVE | ControlFlag.GRABBED
+
+
+def _struct_to_json(struct) -> dict:
+    result = {}
+    for name, *_ in struct._fields_:
+        if name.startswith("reserved"):
+            continue
+        value = getattr(struct, name)
+        if isinstance(value, bytes):
+            value = value.decode("latin-1")
+        elif isinstance(value, ctypes.Array):
+            value = list(value)
+        result[name] = value
+    return result
+
+
+def _struct_from_json(struct_type, data: dict):
+    struct = struct_type()
+    for name, value in data.items():
+        if isinstance(value, str):
+            value = value.encode("latin-1")
+        elif isinstance(value, list):
+            value = type(getattr(struct, name))(*value)
+        setattr(struct, name, value)
+    return struct
+
+
+def _fraction(value) -> list[int]:
+    value = fractions.Fraction(value)
+    return [value.numerator, value.denominator]
+
+
+def info_to_json(info: Info, menus: dict) -> dict:
+    """JSON compatible form of the static part of *info* and control *menus* (see `InfoCache`)"""
+    controls = []
+    for ctrl in info.controls:
+        ctrl = _struct_to_json(ctrl)
+        ctrl["flags"] &= ~DYNAMIC_CONTROL_FLAGS
+        controls.append(ctrl)
+    return {
+        "driver": info.driver,
+        "card": info.card,
+        "bus_info": info.bus_info,
+        "version": info.version,
+        "capabilities": int(info.capabilities),
+        "device_capabilities": int(info.device_capabilities),
+        "crop_capabilities": [
+            [int(crop.type), list(crop.bounds), list(crop.defrect), crop.pixel_aspect]
+            for crop in info.crop_capabilities
+        ],
+        "buffers": [int(buffer_type) for buffer_type in info.buffers],
+        "formats": [[int(fmt.type), fmt.description, int(fmt.flags), int(fmt.pixel_format)] for fmt in info.formats],
+        "frame_sizes": [
+            [int(size.type), int(size.pixel_format), size.width, size.height]
+            + [_fraction(fps) for fps in (size.min_fps, size.max_fps, size.step_fps)]
+            for size in info.frame_sizes
+        ],
+        "controls": controls,
+        "menus": {ctrl_id: list(items.items()) for ctrl_id, items in menus.items()},
+    }
+
+
+def info_from_json(data: dict) -> tuple[Info, dict]:
+    """Inverse of `info_to_json`. Inputs are not cached: they are None"""
+    info = Info(
+        driver=data["driver"],
+        card=data["card"],
+        bus_info=data["bus_info"],
+        version=data["version"],
+        capabilities=Capability(data["capabilities"]),
+        device_capabilities=Capability(data["device_capabilities"]),
+        crop_capabilities=[
+            CropCapability(BufferType(buffer_type), Rect(*bounds), Rect(*defrect), pixel_aspect)
+            for buffer_type, bounds, defrect, pixel_aspect in data["crop_capabilities"]
+        ],
+        buffers=[BufferType(buffer_type) for buffer_type in data["buffers"]],
+        formats=[
+            ImageFormat(BufferType(buffer_type), description, ImageFormatFlag(flags), PixelFormat(pixel_format))
+            for buffer_type, description, flags, pixel_format in data["formats"]
+        ],
+        frame_sizes=[
+            FrameType(
+                FrameIntervalType(interval_type),
+                PixelFormat(pixel_format),
+                width,
+                height,
+                *(fractions.Fraction(*fps) for fps in rates),
+            )
+            for interval_type, pixel_format, width, height, *rates in data["frame_sizes"]
+        ],
+        inputs=None,
+        controls=[_struct_from_json(raw.v4l2_query_ext_ctrl, ctrl) for ctrl in data["controls"]],
+    )
+    menus = {int(ctrl_id): dict(items) for ctrl_id, items in data["menus"].items()}
+    return info, menus
+
+
+class InfoCache:
+    """
+    Persistent on disk cache of device information (capabilities, formats,
+    frame sizes, inputs, controls and control menus).
+
+    Entries are keyed by driver, card, bus info, driver version and device
+    capabilities so opening a known device only costs a QUERYCAP instead of
+    a full enumeration:
+
+    ```python
+    cache = InfoCache()
+    with Device.from_id(0, cache=cache) as cam:
+        ...
+    ```
+
+    The default location is `$XDG_CACHE_HOME/linuxpy/video` (`~/.cache/linuxpy/video`).
+    Call `clear()` (or delete the directory) after changing device firmware or
+    drivers with the same version.
+
+    Entries are plain JSON. Dynamic state is not cached: control flags which
+    change at runtime (inactive, grabbed) are left out and inputs (with their
+    signal status) are always read from the device.
+    """
+
+    # bump when the layout of cached data changes
+    VERSION = 2
+
+    def __init__(self, path: Optional[PathLike] = None):
+        if path is None:
+            path = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "linuxpy" / "video"
+        self.path = Path(path)
+
+    def key(self, caps: raw.v4l2_capability) -> str:
+        from linuxpy import __version__
+
+        fields = (
+            __version__,
+            self.VERSION,
+            caps.driver,
+            caps.card,
+            caps.bus_info,
+            caps.version,
+            caps.capabilities,
+            caps.device_caps,
+        )
+        return hashlib.sha1(repr(fields).encode()).hexdigest()
+
+    def load(self, key: str) -> Optional[tuple[Info, dict]]:
+        """Returns (info without inputs, menus) for the given key or None if not in cache"""
+        try:
+            with open(self.path / f"{key}.json", "rb") as fobj:
+                return info_from_json(json.load(fobj))
+        except FileNotFoundError:
+            return None
+        except Exception as error:
+            log.warning("ignored invalid cache entry %s: %r", key, error)
+            return None
+
+    def save(self, key: str, info: Info, menus: dict) -> None:
+        """Stores (info, menus) atomically. Errors are logged and ignored"""
+        filename = self.path / f"{key}.json"
+        temp = filename.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(temp, "w") as fobj:
+                json.dump(info_to_json(info, menus), fobj)
+            os.replace(temp, filename)
+        except OSError as error:
+            log.warning("could not write cache entry %s: %r", filename, error)
+            with contextlib.suppress(OSError):
+                temp.unlink()
+
+    def clear(self) -> None:
+        for filename in self.path.glob("*.json"):
+            filename.unlink()
+
+    def read(self, device: "Device") -> tuple[Info, "Controls"]:
+        """Read device information and controls from the cache (or the device on a miss)"""
+        key = self.key(read_capabilities(device.fileno()))
+        entry = self.load(key)
+        if entry is not None:
+            info, menus = entry
+            device.info = info = info._replace(inputs=list(iter_read_inputs(device.fileno())))
+            return info, Controls.from_device(device, menus)
+        device.info = info = read_info(device.fileno())
+        controls = Controls.from_device(device)
+        menus = {ctrl.id: dict(ctrl.data) for ctrl in controls.values() if isinstance(ctrl, MenuControl)}
+        self.save(key, info, menus)
+        return info, controls
+
+
+def is_multiplanar(buffer_type: BufferType) -> bool:
+    return buffer_type in MULTI_PLANE_BUFFER_TYPES
+
+
+def new_buffer(buffer_type: BufferType, memory: Memory, index: int = 0) -> raw.v4l2_buffer:
+    """Create a v4l2_buffer, with room for the planes if the buffer type is multi-planar"""
     buff = raw.v4l2_buffer()
     buff.type = buffer_type
     buff.memory = memory
     buff.index = index
     buff.reserved = 0
+    if is_multiplanar(buffer_type):
+        # ctypes keeps a reference to the planes array in the buffer
+        buff.m.planes = (raw.v4l2_plane * VIDEO_MAX_PLANES)()
+        buff.length = VIDEO_MAX_PLANES
+    return buff
+
+
+def copy_buffer(buff: raw.v4l2_buffer) -> raw.v4l2_buffer:
+    """Copy of a v4l2_buffer (planes included) which can be safely given back to the driver"""
+    result = raw.v4l2_buffer()
+    memcpy(result, buff)
+    if is_multiplanar(buff.type):
+        planes = (raw.v4l2_plane * VIDEO_MAX_PLANES)()
+        for index in range(buff.length):
+            memcpy(planes[index], buff.m.planes[index])
+        result.m.planes = planes
+    return result
+
+
+def buffer_planes(buff: raw.v4l2_buffer) -> list[raw.v4l2_plane]:
+    return [buff.m.planes[index] for index in range(buff.length)]
+
+
+def query_buffer(fd, buffer_type: BufferType, memory: Memory, index: int) -> raw.v4l2_buffer:
+    buff = new_buffer(buffer_type, memory, index)
     ioctl(fd, IOC.QUERYBUF, buff)
     return buff
 
 
 def enqueue_buffer_raw(fd, buff: raw.v4l2_buffer) -> raw.v4l2_buffer:
-    if not buff.timestamp.secs:
-        buff.timestamp.set_ns()
     ioctl(fd, IOC.QBUF, buff)
     return buff
 
 
+def stamp_buffer(buff: raw.v4l2_buffer, timestamp: Optional[timeval] = None) -> raw.v4l2_buffer:
+    """Set the timestamp of an output buffer to *timestamp* (defaults to now, CLOCK_MONOTONIC)"""
+    if timestamp is None:
+        buff.timestamp.set_ns(time.monotonic_ns())
+    else:
+        buff.timestamp = timestamp
+    return buff
+
+
 def enqueue_buffer(fd, buffer_type: BufferType, memory: Memory, size: int, index: int) -> raw.v4l2_buffer:
-    buff = raw.v4l2_buffer()
-    buff.type = buffer_type
-    buff.memory = memory
-    buff.bytesused = size
-    buff.index = index
+    buff = new_buffer(buffer_type, memory, index)
+    if is_multiplanar(buffer_type):
+        buff.m.planes[0].bytesused = size
+    else:
+        buff.bytesused = size
     buff.field = Field.NONE
-    buff.reserved = 0
     return enqueue_buffer_raw(fd, buff)
 
 
 def dequeue_buffer(fd, buffer_type: BufferType, memory: Memory) -> raw.v4l2_buffer:
-    buff = raw.v4l2_buffer()
-    buff.type = buffer_type
-    buff.memory = memory
-    buff.index = 0
-    buff.reserved = 0
+    buff = new_buffer(buffer_type, memory)
     ioctl(fd, IOC.DQBUF, buff)
     return buff
 
@@ -436,6 +869,19 @@ def free_buffers(fd, buffer_type: BufferType, memory: Memory) -> raw.v4l2_reques
     return req
 
 
+def export_buffer(
+    fd, buffer_type: BufferType, index: int, plane: int = 0, flags: int = os.O_CLOEXEC | os.O_RDWR
+) -> int:
+    """Export a buffer as a DMABUF file descriptor. The caller owns the returned descriptor"""
+    req = raw.v4l2_exportbuffer()
+    req.type = buffer_type
+    req.index = index
+    req.plane = plane
+    req.flags = flags
+    ioctl(fd, IOC.EXPBUF, req)
+    return req.fd
+
+
 def set_raw_format(fd, fmt: raw.v4l2_format):
     ioctl(fd, IOC.S_FMT, fmt)
 
@@ -445,12 +891,19 @@ def set_format(fd, buffer_type: BufferType, width: int, height: int, pixel_forma
     if isinstance(pixel_format, str):
         pixel_format = raw.v4l2_fourcc(*pixel_format.upper())
     fmt.type = buffer_type
-    fmt.fmt.pix.pixelformat = pixel_format
-    fmt.fmt.pix.field = Field.ANY
-    fmt.fmt.pix.width = width
-    fmt.fmt.pix.height = height
-    fmt.fmt.pix.bytesperline = 0
-    fmt.fmt.pix.sizeimage = 0
+    if is_multiplanar(buffer_type):
+        fmt.fmt.pix_mp.pixelformat = pixel_format
+        fmt.fmt.pix_mp.field = Field.ANY
+        fmt.fmt.pix_mp.width = width
+        fmt.fmt.pix_mp.height = height
+        fmt.fmt.pix_mp.num_planes = 0
+    else:
+        fmt.fmt.pix.pixelformat = pixel_format
+        fmt.fmt.pix.field = Field.ANY
+        fmt.fmt.pix.width = width
+        fmt.fmt.pix.height = height
+        fmt.fmt.pix.bytesperline = 0
+        fmt.fmt.pix.sizeimage = 0
     return set_raw_format(fd, fmt)
 
 
@@ -463,13 +916,53 @@ def get_raw_format(fd, buffer_type):
 
 def get_format(fd, buffer_type) -> Format:
     f = get_raw_format(fd, buffer_type)
+    if is_multiplanar(buffer_type):
+        return Format(
+            width=f.fmt.pix_mp.width,
+            height=f.fmt.pix_mp.height,
+            pixel_format=PixelFormat(f.fmt.pix_mp.pixelformat),
+            bytesperline=f.fmt.pix_mp.plane_fmt[0].bytesperline,
+            size=sum(plane.sizeimage for plane in f.fmt.pix_mp.plane_fmt[: f.fmt.pix_mp.num_planes]),
+        )
     return Format(
         width=f.fmt.pix.width,
         height=f.fmt.pix.height,
         pixel_format=PixelFormat(f.fmt.pix.pixelformat),
+        bytesperline=f.fmt.pix.bytesperline,
+        size=f.fmt.pix.sizeimage,
     )
 
 
+def get_plane_sizes(fd, buffer_type, memories: Sequence) -> list[int]:
+    """
+    Negotiated image size (sizeimage) of each plane of a multi-planar format,
+    bounded by the size of the plane *memories* (which is often padded)
+    """
+    f = get_raw_format(fd, buffer_type).fmt.pix_mp
+    sizes = [f.plane_fmt[index].sizeimage for index in range(f.num_planes)]
+    return [min(size, len(memory)) if size else len(memory) for memory, size in zip(memories, sizes)]
+
+
+def write_planes(data: Buffer, memories: Sequence, planes: Sequence[raw.v4l2_plane], sizes: Sequence[int]) -> None:
+    """
+    Copy *data* to the plane *memories* in order, each plane getting up to
+    its image size (see `get_plane_sizes`), and set the planes bytesused
+    """
+    data, offset = memoryview(data).cast("B"), 0
+    for memory, plane, size in zip(memories, planes, sizes):
+        chunk = data[offset : offset + size]
+        memory[: len(chunk)] = chunk
+        plane.bytesused = len(chunk)
+        offset += len(chunk)
+
+
+def check_data_size(data: Buffer, capacity: int) -> int:
+    size = getattr(data, "nbytes", len(data))
+    if size > capacity:
+        raise V4L2Error(f"{size} bytes don't fit a {capacity} bytes buffer")
+    return size
+
+
 def get_parm(fd, buffer_type):
     p = raw.v4l2_streamparm()
     p.type = buffer_type
@@ -483,10 +976,10 @@ def set_fps(fd, buffer_type, fps):
     p = raw.v4l2_streamparm()
     p.type = buffer_type
     fps = fractions.Fraction(fps).limit_denominator(max_denominator)
-    if buffer_type == BufferType.VIDEO_CAPTURE:
+    if buffer_type in CAPTURE_BUFFER_TYPES:
         p.parm.capture.timeperframe.numerator = fps.denominator
         p.parm.capture.timeperframe.denominator = fps.numerator
-    elif buffer_type == BufferType.VIDEO_OUTPUT:
+    elif buffer_type in OUTPUT_BUFFER_TYPES:
         p.parm.output.timeperframe.numerator = fps.denominator
         p.parm.output.timeperframe.denominator = fps.numerator
     else:
@@ -496,9 +989,9 @@ def set_fps(fd, buffer_type, fps):
 
 def get_fps(fd, buffer_type):
     p = get_parm(fd, buffer_type)
-    if buffer_type == BufferType.VIDEO_CAPTURE:
+    if buffer_type in CAPTURE_BUFFER_TYPES:
         parm = p.parm.capture
-    elif buffer_type == BufferType.VIDEO_OUTPUT:
+    elif buffer_type in OUTPUT_BUFFER_TYPES:
         parm = p.parm.output
     else:
         raise ValueError(f"Unsupported buffer type {buffer_type!r}")
@@ -569,6 +1062,125 @@ def set_control(fd, id, value):
     ioctl(fd, IOC.S_CTRL, control)
 
 
+def has_payload(info: raw.v4l2_query_ext_ctrl) -> bool:
+    """True for string, array and compound controls (value passed by pointer)"""
+    return bool(info.flags & ControlFlag.HAS_PAYLOAD)
+
+
+def _new_ext_controls(items, which, request_fd=0):
+    """items is a sequence of (query_ext_ctrl, value). value is ignored when None"""
+    array = (raw.v4l2_ext_control * len(items))()
+    payloads = []
+    for control, (info, value) in zip(array, items):
+        control.id = info.id
+        if has_payload(info):
+            size = info.elem_size * max(info.elems, 1)
+            if value is None:
+                data = b""
+            elif info.type == ControlType.STRING:
+                data = value.encode() if isinstance(value, str) else bytes(value)
+            else:
+                data = memoryview(value).tobytes()
+                if info.flags & ControlFlag.DYNAMIC_ARRAY:
+                    size = len(data)
+            if len(data) > size:
+                raise ValueError(f"Control {info.name.decode()!r} value exceeds {size} bytes")
+            payload = create_string_buffer(data, size)
+            payloads.append(payload)
+            control.size = size
+            control.ptr = ctypes.addressof(payload)
+        elif value is not None:
+            if info.type == ControlType.INTEGER64:
+                control.value64 = value
+            else:
+                control.value = value
+    ext = raw.v4l2_ext_controls()
+    ext.which = which
+    ext.request_fd = request_fd
+    ext.count = len(items)
+    ext.controls = array
+    return ext, array, payloads
+
+
+def _read_ext_control(info: raw.v4l2_query_ext_ctrl, control: raw.v4l2_ext_control):
+    if has_payload(info):
+        data = string_at(control.ptr, control.size)
+        if info.type == ControlType.STRING:
+            return data.split(b"\0", 1)[0].decode()
+        return data
+    if info.type == ControlType.INTEGER64:
+        return control.value64
+    return control.value
+
+
+def _ext_controls_ioctl(fd, ioc, infos, which, values=None, request_fd=0) -> list:
+    items = list(zip(infos, [None] * len(infos) if values is None else values))
+    ext, array, _ = _new_ext_controls(items, which, request_fd)
+    try:
+        ioctl(fd, ioc, ext)
+    except OSError as error:
+        if ext.error_idx < ext.count:
+            name = infos[ext.error_idx].name.decode()
+            raise OSError(error.errno, f"{error.strerror} (control {name!r})") from error
+        raise
+    return [_read_ext_control(info, control) for info, control in zip(infos, array)]
+
+
+def get_ext_controls(
+    fd, infos: Sequence[raw.v4l2_query_ext_ctrl], which: ControlWhich = ControlWhich.CURRENT, request_fd: int = 0
+) -> list:
+    """
+    Read several controls with a single G_EXT_CTRLS.
+    With `ControlWhich.REQUEST`, the values of a completed request are read.
+    """
+    return _ext_controls_ioctl(fd, IOC.G_EXT_CTRLS, infos, which, request_fd=request_fd)
+
+
+def set_ext_controls(
+    fd,
+    infos: Sequence[raw.v4l2_query_ext_ctrl],
+    values: Sequence,
+    which: ControlWhich = ControlWhich.CURRENT,
+    request_fd: int = 0,
+) -> list:
+    """
+    Atomically write several controls with a single S_EXT_CTRLS.
+    With `ControlWhich.REQUEST`, the values are only stored in the
+    request and applied when it is queued.
+    Returns the values as applied by the driver.
+    """
+    return _ext_controls_ioctl(fd, IOC.S_EXT_CTRLS, infos, which, values, request_fd)
+
+
+def try_ext_controls(
+    fd,
+    infos: Sequence[raw.v4l2_query_ext_ctrl],
+    values: Sequence,
+    which: ControlWhich = ControlWhich.CURRENT,
+    request_fd: int = 0,
+) -> list:
+    """
+    Validate several control values with TRY_EXT_CTRLS without applying them.
+    Returns the values as the driver would apply them.
+    """
+    return _ext_controls_ioctl(fd, IOC.TRY_EXT_CTRLS, infos, which, values, request_fd)
+
+
+def allocate_request(media_fd) -> int:
+    """Allocate a new request on a media device. The caller owns the returned descriptor"""
+    request_fd = ctypes.c_int()
+    ioctl(media_fd, MEDIA_IOC_REQUEST_ALLOC, request_fd)
+    return request_fd.value
+
+
+def queue_request(request_fd) -> None:
+    ioctl(request_fd, MEDIA_REQUEST_IOC_QUEUE)
+
+
+def reinit_request(request_fd) -> None:
+    ioctl(request_fd, MEDIA_REQUEST_IOC_REINIT)
+
+
 def get_priority(fd) -> Priority:
     priority = ctypes.c_uint()
     ioctl(fd, IOC.G_PRIORITY, priority)
@@ -606,6 +1218,22 @@ def deque_event(fd):
     return event
 
 
+def encoder_command(fd, command: EncoderCommand, flags: int = 0) -> raw.v4l2_encoder_cmd:
+    cmd = raw.v4l2_encoder_cmd()
+    cmd.cmd = command
+    cmd.flags = flags
+    ioctl(fd, IOC.ENCODER_CMD, cmd)
+    return cmd
+
+
+def decoder_command(fd, command: DecoderCommand, flags: int = 0) -> raw.v4l2_decoder_cmd:
+    cmd = raw.v4l2_decoder_cmd()
+    cmd.cmd = command
+    cmd.flags = flags
+    ioctl(fd, IOC.DECODER_CMD, cmd)
+    return cmd
+
+
 def set_edid(fd, edid):
     if len(edid) % 128:
         raise ValueError(f"EDID length {len(edid)} is not multiple of 128")
@@ -653,6 +1281,10 @@ def mmap_from_buffer(fd, buff: raw.v4l2_buffer) -> mmap.mmap:
     return mem_map(fd, buff.length, offset=buff.m.offset)
 
 
+def mmap_planes_from_buffer(fd, buff: raw.v4l2_buffer) -> list[mmap.mmap]:
+    return [mem_map(fd, plane.length, offset=plane.m.mem_offset) for plane in buffer_planes(buff)]
+
+
 def create_mmap_buffers(fd, buffer_type: BufferType, memory: Memory, count: int) -> list[mmap.mmap]:
     """create buffers + mmap_from_buffer"""
     return [mmap_from_buffer(fd, buff) for buff in create_buffers(fd, buffer_type, memory, count)]
@@ -669,9 +1301,19 @@ def enqueue_buffers(fd, buffer_type: BufferType, memory: Memory, count: int) ->
 class Device(BaseDevice):
     PREFIX = "/dev/video"
 
-    def __init__(self, name_or_file, read_write=True, io=IO):
+    def __init__(
+        self,
+        name_or_file,
+        read_write=True,
+        io=IO,
+        cache: Optional[InfoCache] = None,
+        lazy: bool = False,
+    ):
         self.info = None
-        self.controls = None
+        self._controls = None
+        self.control_cache = None
+        self.cache = cache
+        self.lazy = lazy
         super().__init__(name_or_file, read_write=read_write, io=io)
 
     def __iter__(self):
@@ -684,8 +1326,21 @@ class Device(BaseDevice):
                 yield frame
 
     def _on_open(self):
-        self.info = read_info(self.fileno())
-        self.controls = Controls.from_device(self)
+        self._controls = None
+        if self.cache is not None:
+            self.info, self._controls = self.cache.read(self)
+        elif self.lazy:
+            self.info = LazyInfo(self)
+        else:
+            self.info = read_info(self.fileno())
+            self._controls = Controls.from_device(self)
+
+    @property
+    def controls(self) -> Optional["Controls"]:
+        """Device controls (in lazy mode, read on first access)"""
+        if self._controls is None and self.info is not None:
+            self._controls = Controls.from_device(self)
+        return self._controls
 
     def query_buffer(self, buffer_type, memory, index):
         return query_buffer(self.fileno(), buffer_type, memory, index)
@@ -705,6 +1360,9 @@ class Device(BaseDevice):
     def free_buffers(self, buffer_type, memory):
         return free_buffers(self.fileno(), buffer_type, memory)
 
+    def export_buffer(self, buffer_type: BufferType, index: int, plane: int = 0) -> int:
+        return export_buffer(self.fileno(), buffer_type, index, plane)
+
     def enqueue_buffers(self, buffer_type: BufferType, memory: Memory, count: int) -> list[raw.v4l2_buffer]:
         return enqueue_buffers(self.fileno(), buffer_type, memory, count)
 
@@ -765,6 +1423,12 @@ class Device(BaseDevice):
     def deque_event(self):
         return deque_event(self.fileno())
 
+    def encoder_command(self, command: EncoderCommand, flags: int = 0):
+        return encoder_command(self.fileno(), command, flags)
+
+    def decoder_command(self, command: DecoderCommand, flags: int = 0):
+        return decoder_command(self.fileno(), command, flags)
+
     def set_edid(self, edid):
         set_edid(self.fileno(), edid)
 
@@ -775,9 +1439,19 @@ class Device(BaseDevice):
         return get_edid(self.fileno())
 
 
+def _request_which(which: ControlWhich, request) -> tuple[ControlWhich, int]:
+    if request is None:
+        return which, 0
+    return ControlWhich.REQUEST, request.fileno()
+
+
 class Controls(dict):
     @classmethod
-    def from_device(cls, device):
+    def from_device(cls, device, menus: Optional[dict] = None):
+        """
+        Build controls from device info. *menus* maps menu control ids to
+        their items (skips reading them from the device)
+        """
         ctrl_type_map = {
             ControlType.BOOLEAN: BooleanControl,
             ControlType.INTEGER: IntegerControl,
@@ -793,7 +1467,10 @@ class Controls(dict):
         for ctrl in device.info.controls:
             ctrl_type = ControlType(ctrl.type)
             ctrl_class = ctrl_type_map.get(ctrl_type, GenericControl)
-            ctrl_dict[ctrl.id] = ctrl_class(device, ctrl)
+            if menus is not None and ctrl_class is MenuControl and ctrl.id in menus:
+                ctrl_dict[ctrl.id] = MenuControl(device, ctrl, menus[ctrl.id])
+            else:
+                ctrl_dict[ctrl.id] = ctrl_class(device, ctrl)
 
         return cls(ctrl_dict)
 
@@ -835,13 +1512,77 @@ class Controls(dict):
             if isinstance(v, BaseControl) and (v.control_class == control_class):
                 yield v
 
-    def set_to_default(self):
-        for v in self.values():
-            if not isinstance(v, BaseControl):
-                continue
+    def _control(self, key) -> "BaseControl":
+        return key if isinstance(key, BaseControl) else self[key]
+
+    def get_values(self, *keys, which: ControlWhich = ControlWhich.CURRENT, request=None) -> dict:
+        """
+        Read the given controls (objects, ids or names) with a single ioctl.
+        Without keys, all readable controls are read. If a completed
+        *request* is given, the values it applied are read.
+        Returns a dict of control config name to value.
+        """
+        if keys:
+            controls = [self._control(key) for key in keys]
+        else:
+            controls = [
+                ctrl for ctrl in self.values() if isinstance(ctrl, BaseMonoControl) and not ctrl.is_flagged_write_only
+            ]
+        if not controls:
+            return {}
+        which, request_fd = _request_which(which, request)
+        values = get_ext_controls(controls[0].device, [ctrl._info for ctrl in controls], which, request_fd)
+        return {ctrl.config_name: ctrl._convert_read(value) for ctrl, value in zip(controls, values)}
+
+    def _prepare_values(self, values: dict):
+        controls, raw_values = [], []
+        for key, value in values.items():
+            ctrl = self._control(key)
+            ctrl._check_writeable()
+            if isinstance(ctrl, BaseMonoControl):
+                value = ctrl._mangle_write(ctrl._convert_write(value))
+            controls.append(ctrl)
+            raw_values.append(value)
+        return controls, raw_values
+
+    def set_values(self, values: dict, which: ControlWhich = ControlWhich.CURRENT, request=None) -> dict:
+        """
+        Atomically write several controls (keys can be control objects,
+        ids or names) with a single ioctl. Either all values are applied or
+        none. If a *request* is given, the values are only applied when the
+        request is submitted.
+        Returns a dict of control config name to value as applied.
+        """
+        controls, raw_values = self._prepare_values(values)
+        if not controls:
+            return {}
+        which, request_fd = _request_which(which, request)
+        infos = [ctrl._info for ctrl in controls]
+        result = set_ext_controls(controls[0].device, infos, raw_values, which, request_fd)
+        return {ctrl.config_name: ctrl._convert_read(value) for ctrl, value in zip(controls, result)}
+
+    def try_values(self, values: dict, which: ControlWhich = ControlWhich.CURRENT, request=None) -> dict:
+        """
+        Validate several control values with the driver without applying
+        them. Returns a dict of control config name to value as the driver
+        would apply them.
+        """
+        controls, raw_values = self._prepare_values(values)
+        if not controls:
+            return {}
+        which, request_fd = _request_which(which, request)
+        infos = [ctrl._info for ctrl in controls]
+        result = try_ext_controls(controls[0].device, infos, raw_values, which, request_fd)
+        return {ctrl.config_name: ctrl._convert_read(value) for ctrl, value in zip(controls, result)}
 
-            with contextlib.suppress(AttributeError):
-                v.set_to_default()
+    def set_to_default(self):
+        """Set all writable controls to their default value in a single ioctl"""
+        values = {
+            ctrl: ctrl.default
+            for ctrl in self.values()
+            if isinstance(ctrl, BaseMonoControl) and ctrl.is_writeable and not has_payload(ctrl._info)
+        }
+        self.set_values(values)
 
     def set_clipping(self, clipping: bool) -> None:
         for v in self.values():
@@ -882,10 +1623,18 @@ class BaseControl:
         return ""
 
     def _get_control(self):
+        cache = getattr(self.device, "control_cache", None)
+        if cache is not None:
+            with contextlib.suppress(KeyError):
+                return cache.value(self.id)
         value = get_control(self.device, self.id)
         return value
 
     def _set_control(self, value):
+        self._check_writeable()
+        set_control(self.device, self.id, value)
+
+    def _check_writeable(self):
         if not self.is_writeable:
             reasons = []
             if self.is_flagged_read_only:
@@ -897,7 +1646,6 @@ class BaseControl:
             if self.is_flagged_grabbed:
                 reasons.append("grabbed")
             raise AttributeError(f"{self.__class__.__name__} {self.config_name} is not writeable: {', '.join(reasons)}")
-        set_control(self.device, self.id, value)
 
     @property
     def config_name(self) -> str:
@@ -1122,11 +1870,13 @@ class BooleanControl(BaseMonoControl):
 
 
 class MenuControl(BaseMonoControl, UserDict):
-    def __init__(self, device, info):
+    def __init__(self, device, info, items: Optional[dict] = None):
         BaseControl.__init__(self, device, info)
         UserDict.__init__(self)
 
-        if self.type == ControlType.MENU:
+        if items is not None:
+            self.data = dict(items)
+        elif self.type == ControlType.MENU:
             self.data = {item.index: item.name.decode() for item in iter_read_menu(self.device._fobj, self)}
         elif self.type == ControlType.INTEGER_MENU:
             self.data = {item.index: int(item.name) for item in iter_read_menu(self.device._fobj, self)}
@@ -1192,6 +1942,9 @@ class BufferManager(DeviceHelper):
         self.buffers = self.device.create_buffers(self.type, memory, self.size)
         return self.buffers
 
+    def export_buffer(self, index: int, plane: int = 0) -> int:
+        return self.device.export_buffer(self.type, index, plane)
+
     def set_format(self, width, height, pixel_format="MJPG"):
         return self.device.set_format(self.type, width, height, pixel_format)
 
@@ -1221,14 +1974,20 @@ class BufferManager(DeviceHelper):
 
 
 class Frame:
-    """The resulting object from an acquisition."""
+    """
+    The resulting object from an acquisition.
+
+    `planes` holds one buffer per plane. For multi-planar buffer types `data`
+    is the concatenation of all planes.
+    """
 
-    __slots__ = ["format", "buff", "data"]
+    __slots__ = ["format", "buff", "data", "planes"]
 
-    def __init__(self, data: bytes, buff: raw.v4l2_buffer, format: Format):
+    def __init__(self, data: bytes, buff: raw.v4l2_buffer, format: Format, planes: Optional[Sequence] = None):
         self.format = format
         self.buff = buff
         self.data = data
+        self.planes = (data,) if planes is None else planes
 
     def __bytes__(self):
         return self.data
@@ -1255,6 +2014,8 @@ class Frame:
 
     @property
     def nbytes(self):
+        if is_multiplanar(self.buff.type):
+            return sum(plane.bytesused - plane.data_offset for plane in buffer_planes(self.buff))
         return self.buff.bytesused
 
     @property
@@ -1302,16 +2063,247 @@ class Frame:
 
     @property
     def array(self):
+        """
+        numpy array sharing memory with the frame data (no copy is made
+        except for leased multi-planar frames with more than one plane).
+
+        Packed formats are shaped (height, width) for single channel formats
+        or (height, width, channels) otherwise, honoring `bytesperline`.
+        YUV 4:2:0 formats without line padding are shaped (height * 3 // 2, width).
+        Other formats (ex: compressed) give a flat uint8 array.
+        """
         import numpy
 
-        return numpy.frombuffer(bytes(self), dtype="u1")
+        if self.data is not None:
+            data = self.data
+        elif len(self.planes) == 1:
+            data = self.planes[0]
+        else:
+            data = bytes(self)
+        width, height, pixel_format, stride, _ = self.format
+        if pixel_format in PACKED_PIXEL_FORMATS:
+            dtype, channels = PACKED_PIXEL_FORMATS[pixel_format]
+            dtype = numpy.dtype(dtype)
+            channel_bytes = dtype.itemsize
+            stride = stride or width * channels * channel_bytes
+            if channels == 1:
+                shape, strides = (height, width), (stride, channel_bytes)
+            else:
+                shape = (height, width, channels)
+                strides = (stride, channels * channel_bytes, channel_bytes)
+            return numpy.ndarray(shape, dtype=dtype, buffer=data, strides=strides)
+        if pixel_format in YUV420_PIXEL_FORMATS and stride in {0, width}:
+            return numpy.ndarray((height * 3 // 2, width), dtype="u1", buffer=data)
+        return numpy.frombuffer(data, dtype="u1")
+
+    def convert(self, to: str = "RGB", out=None):
+        """
+        Convert the frame image to "RGB", "BGR" or "GRAY" numpy array.
+        The result is written in `out` (if given). See `linuxpy.video.convert`.
+        """
+        from .convert import convert
+
+        data = bytes(self) if self.data is None else self.data
+        return convert(data, self.width, self.height, self.pixel_format, to, out, self.format.bytesperline)
+
+    def to_rgb(self, out=None):
+        """Frame image as a (height, width, 3) RGB numpy array"""
+        return self.convert("RGB", out)
+
+    def to_bgr(self, out=None):
+        """Frame image as a (height, width, 3) BGR numpy array"""
+        return self.convert("BGR", out)
+
+    def to_gray(self, out=None):
+        """Frame image as a (height, width) grayscale numpy array"""
+        return self.convert("GRAY", out)
+
+
+class LeasedFrame(Frame):
+    """
+    A frame whose data is a zero-copy view into the driver buffer.
+
+    The buffer is only given back to the driver (QBUF) when the frame is
+    released: explicitly with `release()`, at the end of a `with` statement
+    or when the frame is garbage collected. Views derived from the frame
+    data (ex: `array`) must be dropped first: the buffer is never given back
+    while one of them is alive.
+
+    Multi-planar frames have no contiguous data: `data` is None and each
+    plane is available as a view in `planes`.
+    """
+
+    __slots__ = ["_release", "_exporters", "__weakref__"]
+
+    def __init__(
+        self,
+        data: Optional[memoryview],
+        buff: raw.v4l2_buffer,
+        format: Format,
+        release: Callable,
+        planes: Optional[Sequence[memoryview]] = None,
+    ):
+        super().__init__(data, buff, format, planes)
+        self._release = release
+        self._exporters = []
+        for plane in self.planes:
+            with contextlib.suppress(TypeError):
+                self._exporters.append(weakref.ref(plane.obj))
+
+    def __del__(self):
+        try:
+            self.release()
+        except BufferError as error:
+            log.warning("%s: buffer kept out of the driver queue", error)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __bytes__(self):
+        return b"".join(self.planes)
+
+    def __len__(self):
+        return sum(plane.nbytes for plane in self.planes)
+
+    @property
+    def released(self) -> bool:
+        return self._release is None
+
+    def release(self) -> None:
+        """
+        Give the buffer back to the driver. Calling it more than once has no effect.
+
+        Raises BufferError if a view of the frame data is still alive (the
+        buffer is kept: release again once the views are gone)
+        """
+        if self._release is None:
+            return
+        if not self._release_views():
+            raise BufferError(f"frame #{self.frame_nb} data is still referenced")
+        release, self._release = self._release, None
+        release(self.buff)
+
+    def _release_views(self) -> bool:
+        """Release all plane views. Returns False if views derived from them are still alive"""
+        for plane in self.planes:
+            with contextlib.suppress(BufferError):
+                plane.release()
+        return all(exporter() is None for exporter in self._exporters)
+
+    def _detach(self, log=log) -> None:
+        """Forget the buffer (it is being freed) and drop the views that can be"""
+        self._release = None
+        if not self._release_views():
+            log.warning("frame #%d data still referenced while its buffer is freed", self.frame_nb)
+
+
+class WritableFrame(LeasedFrame):
+    """
+    A free output buffer to fill in place: `data`, `planes` and `array` are
+    writable views of the driver memory (see `VideoOutput.acquire`).
+
+    `commit()` queues the buffer to the driver. Releasing it without
+    committing (explicitly, on error inside a `with` statement or when the
+    frame is garbage collected) keeps the buffer for the next acquire.
+    """
+
+    __slots__ = ["_commit"]
+
+    def __init__(
+        self,
+        data: Optional[memoryview],
+        buff: raw.v4l2_buffer,
+        format: Format,
+        release: Callable,
+        commit: Callable,
+        planes: Optional[Sequence[memoryview]] = None,
+    ):
+        super().__init__(data, buff, format, release, planes)
+        self._commit = commit
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None and not self.released:
+            self.commit()
+        else:
+            self.release()
+
+    def fill(self, data: Buffer) -> Union[int, list[int]]:
+        """
+        Copy *data* to the buffer (split over the planes in order). Returns
+        the size to commit
+        """
+        view, sizes = memoryview(data).cast("B"), []
+        for plane in self.planes:
+            chunk = view[: plane.nbytes]
+            plane[: chunk.nbytes] = chunk
+            sizes.append(chunk.nbytes)
+            view = view[chunk.nbytes :]
+        if view.nbytes:
+            raise V4L2Error(f"data is {view.nbytes} bytes larger than the buffer")
+        return sizes if self.data is None else sizes[0]
+
+    def commit(self, size: Union[int, Sequence[int], None] = None, timestamp: Optional[timeval] = None) -> None:
+        """
+        Queue the buffer with *size* bytes (one size per plane for
+        multi-planar buffers). Defaults to the whole buffer.
+        The buffer is stamped with *timestamp* (defaults to now)
+        """
+        if self.released:
+            raise V4L2Error("buffer already committed or released")
+        buff = self.buff
+        stamp_buffer(buff, timestamp)
+        if is_multiplanar(buff.type):
+            sizes = [plane.nbytes for plane in self.planes] if size is None else size
+            for plane, plane_size in zip(buffer_planes(buff), sizes):
+                plane.bytesused = plane_size
+        else:
+            buff.bytesused = self.planes[0].nbytes if size is None else size
+        release, self._release = self._release, self._commit
+        try:
+            self.release()
+        except BufferError:
+            self._release = release
+            raise
 
 
 class VideoCapture(BufferManager):
-    def __init__(self, device: Device, size: int = 2, source: Capability = None):
-        super().__init__(device, BufferType.VIDEO_CAPTURE, size)
+    """
+    Video capture helper.
+
+    *source* selects how frames are transferred: `Capability.STREAMING`
+    (memory map), `Capability.READWRITE` (read), `Memory.DMABUF` in which
+    case *pool* must be a sequence of DMABUF file descriptors to import or
+    `Memory.USERPTR` in which case *pool* must be a sequence of writable
+    buffers (ex: numpy arrays) the driver fills directly.
+    If not given, memory map is used if available with a fallback to read.
+
+    Use `buffer_type=BufferType.VIDEO_CAPTURE_MPLANE` for multi-planar devices.
+
+    *drop_policy* and *max_queue_size* configure what happens to frames when
+    an async consumer falls behind (see `FrameReader`).
+    """
+
+    def __init__(
+        self,
+        device: Device,
+        size: int = 2,
+        source: Union[Capability, Memory, None] = None,
+        lease: bool = False,
+        pool: Optional[Sequence] = None,
+        buffer_type: BufferType = BufferType.VIDEO_CAPTURE,
+        drop_policy: DropPolicy = DropPolicy.DROP_OLDEST,
+        max_queue_size: int = 1,
+    ):
+        super().__init__(device, buffer_type, size)
         self.buffer = None
         self.source = source
+        self.lease = lease
+        self.pool = pool
+        self.drop_policy = drop_policy
+        self.max_queue_size = max_queue_size
 
     def __enter__(self):
         self.open()
@@ -1327,21 +2319,39 @@ class VideoCapture(BufferManager):
         async for frame in self.buffer:
             yield frame
 
+    @property
+    def stats(self) -> FrameStats:
+        """Frames read, dropped and lost since the capture started"""
+        return self.buffer.frame_reader.stats
+
+    @property
+    def lag(self) -> LagStats:
+        """How far behind the consumer is (see `FrameReader`)"""
+        return self.buffer.frame_reader.lag
+
     def open(self):
         if self.buffer is None:
             self.device.log.info("Preparing for video capture...")
             capabilities = self.device.info.capabilities
-            if Capability.VIDEO_CAPTURE not in capabilities:
-                raise V4L2Error("device lacks VIDEO_CAPTURE capability")
+            if Capability[self.type.name] not in capabilities:
+                raise V4L2Error(f"device lacks {self.type.name} capability")
             source = capabilities if self.source is None else self.source
-            if Capability.STREAMING in source:
+            if source is Memory.DMABUF:
+                self.device.log.info("Video capture using DMABUF")
+                self.buffer = DmaBuf(self, self.pool, lease=self.lease)
+            elif source is Memory.USERPTR:
+                self.device.log.info("Video capture using user pointers")
+                self.buffer = UserPtr(self, self.pool)
+            elif Capability.STREAMING in source:
                 self.device.log.info("Video capture using memory map")
-                self.buffer = MemoryMap(self)
+                self.buffer = MemoryMap(self, lease=self.lease)
             elif Capability.READWRITE in source:
                 self.device.log.info("Video capture using read")
                 self.buffer = Read(self)
             else:
                 raise OSError("Device needs to support STREAMING or READWRITE capability")
+            self.buffer.frame_reader.drop_policy = self.drop_policy
+            self.buffer.frame_reader.max_queue_size = self.max_queue_size
             self.buffer.open()
             self.stream_on()
             self.device.log.info("Video capture started!")
@@ -1355,38 +2365,331 @@ class VideoCapture(BufferManager):
             self.device.log.info("Video capture closed")
 
 
-class Read(ReentrantOpen):
-    def __init__(self, buffer_manager: BufferManager):
-        super().__init__()
-        self.buffer_manager = buffer_manager
-        self.frame_reader = FrameReader(self.device, self.raw_read)
-        self.format = None
-
-    def __iter__(self) -> Iterator[Frame]:
-        with self.frame_reader:
-            while True:
-                yield self.frame_reader.read()
+class FrameRing:
+    """
+    Background capture engine: a dedicated thread dequeues frames from the
+    capture and stores the last *size* of them in a ring which any number
+    of subscribers (sync or async) read from, each at its own pace.
+
+    ```python
+    with FrameRing(VideoCapture(device)) as ring:
+        for frame in ring.subscribe():
+            ...
+    ```
+
+    Frames are kept in the ring after the driver buffer is given back, so
+    the capture must not use leased frames.
+    """
 
-    async def __aiter__(self) -> AsyncIterator[Frame]:
-        async with self.frame_reader:
-            while True:
-                yield await self.frame_reader.aread()
+    def __init__(self, capture: VideoCapture, size: int = 8, timeout: float = 0.1):
+        if capture.lease:
+            raise V4L2Error("FrameRing needs a capture without leased frames")
+        self.capture = capture
+        self.slots = size * [None]
+        self.head = 0
+        self.timeout = timeout
+        self.error = None
+        self._condition = threading.Condition()
+        self._waiters = set()
+        self._thread = None
+        self._running = False
 
-    def open(self) -> None:
-        self.format = self.buffer_manager.get_format()
+    def __enter__(self) -> Self:
+        self.start()
+        return self
 
-    def close(self) -> None:
-        self.format = None
+    def __exit__(self, *exc):
+        self.stop()
 
     @property
-    def device(self) -> Device:
-        return self.buffer_manager.device
+    def is_running(self) -> bool:
+        return self._running
 
-    def raw_grab(self) -> tuple[bytes, raw.v4l2_buffer]:
-        data = os.read(self.device.fileno(), 2**31 - 1)
-        ns = time.time_ns()
-        buff = raw.v4l2_buffer()
-        buff.bytesused = len(data)
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self.error = None
+        self._running = True
+        name = f"FrameRing-{self.capture.device.filename.name}"
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._running = False
+            thread.join()
+
+    def subscribe(self) -> "FrameSubscriber":
+        """New subscriber which starts with the next captured frame"""
+        return FrameSubscriber(self)
+
+    def _run(self) -> None:
+        try:
+            with self.capture:
+                reader = self.capture.buffer.frame_reader
+                while self._running:
+                    frame = reader.read(self.timeout)
+                    if frame is not None:
+                        self._publish(frame)
+        except Exception as error:
+            self.capture.device.log.exception("frame ring stopped on error")
+            self.error = error
+        finally:
+            self._running = False
+            self._notify()
+
+    def _publish(self, frame: Frame) -> None:
+        with self._condition:
+            self.slots[self.head % len(self.slots)] = frame
+            self.head += 1
+        self._notify()
+
+    def _notify(self) -> None:
+        with self._condition:
+            self._condition.notify_all()
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+
+class FrameSubscriber:
+    """
+    A cursor into a `FrameRing`. If the subscriber falls more than the ring
+    size behind, the oldest frames are skipped and accounted as dropped.
+    """
+
+    def __init__(self, ring: FrameRing):
+        self.ring = ring
+        self.cursor = ring.head
+        self._frames = 0
+        self._dropped = 0
+
+    def __iter__(self) -> Iterator[Frame]:
+        while True:
+            frame = self.read()
+            if frame is None:
+                if not self.ring.is_running:
+                    return
+                continue
+            yield frame
+
+    async def __aiter__(self) -> AsyncIterator[Frame]:
+        while True:
+            frame = await self.aread()
+            if frame is None:
+                return
+            yield frame
+
+    @property
+    def lag(self) -> int:
+        """Number of frames available but not yet read"""
+        return min(self.ring.head - self.cursor, len(self.ring.slots))
+
+    @property
+    def stats(self) -> SubscriberStats:
+        return SubscriberStats(self._frames, self._dropped, self.lag)
+
+    def _take(self) -> Frame:
+        ring = self.ring
+        size = len(ring.slots)
+        behind = ring.head - self.cursor
+        if behind > size:
+            self._dropped += behind - size
+            self.cursor = ring.head - size
+        frame = ring.slots[self.cursor % size]
+        self.cursor += 1
+        self._frames += 1
+        return frame
+
+    def _available(self) -> bool:
+        return self.ring.head > self.cursor or not self.ring.is_running
+
+    def read(self, timeout: Optional[float] = None) -> Optional[Frame]:
+        """
+        Wait for the next frame. Returns None on timeout or if the ring
+        stopped and there are no frames left
+        """
+        ring = self.ring
+        with ring._condition:
+            if not ring._condition.wait_for(self._available, timeout):
+                return None
+            if ring.head > self.cursor:
+                return self._take()
+
+    async def aread(self) -> Optional[Frame]:
+        """Wait for the next frame. Returns None if the ring stopped and there are no frames left"""
+        ring = self.ring
+        loop = asyncio.get_running_loop()
+        while True:
+            event = asyncio.Event()
+            waiter = loop, event
+            with ring._condition:
+                if ring.head > self.cursor:
+                    return self._take()
+                if not ring.is_running:
+                    return None
+                ring._waiters.add(waiter)
+            try:
+                await event.wait()
+            finally:
+                with ring._condition:
+                    ring._waiters.discard(waiter)
+
+
+class FrameGrouper:
+    """
+    Groups frames coming from *size* sources whose timestamps fall within
+    *tolerance* seconds of each other. At most *depth* frames are kept per
+    source; frames which can't be matched are discarded and counted in
+    `dropped`.
+    """
+
+    def __init__(self, size: int, tolerance: float, depth: int = 4):
+        self.tolerance = tolerance
+        self.pending = [collections.deque(maxlen=depth) for _ in range(size)]
+        self.dropped = 0
+
+    def push(self, index: int, frame: Frame) -> Optional[tuple[Frame, ...]]:
+        """Add a frame from source *index*. Returns a complete group if there is one"""
+        queue = self.pending[index]
+        if len(queue) == queue.maxlen:
+            self.dropped += 1
+        queue.append(frame)
+        pending = self.pending
+        while all(pending):
+            heads = [queue[0] for queue in pending]
+            newest = max(frame.timestamp for frame in heads)
+            if all(newest - frame.timestamp <= self.tolerance for frame in heads):
+                return tuple(queue.popleft() for queue in pending)
+            # heads too old to ever be matched
+            for queue in pending:
+                if newest - queue[0].timestamp > self.tolerance:
+                    queue.popleft()
+                    self.dropped += 1
+
+
+class MultiCapture:
+    """
+    Capture from several devices in a single thread. All devices are
+    registered in one epoll set and frames are dequeued from whichever
+    device is ready.
+
+    ```python
+    captures = [VideoCapture(device) for device in devices]
+    with MultiCapture(captures) as multi:
+        for capture, frame in multi:
+            ...
+        for left, right in multi.groups(tolerance=0.002):
+            ...
+    ```
+
+    Devices must have been opened in non-blocking mode (the default).
+    """
+
+    def __init__(self, captures: Iterable[VideoCapture]):
+        self.captures = list(captures)
+        self.grouper = None
+        self._selector = None
+        self._stack = None
+        self._fds = {}
+
+    def __enter__(self) -> Self:
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self) -> Iterator[tuple[VideoCapture, Frame]]:
+        while True:
+            yield from self.read()
+
+    def open(self) -> None:
+        if self._selector is not None:
+            return
+        with contextlib.ExitStack() as stack:
+            selector = select.epoll()
+            stack.callback(selector.close)
+            for capture in self.captures:
+                stack.enter_context(capture)
+                fd = capture.device.fileno()
+                selector.register(fd, select.EPOLLIN)
+                self._fds[fd] = capture
+            self._stack = stack.pop_all()
+            self._selector = selector
+
+    def close(self) -> None:
+        if self._selector is not None:
+            self._selector = None
+            self._fds = {}
+            stack, self._stack = self._stack, None
+            stack.close()
+
+    def read(self, timeout: Optional[float] = None) -> list[tuple[VideoCapture, Frame]]:
+        """
+        Wait until at least one device is ready and return one frame from
+        each ready device. Returns an empty list on timeout
+        """
+        result = []
+        events = self._selector.poll(-1 if timeout is None else timeout)
+        for fd, _ in events:
+            capture = self._fds[fd]
+            try:
+                frame = capture.buffer.raw_read()
+            except BlockingIOError:
+                continue
+            result.append((capture, frame))
+        return result
+
+    def groups(self, tolerance: float, depth: int = 4) -> Iterator[tuple[Frame, ...]]:
+        """
+        Yield tuples with one frame per capture (in the order of `captures`)
+        whose timestamps fall within *tolerance* seconds of each other.
+        Unmatched frames are counted in `grouper.dropped`
+        """
+        index = {id(capture): i for i, capture in enumerate(self.captures)}
+        self.grouper = grouper = FrameGrouper(len(self.captures), tolerance, depth)
+        for capture, frame in self:
+            group = grouper.push(index[id(capture)], frame)
+            if group is not None:
+                yield group
+
+
+class Read(ReentrantOpen):
+    def __init__(self, buffer_manager: BufferManager):
+        super().__init__()
+        self.buffer_manager = buffer_manager
+        self.frame_reader = FrameReader(self.device, self.raw_read)
+        self.format = None
+
+    def __iter__(self) -> Iterator[Frame]:
+        with self.frame_reader:
+            while True:
+                yield self.frame_reader.read()
+
+    async def __aiter__(self) -> AsyncIterator[Frame]:
+        async with self.frame_reader:
+            while True:
+                yield await self.frame_reader.aread()
+
+    def open(self) -> None:
+        self.format = self.buffer_manager.get_format()
+
+    def close(self) -> None:
+        self.format = None
+
+    @property
+    def device(self) -> Device:
+        return self.buffer_manager.device
+
+    def raw_grab(self) -> tuple[bytes, raw.v4l2_buffer]:
+        # read() gives at most one frame: ask for the image size (the
+        # maximum for compressed formats) to avoid allocating 2GiB each time
+        data = os.read(self.device.fileno(), self.format.size or 2**31 - 1)
+        ns = time.time_ns()
+        buff = raw.v4l2_buffer()
+        buff.bytesused = len(data)
         buff.timestamp.set_ns(ns)
         return data, buff
 
@@ -1412,13 +2715,19 @@ class Read(ReentrantOpen):
 
 
 class MemoryMap(ReentrantOpen):
-    def __init__(self, buffer_manager: BufferManager):
+    def __init__(self, buffer_manager: BufferManager, lease: bool = False):
         super().__init__()
         self.buffer_manager = buffer_manager
         self.buffers = None
         self.queue = BufferQueue(buffer_manager, Memory.MMAP)
         self.frame_reader = FrameReader(self.device, self.raw_read)
         self.format = None
+        self.lease = lease
+        self.leases = weakref.WeakSet()
+        self.exported = None
+        self.free = []  # output buffers dequeued and not yet acquired
+        self.acquired = set()  # indexes of output buffers being filled
+        self.plane_sizes = None  # image size of each plane (multi-planar only)
 
     def __iter__(self) -> Iterator[Frame]:
         with self.frame_reader:
@@ -1426,26 +2735,28 @@ class MemoryMap(ReentrantOpen):
                 yield self.frame_reader.read()
 
     async def __aiter__(self) -> AsyncIterator[Frame]:
-        queue = asyncio.Queue(maxsize=10)
-
-        def feed():
-            queue.put_nowait(self.raw_read())
-
-        with add_reader_asyncio(self.device.fileno(), feed):
+        async with self.frame_reader:
             while True:
-                frame = await queue.get()
-                yield frame
+                yield await self.frame_reader.aread()
 
     @property
     def device(self) -> Device:
         return self.buffer_manager.device
 
+    @property
+    def multiplanar(self) -> bool:
+        return is_multiplanar(self.buffer_manager.type)
+
     def open(self) -> None:
         if self.buffers is None:
             self.device.log.info("Reserving buffers...")
             fd = self.device.fileno()
             buffers = self.buffer_manager.create_buffers(Memory.MMAP)
-            self.buffers = [mmap_from_buffer(fd, buff) for buff in buffers]
+            if self.multiplanar:
+                self.buffers = [mmap_planes_from_buffer(fd, buff) for buff in buffers]
+                self.plane_sizes = get_plane_sizes(fd, self.buffer_manager.type, self.buffers[0])
+            else:
+                self.buffers = [mmap_from_buffer(fd, buff) for buff in buffers]
             self.buffer_manager.enqueue_buffers(Memory.MMAP)
             self.format = self.buffer_manager.get_format()
             self.buffer_manager.device.log.info("Buffers reserved")
@@ -1453,10 +2764,26 @@ class MemoryMap(ReentrantOpen):
     def close(self) -> None:
         if self.buffers:
             self.device.log.info("Freeing buffers...")
-            for mem in self.buffers:
-                mem.close()
+            buffers, self.buffers = self.buffers, None
+            self.free = []
+            self.acquired = set()
+            self.plane_sizes = None
+            # frames still leased must drop their views before unmapping
+            for frame in list(self.leases):
+                frame._detach(self.device.log)
+            if self.exported:
+                for fd in self.exported:
+                    os.close(fd)
+                self.exported = None
+            for mem in buffers:
+                for plane in mem if self.multiplanar else (mem,):
+                    try:
+                        plane.close()
+                    except BufferError:
+                        # still exported: unmapped when the last view is gone.
+                        # REQBUFS(0) orphans it so the driver doesn't reuse it
+                        self.device.log.warning("buffer memory still referenced while freeing buffers")
             self.buffer_manager.free_buffers(Memory.MMAP)
-            self.buffers = None
             self.format = None
             self.device.log.info("Buffers freed")
 
@@ -1464,7 +2791,55 @@ class MemoryMap(ReentrantOpen):
         with self.queue as buff:
             return self.buffers[buff.index][: buff.bytesused], buff
 
+    def export_buffers(self) -> list[int]:
+        """
+        Export all buffers as DMABUF file descriptors (one per buffer index,
+        first plane only for multi-planar buffers) so that they can be
+        imported by another device. The descriptors are closed when this
+        object is closed.
+        """
+        if self.exported is None:
+            self.exported = [self.buffer_manager.export_buffer(index) for index in range(len(self.buffers))]
+        return self.exported
+
+    def raw_grab_planes(self) -> tuple[list[bytes], raw.v4l2_buffer]:
+        with self.queue as buff:
+            mems = self.buffers[buff.index]
+            planes = [mem[plane.data_offset : plane.bytesused] for mem, plane in zip(mems, buffer_planes(buff))]
+            return planes, buff
+
+    def raw_lease(self) -> tuple[list[memoryview], raw.v4l2_buffer]:
+        """
+        Dequeue a buffer without giving it back and return a view of each
+        plane. Use `requeue` when done with it
+        """
+        buff = self.buffer_manager.dequeue_buffer(Memory.MMAP)
+        if self.multiplanar:
+            mems = self.buffers[buff.index]
+            views = [
+                lease_view(mem, plane.bytesused - plane.data_offset, plane.data_offset)
+                for mem, plane in zip(mems, buffer_planes(buff))
+            ]
+        else:
+            views = [lease_view(self.buffers[buff.index], buff.bytesused)]
+        return views, buff
+
+    def requeue(self, buff: raw.v4l2_buffer) -> None:
+        if self.buffers is None:
+            # buffers have been freed in the meantime
+            return
+        enqueue_buffer_raw(self.device.fileno(), copy_buffer(buff))
+
     def raw_read(self) -> Frame:
+        if self.lease:
+            planes, buff = self.raw_lease()
+            data = None if self.multiplanar else planes[0]
+            frame = LeasedFrame(data, buff, self.format, self.requeue, planes)
+            self.leases.add(frame)
+            return frame
+        if self.multiplanar:
+            planes, buff = self.raw_grab_planes()
+            return Frame(b"".join(planes), buff, self.format, planes)
         data, buff = self.raw_grab()
         return Frame(data, buff, self.format)
 
@@ -1485,19 +2860,77 @@ class MemoryMap(ReentrantOpen):
         return self.read()
 
     def raw_write(self, data: Buffer) -> raw.v4l2_buffer:
-        with self.queue as buff:
-            size = getattr(data, "nbytes", len(data))
-            memory = self.buffers[buff.index]
-            memory[:size] = data
-            buff.bytesused = size
+        if self.multiplanar:
+            size = check_data_size(data, sum(self.plane_sizes))
+        else:
+            size = check_data_size(data, len(self.buffers[0]))
+        # buffers released without commit are used before dequeuing another one
+        buff = self.free.pop() if self.free else self.buffer_manager.dequeue_buffer(Memory.MMAP)
+        try:
+            if self.multiplanar:
+                # data is split over the planes in order
+                write_planes(data, self.buffers[buff.index], buffer_planes(buff), self.plane_sizes)
+            else:
+                memory = self.buffers[buff.index]
+                memory[:size] = data
+                buff.bytesused = size
+        finally:
+            enqueue_buffer_raw(self.device.fileno(), stamp_buffer(copy_buffer(buff)))
         return buff
 
     def wait_write(self, data: Buffer) -> raw.v4l2_buffer:
         device = self.device
-        if device.io.select is not None:
+        if not self.free and device.io.select is not None:
             _, r, _ = device.io.select((), (device,), ())
         return self.raw_write(data)
 
+    @property
+    def in_flight(self) -> int:
+        """Number of output buffers queued to the driver"""
+        if self.buffers is None:
+            return 0
+        return len(self.buffers) - len(self.free) - len(self.acquired)
+
+    def reclaim(self) -> None:
+        """Dequeue, without waiting, the output buffers the driver is done with"""
+        if self.device.is_blocking:
+            return
+        while self.in_flight:
+            try:
+                self.free.append(self.buffer_manager.dequeue_buffer(Memory.MMAP))
+            except BlockingIOError:
+                break
+
+    def raw_acquire(self) -> WritableFrame:
+        """Like `acquire` but raises BlockingIOError instead of waiting for a free buffer"""
+        buff = self.free.pop() if self.free else self.buffer_manager.dequeue_buffer(Memory.MMAP)
+        self.acquired.add(buff.index)
+        if self.multiplanar:
+            mems = self.buffers[buff.index]
+            data, planes = None, [lease_view(mem, size) for mem, size in zip(mems, self.plane_sizes)]
+        else:
+            mem = self.buffers[buff.index]
+            data, planes = lease_view(mem, len(mem)), None
+        frame = WritableFrame(data, buff, self.format, self._discard, self._commit, planes)
+        self.leases.add(frame)
+        return frame
+
+    def acquire(self) -> WritableFrame:
+        """Free output buffer to fill in place (see `VideoOutput.acquire`)"""
+        device = self.device
+        if not self.free and not device.is_blocking and device.io.select is not None:
+            device.io.select((), (device,), ())
+        return self.raw_acquire()
+
+    def _discard(self, buff: raw.v4l2_buffer) -> None:
+        self.acquired.discard(buff.index)
+        if self.buffers is not None:
+            self.free.append(buff)
+
+    def _commit(self, buff: raw.v4l2_buffer) -> None:
+        self.acquired.discard(buff.index)
+        self.requeue(buff)
+
     def write(self, data: Buffer) -> raw.v4l2_buffer:
         # first time we check what mode device was opened (blocking vs non-blocking)
         # if file was opened with O_NONBLOCK: DQBUF will not block until a buffer
@@ -1509,6 +2942,479 @@ class MemoryMap(ReentrantOpen):
         return self.write(data)
 
 
+class PoolBuffers(ReentrantOpen):
+    """
+    Base for buffers backed by caller owned memory. Queue slot *index* is
+    always bound to `pool[index]`.
+
+    Subclasses set `memory_type` and implement `_prepare` and `memory`.
+    """
+
+    memory_type = None
+
+    def __init__(self, buffer_manager: BufferManager, pool: Sequence, lease: bool = False):
+        super().__init__()
+        if not pool:
+            raise V4L2Error(f"{self.memory_type.name} needs a non empty pool")
+        if is_multiplanar(buffer_manager.type):
+            raise V4L2Error(f"{self.memory_type.name} does not support multi-planar buffers")
+        self.buffer_manager = buffer_manager
+        self.pool = list(pool)
+        self.frame_reader = FrameReader(self.device, self.raw_read)
+        self.format = None
+        self.lease = lease
+        self.leases = weakref.WeakSet()
+        self.pending = None
+        self.acquired = set()
+
+    def __iter__(self) -> Iterator[Frame]:
+        with self.frame_reader:
+            while True:
+                yield self.frame_reader.read()
+
+    async def __aiter__(self) -> AsyncIterator[Frame]:
+        async with self.frame_reader:
+            while True:
+                yield await self.frame_reader.aread()
+
+    @property
+    def device(self) -> Device:
+        return self.buffer_manager.device
+
+    @property
+    def is_capture(self) -> bool:
+        return self.buffer_manager.type in CAPTURE_BUFFER_TYPES
+
+    def open(self) -> None:
+        if self.pending is None:
+            name = self.memory_type.name
+            self.device.log.info("Importing %d %s buffers...", len(self.pool), name)
+            self.device.request_buffers(self.buffer_manager.type, self.memory_type, len(self.pool))
+            self.pending = {}
+            self.format = self.buffer_manager.get_format()
+            if self.is_capture:
+                for index in range(len(self.pool)):
+                    self.queue(index)
+            self.device.log.info("%s buffers imported", name)
+
+    def close(self) -> None:
+        if self.pending is not None:
+            name = self.memory_type.name
+            self.device.log.info("Releasing %s buffers...", name)
+            self.pending = None
+            for frame in list(self.leases):
+                frame._detach(self.device.log)
+            self.acquired.clear()
+            self._release_memory()
+            self.buffer_manager.free_buffers(self.memory_type)
+            self.format = None
+            self.device.log.info("%s buffers released", name)
+
+    def _release_memory(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def _prepare(self, buff: raw.v4l2_buffer) -> None:
+        """Point *buff* to the memory of its slot before it is queued"""
+
+    @abc.abstractmethod
+    def memory(self, index: int) -> Buffer:
+        """Writable CPU view of the memory in the given slot"""
+
+    def queue(
+        self,
+        index: int,
+        size: int = 0,
+        on_done: Optional[Callable[[], None]] = None,
+        timestamp: Optional[timeval] = None,
+    ) -> raw.v4l2_buffer:
+        buff = raw.v4l2_buffer()
+        buff.type = self.buffer_manager.type
+        buff.memory = self.memory_type
+        buff.index = index
+        buff.bytesused = size
+        buff.field = Field.NONE
+        if not self.is_capture:
+            stamp_buffer(buff, timestamp)
+        self._prepare(buff)
+        enqueue_buffer_raw(self.device.fileno(), buff)
+        self.pending[index] = on_done
+        return buff
+
+    def requeue(self, buff: raw.v4l2_buffer) -> None:
+        if self.pending is None:
+            # buffers have been released in the meantime
+            return
+        self.queue(buff.index)
+
+    def dequeue(self) -> raw.v4l2_buffer:
+        buff = self.buffer_manager.dequeue_buffer(self.memory_type)
+        on_done = self.pending.pop(buff.index, None)
+        if on_done is not None:
+            on_done()
+        return buff
+
+    def reclaim(self, index: Optional[int] = None) -> None:
+        """
+        Dequeue buffers the device is done with. If *index* is given,
+        wait until that slot is free
+        """
+        device = self.device
+        blocking = device.is_blocking
+        while self.pending:
+            if index is not None and index not in self.pending:
+                break
+            if index is None and blocking:
+                # a blocking DQBUF would stall with nothing to wait for
+                break
+            try:
+                self.dequeue()
+            except BlockingIOError:
+                if index is None:
+                    break
+                if self.is_capture:
+                    device.io.select((device,), (), ())
+                else:
+                    device.io.select((), (device,), ())
+
+    def free_index(self) -> int:
+        """Index of a slot which is not queued (reclaiming one if needed)"""
+        self.reclaim()
+        for index in range(len(self.pool)):
+            if index not in self.pending and index not in self.acquired:
+                return index
+        if not self.pending:
+            raise V4L2Error("all buffers are acquired")
+        self.reclaim(next(iter(self.pending)))
+        return self.free_index()
+
+    def raw_read(self) -> Frame:
+        buff = self.dequeue()
+        if self.lease:
+            data = lease_view(self.memory(buff.index), buff.bytesused)
+            frame = LeasedFrame(data, buff, self.format, self.requeue)
+            self.leases.add(frame)
+            return frame
+        try:
+            data = self.memory(buff.index)[: buff.bytesused]
+            return Frame(bytes(data), buff, self.format)
+        finally:
+            self.requeue(buff)
+
+    def read(self) -> Frame:
+        return self.frame_reader.read()
+
+    def write_buffer(self, index: int, size: int, on_done: Optional[Callable[[], None]] = None) -> raw.v4l2_buffer:
+        """
+        Queue slot *index* with *size* bytes without copying. *on_done* is
+        called once the device is done with the buffer
+        """
+        self.reclaim(index)
+        return self.queue(index, size, on_done)
+
+    def write(self, data: Buffer) -> raw.v4l2_buffer:
+        index = self.free_index()
+        size = getattr(data, "nbytes", len(data))
+        memoryview(self.memory(index))[:size] = data
+        return self.queue(index, size)
+
+    @property
+    def in_flight(self) -> int:
+        """Number of buffers queued to the driver"""
+        return len(self.pending) if self.pending else 0
+
+    def raw_acquire(self) -> WritableFrame:
+        """Like `acquire` but raises BlockingIOError instead of waiting for a free slot"""
+        self.reclaim()
+        for index in range(len(self.pool)):
+            if index not in self.pending and index not in self.acquired:
+                return self._acquire(index)
+        raise BlockingIOError(errno.EAGAIN, "no free buffer")
+
+    def acquire(self) -> WritableFrame:
+        """Free output slot to fill in place (see `VideoOutput.acquire`)"""
+        return self._acquire(self.free_index())
+
+    def _acquire(self, index: int) -> WritableFrame:
+        self.acquired.add(index)
+        buff = raw.v4l2_buffer()
+        buff.type = self.buffer_manager.type
+        buff.memory = self.memory_type
+        buff.index = index
+        memory = self.memory(index)
+        data = lease_view(memory, len(memory))
+        frame = WritableFrame(data, buff, self.format, self._discard, self._commit)
+        self.leases.add(frame)
+        return frame
+
+    def _discard(self, buff: raw.v4l2_buffer) -> None:
+        self.acquired.discard(buff.index)
+
+    def _commit(self, buff: raw.v4l2_buffer) -> None:
+        self.acquired.discard(buff.index)
+        if self.pending is not None:
+            self.queue(buff.index, buff.bytesused, timestamp=buff.timestamp)
+
+
+class DmaBuf(PoolBuffers):
+    """
+    Buffers backed by externally allocated DMABUF file descriptors.
+
+    When the descriptors come from `MemoryMap.export_buffers()`, a captured
+    frame can be handed to an output device without copying it with
+    `write_buffer(frame.index, frame.nbytes, frame.release)`.
+    """
+
+    memory_type = Memory.DMABUF
+
+    def __init__(self, buffer_manager: BufferManager, fds: Sequence[int], lease: bool = False):
+        super().__init__(buffer_manager, fds, lease=lease)
+        self.maps = len(self.pool) * [None]
+
+    @property
+    def fds(self) -> list[int]:
+        return self.pool
+
+    def _release_memory(self) -> None:
+        maps, self.maps = self.maps, len(self.pool) * [None]
+        for mem in maps:
+            if mem is not None:
+                try:
+                    mem.close()
+                except BufferError:
+                    # still exported: unmapped when the last view is gone
+                    self.device.log.warning("DMABUF memory still referenced while releasing buffers")
+
+    def _prepare(self, buff: raw.v4l2_buffer) -> None:
+        buff.m.fd = self.pool[buff.index]
+
+    def memory(self, index: int) -> mmap.mmap:
+        """CPU mapping of the DMABUF in the given slot (mapped on first use)"""
+        mem = self.maps[index]
+        if mem is None:
+            fd = self.pool[index]
+            mem = self.maps[index] = mem_map(fd, os.lseek(fd, 0, os.SEEK_END), 0)
+        return mem
+
+
+class UserPtr(PoolBuffers):
+    """
+    Buffers backed by caller owned memory (bytearray, numpy array, mmap...)
+    so that the driver writes frames directly into it.
+
+    Frames are always leased: `frame.data` is a view of `pool[frame.index]`
+    which is given back to the driver when the frame is released.
+    """
+
+    memory_type = Memory.USERPTR
+
+    def __init__(self, buffer_manager: BufferManager, pool: Sequence[Buffer]):
+        super().__init__(buffer_manager, pool, lease=True)
+        self.views = [memoryview(item).cast("B") for item in self.pool]
+        for view in self.views:
+            if view.readonly:
+                raise V4L2Error("USERPTR memory must be writable")
+        self._pinned = None
+
+    def _release_memory(self) -> None:
+        self._pinned = None
+
+    def _prepare(self, buff: raw.v4l2_buffer) -> None:
+        if self._pinned is None:
+            self._pinned = [(ctypes.c_char * view.nbytes).from_buffer(view) for view in self.views]
+        buff.m.userptr = ctypes.addressof(self._pinned[buff.index])
+        buff.length = self.views[buff.index].nbytes
+
+    def memory(self, index: int) -> memoryview:
+        return self.views[index]
+
+
+class MediaDevice(BaseDevice):
+    """
+    Media controller device (ex: /dev/media0).
+    Only used to allocate requests for now.
+    """
+
+    PREFIX = "/dev/media"
+
+    def allocate_request(self) -> int:
+        return allocate_request(self.fileno())
+
+    def request(self, device: Device) -> "MediaRequest":
+        return MediaRequest(self, device)
+
+
+class MediaRequest(ReentrantOpen):
+    """
+    A media request binds control values and buffers of a video device
+    together. The driver applies them atomically, in the same frame, when
+    the request is submitted.
+
+    ```python
+    with MediaDevice("/dev/media0") as media, Device("/dev/video0") as camera:
+        with media.request(camera) as request:
+            request.set_controls({"exposure_time_absolute": 100})
+            request.queue_buffer(buff)
+            request.submit()
+            request.wait()
+    ```
+
+    Once completed, a request can be reused for another frame after `reinit()`.
+    """
+
+    def __init__(self, media: MediaDevice, device: Device):
+        super().__init__()
+        self.media = media
+        self.device = device
+        self.fd = None
+        self.submitted = False
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def open(self) -> None:
+        if self.fd is None:
+            self.fd = self.media.allocate_request()
+
+    def close(self) -> None:
+        if self.fd is not None:
+            fd, self.fd = self.fd, None
+            self.submitted = False
+            os.close(fd)
+
+    def set_controls(self, values: dict) -> dict:
+        """Store control values in the request. See `Controls.set_values`"""
+        return self.device.controls.set_values(values, request=self)
+
+    def get_controls(self, *keys) -> dict:
+        """Control values applied by the completed request"""
+        return self.device.controls.get_values(*keys, request=self)
+
+    def queue_buffer(self, buff: raw.v4l2_buffer) -> raw.v4l2_buffer:
+        """Queue a buffer which is only handed to the driver when the request is submitted"""
+        buff.flags |= BufferFlag.REQUEST_FD
+        buff.request_fd = self.fd
+        return enqueue_buffer_raw(self.device.fileno(), buff)
+
+    def submit(self) -> None:
+        queue_request(self.fd)
+        self.submitted = True
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the request to complete. Returns False on timeout"""
+        _, _, completed = self.device.io.select((), (), (self,), timeout)
+        return bool(completed)
+
+    def reinit(self) -> None:
+        """Clear the request so it can be used again"""
+        reinit_request(self.fd)
+        self.submitted = False
+
+
+class ControlCache(ReentrantOpen):
+    """
+    Keeps control values, ranges and flags up to date from control events
+    so reading a control value is served from memory instead of an ioctl.
+
+    ```python
+    with ControlCache(device):
+        device.controls.brightness.value  # no G_CTRL
+    ```
+
+    Pending events are applied on every cached read (an idle device costs a
+    single poll, no ioctl) or continuously with `watch()` in asyncio code.
+    String, array, compound and volatile controls are not cached.
+
+    The device has a single event queue: other events dequeued by the cache
+    are kept (up to *max_events*) until `take_events()` is called. The
+    `EventReader` and `M2MSession` take them before reading the queue.
+    """
+
+    def __init__(self, device: Device, max_events: int = 100):
+        super().__init__()
+        self.device = device
+        self.values = {}
+        self.events = 0
+        self.other_events = collections.deque(maxlen=max_events)
+        self._subscribed = []
+
+    def open(self) -> None:
+        flags = EVENT_SUB_SEND_INITIAL | EVENT_SUB_ALLOW_FEEDBACK
+        for ctrl in self.device.controls.values():
+            if not isinstance(ctrl, BaseMonoControl) or has_payload(ctrl._info):
+                continue
+            # volatile controls don't send value change events
+            if ctrl.is_flagged_write_only or ctrl.is_flagged_volatile:
+                continue
+            self.device.subscribe_event(EventType.CTRL, ctrl.id, flags)
+            self._subscribed.append(ctrl.id)
+        self.device.control_cache = self
+        self.update()
+
+    def close(self) -> None:
+        self.device.control_cache = None
+        for id in self._subscribed:
+            with contextlib.suppress(OSError):
+                self.device.unsubscribe_event(EventType.CTRL, id)
+        self._subscribed = []
+        self.values.clear()
+        self.other_events.clear()
+
+    def value(self, id: int):
+        """Current raw value of the given control. Raises KeyError if not cached"""
+        self.update()
+        return self.values[id]
+
+    def update(self) -> int:
+        """Apply all pending events. Returns the number of events applied"""
+        count = 0
+        _, _, pending = self.device.io.select((), (), (self.device,), 0)
+        while pending:
+            try:
+                event = self.device.deque_event()
+            except OSError as error:
+                if error.errno == errno.ENOENT:
+                    break
+                raise
+            self.apply(event)
+            count += 1
+            pending = event.pending
+        return count
+
+    def take_events(self) -> list[raw.v4l2_event]:
+        """Non control events dequeued by the cache, oldest first"""
+        events = list(self.other_events)
+        self.other_events.clear()
+        return events
+
+    def apply(self, event: raw.v4l2_event) -> None:
+        if event.type != EventType.CTRL:
+            self.other_events.append(event)
+            return
+        ctrl = self.device.controls.get(event.id)
+        if ctrl is None:
+            return
+        self.events += 1
+        data = event.u.ctrl
+        changes = ControlChange(data.changes)
+        if ControlChange.VALUE in changes:
+            self.values[event.id] = data.value64 if data.type == ControlType.INTEGER64 else data.value
+        if ControlChange.FLAGS in changes:
+            ctrl._info.flags = data.flags
+        if ControlChange.RANGE in changes:
+            info = ctrl._info
+            info.minimum, info.maximum = data.minimum, data.maximum
+            info.step, info.default_value = data.step, data.default_value
+            if isinstance(ctrl, BaseNumericControl):
+                ctrl.minimum, ctrl.maximum, ctrl.step = data.minimum, data.maximum, data.step
+
+    async def watch(self) -> None:
+        """Apply events as soon as they arrive (runs until cancelled)"""
+        async with EventReader(self.device) as reader:
+            async for event in reader:
+                self.apply(event)
+
+
 class EventReader:
     def __init__(self, device: Device, max_queue_size=100):
         self.device = device
@@ -1560,7 +3466,14 @@ class EventReader:
             buffer.popleft()
         buffer.put_nowait(task)
 
+    def _cached_event(self):
+        cache = self.device.control_cache
+        if cache is not None and cache.other_events:
+            return cache.other_events.popleft()
+
     def read(self, timeout=None):
+        if (event := self._cached_event()) is not None:
+            return event
         if not self.device.is_blocking:
             _, _, exc = self.device.io.select((), (), (self.device,), timeout)
             if not exc:
@@ -1569,28 +3482,59 @@ class EventReader:
 
     async def aread(self):
         """Wait for next event or return last event in queue"""
+        if (event := self._cached_event()) is not None:
+            return event
         task = await self._buffer.get()
         return await task
 
 
 class FrameReader:
-    def __init__(self, device: Device, raw_read: Callable[[], Buffer], max_queue_size: int = 1):
+    """
+    Reads frames from the device either synchronously or through the asyncio
+    event loop.
+
+    In async mode, *drop_policy* decides what happens when more than
+    *max_queue_size* frames are waiting for the consumer. With
+    `DropPolicy.BLOCK` frames are not dequeued while the consumer is behind
+    so they are dropped by the driver instead.
+
+    `stats` reports frames read, frames dropped by this reader and frames
+    lost before reaching it (gaps in the buffer sequence number). `lag`
+    reports how far behind the consumer is: frames waiting in the reader and
+    the age of the frames when handed to it (measured from the capture
+    timestamp when the driver uses CLOCK_MONOTONIC, from the dequeue
+    otherwise).
+    """
+
+    def __init__(
+        self,
+        device: Device,
+        raw_read: Callable[[], Buffer],
+        max_queue_size: int = 1,
+        drop_policy: DropPolicy = DropPolicy.DROP_OLDEST,
+    ):
         self.device = device
         self.raw_read = raw_read
+        self.max_queue_size = max_queue_size
+        self.drop_policy = drop_policy
         self._loop = None
         self._selector = None
         self._buffer = None
-        self._max_queue_size = max_queue_size
+        self._waiter = None
         self._device_fd = None
+        self._paused = False
+        self.reset_stats()
 
     async def __aenter__(self) -> Self:
         if self.device.is_blocking:
             raise V4L2Error("Cannot use async frame reader on blocking device")
         self._device_fd = self.device.fileno()
-        self._buffer = asyncio.Queue(maxsize=self._max_queue_size)
+        # (dequeue time, frame or error) waiting for the consumer
+        self._buffer = collections.deque()
         self._selector = select.epoll()
         self._loop = asyncio.get_event_loop()
         self._loop.add_reader(self._selector.fileno(), self._on_event)
+        self._paused = False
         self._selector.register(self._device_fd, select.POLLIN)
         return self
 
@@ -1598,11 +3542,18 @@ class FrameReader:
         with contextlib.suppress(OSError):
             # device may have been closed by now
             self._selector.unregister(self._device_fd)
-        self._loop.remove_reader(self._selector.fileno())
+        if not self._paused:
+            self._loop.remove_reader(self._selector.fileno())
         self._selector.close()
+        # give leased buffers still waiting back to the driver
+        for _, frame in self._buffer:
+            release = getattr(frame, "release", None)
+            if release is not None:
+                release()
         self._selector = None
         self._loop = None
         self._buffer = None
+        self._waiter = None
 
     def __enter__(self) -> Self:
         return self
@@ -1610,32 +3561,196 @@ class FrameReader:
     def __exit__(self, exc_type, exc_value, tb):
         pass
 
+    @property
+    def stats(self) -> FrameStats:
+        return FrameStats(self._frames, self._dropped, self._lost)
+
+    @property
+    def lag(self) -> LagStats:
+        queued = 0 if self._buffer is None else len(self._buffer)
+        return LagStats(queued, self._delay, self._max_delay)
+
+    def reset_stats(self) -> None:
+        self._frames = 0
+        self._dropped = 0
+        self._lost = 0
+        self._last_sequence = None
+        self._delay = 0.0
+        self._max_delay = 0.0
+
+    def _track(self, frame: Frame) -> Frame:
+        if frame is None:
+            return frame
+        self._frames += 1
+        sequence = frame.frame_nb
+        last = self._last_sequence
+        if last is not None and sequence > last + 1:
+            self._lost += sequence - last - 1
+        self._last_sequence = sequence
+        return frame
+
+    def _deliver(self, frame: Frame, dequeued: float) -> Frame:
+        now = time.monotonic()
+        buff = frame.buff
+        if buff.flags & BufferFlag.TIMESTAMP_MASK == BufferFlag.TIMESTAMP_MONOTONIC:
+            dequeued = buff.timestamp.secs + buff.timestamp.usecs * 1e-6
+        self._delay = delay = now - dequeued
+        if delay > self._max_delay:
+            self._max_delay = delay
+        return frame
+
+    def _drop(self, frame) -> None:
+        self._dropped += 1
+        if self.drop_policy != DropPolicy.LATEST:
+            self.device.log.warning("missed frame")
+        # give leased buffers back right away
+        release = getattr(frame, "release", None)
+        if release is not None:
+            release()
+
+    def _pause(self) -> None:
+        if not self._paused:
+            self._loop.remove_reader(self._selector.fileno())
+            self._paused = True
+
+    def _resume(self) -> None:
+        if self._paused:
+            self._loop.add_reader(self._selector.fileno(), self._on_event)
+            self._paused = False
+
     def _on_event(self) -> None:
-        task = self._loop.create_future()
+        now = time.monotonic()
         try:
             self._selector.poll(0)  # avoid blocking
-            data = self.raw_read()
-            task.set_result(data)
+            item = self._track(self.raw_read())
+        except BlockingIOError:
+            return  # spurious wake up: no buffer ready after all
         except Exception as error:
-            task.set_exception(error)
+            item = error
 
         buffer = self._buffer
-        if buffer.full():
-            self.device.log.warn("missed frame")
-            buffer.get_nowait()
-        buffer.put_nowait(task)
+        policy = self.drop_policy
+        if isinstance(item, Exception):
+            pass  # errors are never dropped
+        elif policy == DropPolicy.LATEST:
+            while buffer and not isinstance(buffer[0][1], Exception):
+                self._drop(buffer.popleft()[1])
+        elif len(buffer) >= self.max_queue_size:
+            if policy == DropPolicy.DROP_NEWEST:
+                self._drop(item)
+                return
+            self._drop(buffer.popleft()[1])
+        buffer.append((now, item))
+        if policy == DropPolicy.BLOCK and len(buffer) >= self.max_queue_size:
+            self._pause()
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
 
     def read(self, timeout: Optional[float] = None) -> Frame:
         if not self.device.is_blocking:
             read, _, _ = self.device.io.select((self.device,), (), (), timeout)
             if not read:
                 return
-        return self.raw_read()
+        now = time.monotonic()
+        return self._deliver(self._track(self.raw_read()), now)
 
     async def aread(self) -> Frame:
         """Wait for next frame or return last frame"""
-        task = await self._buffer.get()
-        return await task
+        buffer = self._buffer
+        while not buffer:
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        dequeued, item = buffer.popleft()
+        self._resume()
+        if isinstance(item, Exception):
+            raise item
+        return self._deliver(item, dequeued)
+
+
+class FrameWriter:
+    """
+    Writes frames to a `VideoOutput` through the asyncio event loop.
+
+    All the output buffers (`VideoOutput(device, size=N)`) can be in flight
+    at once: `write` only waits, without blocking the event loop, when none
+    is free, which gives natural backpressure. `drain` waits until the
+    driver is done with every buffer.
+
+    ```python
+    async with FrameWriter(output) as writer:
+        async for frame in capture:
+            await writer.write(frame.data)
+    ```
+
+    Only memory map, DMABUF and USERPTR outputs on a non-blocking device are
+    supported.
+    """
+
+    def __init__(self, output: "VideoOutput"):
+        self.output = output
+        self.frames = 0
+        self.waits = 0
+        self._loop = None
+
+    async def __aenter__(self) -> Self:
+        if self.output.device.is_blocking:
+            raise V4L2Error("Cannot use async frame writer on blocking device")
+        if getattr(self.output.buffer, "raw_acquire", None) is None:
+            raise V4L2Error(f"{type(self.output.buffer).__name__} output cannot be written asynchronously")
+        self._loop = asyncio.get_running_loop()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.drain()
+        self._loop = None
+
+    @property
+    def in_flight(self) -> int:
+        """Number of buffers queued to the driver"""
+        return self.output.buffer.in_flight
+
+    async def _writable(self) -> None:
+        self.waits += 1
+        ready = self._loop.create_future()
+        fd = self.output.device.fileno()
+        self._loop.add_writer(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            self._loop.remove_writer(fd)
+
+    async def acquire(self) -> WritableFrame:
+        """Wait for a free output buffer to fill in place (see `VideoOutput.acquire`)"""
+        while True:
+            try:
+                return self.output.buffer.raw_acquire()
+            except BlockingIOError:
+                await self._writable()
+
+    async def write(self, data: Buffer) -> None:
+        """Copy *data* to the next free buffer (split over the planes in order) and queue it"""
+        frame = await self.acquire()
+        try:
+            size = frame.fill(data)
+        except BaseException:
+            frame.release()
+            raise
+        frame.commit(size)
+        self.frames += 1
+
+    async def drain(self) -> None:
+        """Wait until the driver is done with all queued buffers"""
+        buffer = self.output.buffer
+        while True:
+            buffer.reclaim()
+            if not buffer.in_flight:
+                return
+            await self._writable()
 
 
 class BufferQueue:
@@ -1652,8 +3767,7 @@ class BufferQueue:
     def __exit__(self, *exc):
         # Make a copy of buffer. We need the original buffer that was sent to
         # dequeue in to keep frame info like frame number, timestamp, etc
-        raw_buffer = raw.v4l2_buffer()
-        memcpy(raw_buffer, self.raw_buffer)
+        raw_buffer = copy_buffer(self.raw_buffer)
         enqueue_buffer_raw(self.buffer_manager.device.fileno(), raw_buffer)
 
 
@@ -1695,10 +3809,31 @@ class Write(ReentrantOpen):
 
 
 class VideoOutput(BufferManager):
-    def __init__(self, device: Device, size: int = 2, sink: Capability = None):
-        super().__init__(device, BufferType.VIDEO_OUTPUT, size)
+    """
+    Video output helper.
+
+    *sink* selects how frames are transferred: `Capability.STREAMING`
+    (memory map), `Capability.READWRITE` (write), `Memory.DMABUF` in which
+    case *pool* must be a sequence of DMABUF file descriptors to import
+    (ex: the ones exported by a capture `MemoryMap`) or `Memory.USERPTR` in
+    which case *pool* must be a sequence of writable buffers.
+    If not given, memory map is used if available with a fallback to write.
+
+    Use `buffer_type=BufferType.VIDEO_OUTPUT_MPLANE` for multi-planar devices.
+    """
+
+    def __init__(
+        self,
+        device: Device,
+        size: int = 2,
+        sink: Union[Capability, Memory, None] = None,
+        pool: Optional[Sequence] = None,
+        buffer_type: BufferType = BufferType.VIDEO_OUTPUT,
+    ):
+        super().__init__(device, buffer_type, size)
         self.buffer = None
         self.sink = sink
+        self.pool = pool
 
     def __enter__(self) -> Self:
         self.open()
@@ -1717,7 +3852,13 @@ class VideoOutput(BufferManager):
         # if Capability.VIDEO_OUTPUT not in capabilities:
         #    raise V4L2Error("device lacks VIDEO_OUTPUT capability")
         sink = capabilities if self.sink is None else self.sink
-        if Capability.STREAMING in sink:
+        if sink is Memory.DMABUF:
+            self.device.log.info("Video output using DMABUF")
+            self.buffer = DmaBuf(self, self.pool)
+        elif sink is Memory.USERPTR:
+            self.device.log.info("Video output using user pointers")
+            self.buffer = UserPtr(self, self.pool)
+        elif Capability.STREAMING in sink:
             self.device.log.info("Video output using memory map")
             self.buffer = MemoryMap(self)
         elif Capability.READWRITE in sink:
@@ -1746,6 +3887,412 @@ class VideoOutput(BufferManager):
     def write(self, data: Buffer) -> None:
         self.buffer.write(data)
 
+    def acquire(self) -> WritableFrame:
+        """
+        Free output buffer to fill in place instead of building the image
+        elsewhere and copying it with `write`. The buffer is queued when
+        committed (at the end of the `with` statement):
+
+        ```python
+        with output.acquire() as frame:
+            render(frame.array)
+        ```
+
+        Only memory map, DMABUF and USERPTR outputs support it.
+        """
+        acquire = getattr(self.buffer, "acquire", None)
+        if acquire is None:
+            raise V4L2Error(f"{type(self.buffer).__name__} output cannot be filled in place")
+        return acquire()
+
+
+CLOCK_MONOTONIC = 1
+TIMER_ABSTIME = 1
+
+
+def sleep_until(deadline: int) -> None:
+    """
+    Sleep until *deadline* (CLOCK_MONOTONIC nanoseconds, as given by
+    `time.monotonic_ns()`). Sleeping to an absolute time doesn't accumulate
+    drift like consecutive relative sleeps do
+    """
+    when = timespec(*divmod(deadline, 1_000_000_000))
+    while True:
+        # returns the error number instead of setting errno
+        result = c.clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, byref(when), None)
+        if result != errno.EINTR:
+            break
+    if result:
+        raise OSError(result, os.strerror(result))
+
+
+class PacedOutput:
+    """
+    Writes frames to a `VideoOutput` at a fixed frame rate.
+
+    Frames are scheduled against CLOCK_MONOTONIC at absolute deadlines
+    (start + n / fps) so timing errors don't add up, and each buffer is
+    stamped with its deadline. When the caller falls behind by more than a
+    frame, the missed slots are skipped instead of bursting frames to catch
+    up.
+
+    ```python
+    with VideoOutput(device) as output:
+        paced = PacedOutput(output, fps=30)
+        for image in images:
+            paced.write(image)
+        print(paced.stats)
+    ```
+
+    If *fps* is not given, the output frame rate is used. Only outputs
+    which can be filled in place (memory map, DMABUF and USERPTR) are
+    supported: read/write outputs have no buffer to stamp.
+    """
+
+    def __init__(self, output: VideoOutput, fps: Optional[float] = None):
+        self.output = output
+        self.fps = fps
+        self.reset()
+
+    @property
+    def stats(self) -> PacingStats:
+        jitter = self._jitter / self._frames if self._frames else 0.0
+        return PacingStats(self._frames, self._late, self._skipped, jitter * 1e-9, self._max_jitter * 1e-9)
+
+    def reset(self) -> None:
+        """Restart the schedule (the next frame is written right away) and the stats"""
+        self._start = None
+        self._slot = 0
+        self._frames = 0
+        self._late = 0
+        self._skipped = 0
+        self._jitter = 0
+        self._max_jitter = 0
+
+    def write(self, data: Buffer) -> None:
+        """Write *data* at its scheduled time (blocks until then)"""
+        if self._start is None:
+            fps = self.fps or float(self.output.get_fps())
+            self._period = round(1_000_000_000 / fps)
+            self._start = time.monotonic_ns()
+        deadline = self._start + self._slot * self._period
+        # copy ahead of time so only QBUF happens at the deadline
+        frame = self.output.acquire()
+        try:
+            size = frame.fill(data)
+        except BaseException:
+            frame.release()
+            raise
+        sleep_until(deadline)
+        stamp = timeval()
+        stamp.set_ns(deadline)
+        frame.commit(size, stamp)
+        now = time.monotonic_ns()
+        error = now - deadline
+        self._frames += 1
+        self._jitter += error
+        self._max_jitter = max(self._max_jitter, error)
+        self._slot += 1
+        if error > self._period // 2:
+            self._late += 1
+            # resume at the next slot still ahead instead of catching up
+            slot = (now - self._start) // self._period + 1
+            self._skipped += slot - self._slot
+            self._slot = slot
+
+
+class M2MSession(ReentrantOpen):
+    """
+    Memory to memory (codec, scaler, converter) session.
+
+    Data is written to the OUTPUT queue (`source`) and the processed result
+    is read from the CAPTURE queue (`sink`) of the same device. Both queues
+    are kept full so the device can work on an input buffer while previous
+    results are being read.
+
+    ```python
+    with Device("/dev/video1") as device:
+        session = M2MSession(device)
+        session.source.set_format(640, 480, "YUYV")
+        session.sink.set_format(640, 480, "JPEG")
+        with session:
+            for frame in session.process(images):
+                ...
+    ```
+
+    Formats must be configured before the session is opened. When the input
+    is exhausted the device is drained (decoder or encoder STOP command,
+    or waiting for one result per input if the device has no such command)
+    and the remaining results are still returned. A source change (ex: a
+    decoder finding a new resolution in the stream) reallocates the
+    capture buffers.
+
+    The device must be opened in non-blocking mode (the default).
+    """
+
+    def __init__(self, device: Device, size: int = 4, multiplanar: bool = False):
+        super().__init__()
+        self.device = device
+        if multiplanar:
+            source_type, sink_type = BufferType.VIDEO_OUTPUT_MPLANE, BufferType.VIDEO_CAPTURE_MPLANE
+        else:
+            source_type, sink_type = BufferType.VIDEO_OUTPUT, BufferType.VIDEO_CAPTURE
+        self.source = BufferManager(device, source_type, size)
+        self.sink = BufferManager(device, sink_type, size)
+        self.buffer = None
+        self._inputs = None
+        self._plane_sizes = None
+        self._free = collections.deque()
+        self.queued = 0
+        self.processed = 0
+        self.source_changes = 0
+        self.source_changed = False
+        self.draining = False
+        self.done = False
+        self._stop_command = False
+        self._subscribed = []
+
+    def __iter__(self) -> Iterator[Frame]:
+        while (frame := self.read()) is not None:
+            yield frame
+
+    @property
+    def multiplanar(self) -> bool:
+        return is_multiplanar(self.source.type)
+
+    def open(self) -> None:
+        if self.buffer is not None:
+            return
+        device = self.device
+        if device.is_blocking:
+            raise V4L2Error("memory to memory session needs a non-blocking device")
+        if not (Capability.VIDEO_M2M | Capability.VIDEO_M2M_MPLANE) & device.info.capabilities:
+            raise V4L2Error("device lacks VIDEO_M2M capability")
+        device.log.info("Preparing memory to memory session...")
+        for event_type in (EventType.SOURCE_CHANGE, EventType.EOS):
+            try:
+                device.subscribe_event(event_type)
+            except OSError as error:
+                device.log.info("%s events not supported: %r", event_type.name, error)
+            else:
+                self._subscribed.append(event_type)
+        fd = device.fileno()
+        buffers = self.source.create_buffers(Memory.MMAP)
+        if self.multiplanar:
+            self._inputs = [mmap_planes_from_buffer(fd, buff) for buff in buffers]
+            self._plane_sizes = get_plane_sizes(fd, self.source.type, self._inputs[0])
+        else:
+            self._inputs = [[mmap_from_buffer(fd, buff)] for buff in buffers]
+        self._free = collections.deque(range(len(buffers)))
+        self.buffer = MemoryMap(self.sink)
+        self.buffer.open()
+        self.queued = self.processed = self.source_changes = 0
+        self.draining = self.done = self.source_changed = self._stop_command = False
+        self.source.stream_on()
+        self.sink.stream_on()
+        device.log.info("Memory to memory session started!")
+
+    def close(self) -> None:
+        if self.buffer is None:
+            return
+        device = self.device
+        device.log.info("Closing memory to memory session...")
+        for manager in (self.source, self.sink):
+            try:
+                manager.stream_off()
+            except OSError as error:
+                device.log.warning("Failed to stop %s stream: %r", manager.type.name, error)
+        buffer, self.buffer = self.buffer, None
+        buffer.close()
+        inputs, self._inputs = self._inputs, None
+        for planes in inputs:
+            for plane in planes:
+                plane.close()
+        self._free.clear()
+        self.source.free_buffers(Memory.MMAP)
+        for event_type in self._subscribed:
+            with contextlib.suppress(OSError):
+                device.unsubscribe_event(event_type)
+        self._subscribed = []
+        device.log.info("Memory to memory session closed")
+
+    def feed(self, data: Buffer) -> bool:
+        """
+        Queue data in a free input buffer (split over the planes in order for
+        multi-planar devices). Returns False if all input buffers are in use
+        """
+        if self.draining:
+            raise V4L2Error("cannot feed a draining session")
+        if self.multiplanar:
+            check_data_size(data, sum(self._plane_sizes))
+        else:
+            check_data_size(data, len(self._inputs[0][0]))
+        self._reclaim()
+        if not self._free:
+            return False
+        index = self._free.popleft()
+        buff = new_buffer(self.source.type, Memory.MMAP, index)
+        buff.field = Field.NONE
+        data = memoryview(data).cast("B")
+        if self.multiplanar:
+            write_planes(data, self._inputs[index], buffer_planes(buff), self._plane_sizes)
+            buff.length = len(self._inputs[index])
+        else:
+            memory = self._inputs[index][0]
+            memory[: len(data)] = data
+            buff.bytesused = len(data)
+        enqueue_buffer_raw(self.device.fileno(), stamp_buffer(buff))
+        self.queued += 1
+        return True
+
+    def drain(self) -> None:
+        """
+        Signal the end of the input. Results of the data already fed are
+        still returned by `read()`
+        """
+        if self.draining:
+            return
+        self.draining = True
+        commands = (
+            (self.device.decoder_command, DecoderCommand.STOP),
+            (self.device.encoder_command, EncoderCommand.STOP),
+        )
+        for command, stop in commands:
+            try:
+                command(stop)
+            except OSError as error:
+                if error.errno not in {errno.ENOTTY, errno.EINVAL}:
+                    raise
+            else:
+                self._stop_command = True
+                break
+        else:
+            self.device.log.info("device has no stop command: waiting for %d results", self.queued - self.processed)
+        self._check_drained()
+
+    def read(self, timeout: Optional[float] = None) -> Optional[Frame]:
+        """
+        Next processed frame. Returns None once the session is drained.
+        Raises TimeoutError if no frame is ready after *timeout* seconds
+        """
+        while not self.done:
+            frame = self._step(timeout)
+            if frame is not None:
+                return frame
+        return None
+
+    def process(self, inputs: Iterable[Buffer], timeout: Optional[float] = None) -> Iterator[Frame]:
+        """
+        Feed all *inputs* and yield the processed frames as they become
+        available. The session is drained when *inputs* is exhausted
+        """
+        inputs = iter(inputs)
+        pending = None
+        while not self.done:
+            while not self.draining:
+                if pending is None:
+                    pending = next(inputs, None)
+                    if pending is None:
+                        self.drain()
+                        break
+                if not self.feed(pending):
+                    break
+                pending = None
+            frame = self._step(timeout)
+            if frame is not None:
+                yield frame
+
+    def _check_drained(self) -> None:
+        if self.draining and not self._stop_command and self.processed >= self.queued:
+            self.done = True
+
+    def _step(self, timeout: Optional[float]) -> Optional[Frame]:
+        self._check_drained()
+        if self.done:
+            return None
+        device = self.device
+        readable, writable, exceptional = device.io.select((device,), (device,), (device,), timeout)
+        if not (readable or writable or exceptional):
+            raise TimeoutError("timeout waiting for memory to memory device")
+        if exceptional:
+            self._handle_events()
+        if writable:
+            self._reclaim()
+        if readable:
+            return self._dequeue()
+        return None
+
+    def _reclaim(self) -> None:
+        """Give back to the free list the input buffers the device is done with"""
+        while len(self._free) < len(self._inputs):
+            try:
+                buff = self.source.dequeue_buffer(Memory.MMAP)
+            except BlockingIOError:
+                break
+            self._free.append(buff.index)
+
+    def _dequeue(self) -> Optional[Frame]:
+        try:
+            frame = self.buffer.raw_read()
+        except BlockingIOError:
+            return None
+        except BrokenPipeError:
+            # last buffer has already been dequeued
+            self._on_last()
+            return None
+        last = BufferFlag.LAST in frame.flags
+        if frame.nbytes:
+            self.processed += 1
+        if last:
+            self._on_last()
+            if not frame.nbytes:
+                return None
+        self._check_drained()
+        return frame
+
+    def _on_last(self) -> None:
+        # A decoder also marks the last buffer before a source change. Capture
+        # buffers are only reallocated then so no decoded frame is lost
+        self._handle_events()
+        if self.source_changed:
+            self._source_change()
+        else:
+            self.done = True
+
+    def _handle_events(self) -> None:
+        # the queue is shared with the control cache: take the events it
+        # dequeued and hand it the control events
+        cache = self.device.control_cache
+        if cache is not None:
+            for event in cache.take_events():
+                self._handle_event(event)
+        while True:
+            try:
+                event = self.device.deque_event()
+            except OSError as error:
+                if error.errno == errno.ENOENT:
+                    break
+                raise
+            if event.type == EventType.CTRL and cache is not None:
+                cache.apply(event)
+            else:
+                self._handle_event(event)
+            if not event.pending:
+                break
+
+    def _handle_event(self, event: raw.v4l2_event) -> None:
+        if event.type == EventType.SOURCE_CHANGE:
+            self.source_changed = True
+
+    def _source_change(self) -> None:
+        self.device.log.info("Source changed: reallocating capture buffers...")
+        self.sink.stream_off()
+        self.buffer.close()
+        self.buffer.open()
+        self.sink.stream_on()
+        self.source_changed = False
+        self.source_changes += 1
+
 
 def iter_video_files(path: PathLike = "/dev") -> Iterable[Path]:
     """Returns an iterator over all video files"""
@@ -1793,4 +4340,158 @@ def iter_video_output_devices(path: PathLike = "/dev", **kwargs) -> Iterable[Dev
     return (Device(name, **kwargs) for name in iter_video_output_files(path))
 
 
+def _uvc_capabilities(node) -> Capability:
+    # each streaming interface has a video node (index 0) followed by a
+    # metadata node (linux >= 4.16)
+    kind = Capability.VIDEO_CAPTURE if node.index == 0 else Capability.META_CAPTURE
+    return kind | Capability.STREAMING
+
+
+def _m2m_capabilities(node) -> Capability:
+    return Capability.VIDEO_M2M_MPLANE | Capability.STREAMING
+
+
+RKISP1_NODES = {
+    "rkisp1_mainpath": Capability.VIDEO_CAPTURE_MPLANE,
+    "rkisp1_selfpath": Capability.VIDEO_CAPTURE_MPLANE,
+    "rkisp1_stats": Capability.META_CAPTURE,
+    "rkisp1_params": Capability.META_OUTPUT,
+}
+
+
+def _rkisp1_capabilities(node) -> Optional[Capability]:
+    kind = RKISP1_NODES.get(node.name)
+    return None if kind is None else kind | Capability.STREAMING
+
+
+# Drivers whose node capabilities can be told from sysfs alone (driver name:
+# function of the node returning its capabilities or None if unknown)
+SYSFS_CAPABILITIES = {
+    "uvcvideo": _uvc_capabilities,
+    "rkisp1": _rkisp1_capabilities,
+    **dict.fromkeys(
+        (
+            "bcm2835-codec",
+            "cedrus",
+            "coda",
+            "hantro-vpu",
+            "mtk-vcodec-dec",
+            "mtk-vcodec-enc",
+            "qcom-venus-decoder",
+            "qcom-venus-encoder",
+            "rkvdec",
+            "rockchip-rga",
+            "s5p-mfc",
+            "vicodec",
+            "vim2m",
+        ),
+        _m2m_capabilities,
+    ),
+}
+
+
+class VideoNode(sysfs.Device):
+    """
+    Lightweight descriptor of a video device node, read from sysfs
+    (`/sys/class/video4linux/video*`) without opening the device.
+
+    Only `capabilities` needs to open the node (a single QUERYCAP, done
+    once and cached). `sysfs_capabilities` is the sysfs only guess for well
+    known drivers. Use `device()` to create the corresponding `Device`.
+
+    Attributes:
+        name (str): device name as reported by the driver (usually the card)
+        index (int): index of the node in the parent device
+        filename (Path): device file (ex: /dev/video0)
+        driver (str): name of the driver bound to the parent device
+        bus (str): subsystem of the parent device (ex: usb, platform, pci)
+    """
+
+    name = sysfs.Str("name")
+    index = sysfs.Int("index")
+
+    _caps: Optional[raw.v4l2_capability] = None
+
+    def __repr__(self):
+        return f"<{type(self).__name__} filename={self.filename}, name={self.name!r}>"
+
+    @property
+    def filename(self) -> Path:
+        return Path("/dev") / (self.devname or self.syspath.name)
+
+    @property
+    def parent(self) -> Optional[Path]:
+        parent = self.syspath / "device"
+        return parent.resolve() if parent.exists() else None
+
+    @property
+    def driver(self) -> Optional[str]:
+        driver = self.syspath / "device" / "driver"
+        return driver.resolve().name if driver.exists() else None
+
+    @property
+    def bus(self) -> Optional[str]:
+        subsystem = self.syspath / "device" / "subsystem"
+        return subsystem.resolve().name if subsystem.exists() else None
+
+    def query_capabilities(self) -> raw.v4l2_capability:
+        """QUERYCAP result (the node is opened only on the first call)"""
+        if self._caps is None:
+            with IO.open(self.filename) as fobj:
+                self._caps = read_capabilities(fobj.fileno())
+        return self._caps
+
+    @property
+    def capabilities(self) -> Capability:
+        """Device capabilities (needs to open the node the first time)"""
+        caps = self.query_capabilities()
+        if Capability.DEVICE_CAPS in Capability(caps.capabilities):
+            return Capability(caps.device_caps)
+        return Capability(caps.capabilities)
+
+    @property
+    def sysfs_capabilities(self) -> Optional[Capability]:
+        """
+        Main capabilities inferred from sysfs (driver, name and index) for
+        well known drivers, None otherwise. Never opens the node
+        """
+        guess = SYSFS_CAPABILITIES.get(self.driver)
+        return None if guess is None else guess(self)
+
+    def has_capability(self, capability: Capability) -> bool:
+        """Tells if the node has capability (opens the node only if sysfs can't tell)"""
+        caps = self.sysfs_capabilities
+        if caps is None:
+            caps = self.capabilities
+        return capability in caps
+
+    def device(self, **kwargs) -> Device:
+        return Device(self.filename, **kwargs)
+
+
+def iter_video_nodes(path: PathLike = sysfs.VIDEO4LINUX_PATH) -> Iterable[VideoNode]:
+    """
+    Returns an iterator over all video nodes found in sysfs (sorted by device
+    number). No device is opened.
+    """
+    paths = sorted(Path(path).glob("video*"), key=lambda item: device_number(item) or 0)
+    return (VideoNode.from_syspath(item) for item in paths)
+
+
+def iter_video_capture_nodes(path: PathLike = sysfs.VIDEO4LINUX_PATH) -> Iterable[VideoNode]:
+    """
+    Returns an iterator over all video nodes that have CAPTURE capability.
+    Nodes of well known drivers are classified from sysfs without opening them
+    """
+    return (node for node in iter_video_nodes(path) if node.has_capability(Capability.VIDEO_CAPTURE))
+
+
+def iter_video_output_nodes(path: PathLike = sysfs.VIDEO4LINUX_PATH) -> Iterable[VideoNode]:
+    """
+    Returns an iterator over all video nodes that have VIDEO OUTPUT capability.
+    Nodes of well known drivers are classified from sysfs without opening them
+    """
+    return (node for node in iter_video_nodes(path) if node.has_capability(Capability.VIDEO_OUTPUT))
+
+
 find = make_find(iter_devices)
@@ -14,6 +14,7 @@ import threading
 
 from qtpy import QtCore, QtGui, QtWidgets
 
+from linuxpy.video.convert import PIXEL_FORMATS
 from linuxpy.video.device import Device, Frame, PixelFormat, VideoCapture
 
 
@@ -105,12 +106,9 @@ def frame_to_qimage(frame: Frame) -> QtGui.QImage:
         fmt = QtGui.QImage.Format.Format_RGB32
     elif frame.pixel_format == PixelFormat.ARGB32:
         fmt = QtGui.QImage.Format.Format_ARGB32
-    elif frame.pixel_format == PixelFormat.YUYV:
-        import cv2
-
-        data = frame.array
-        data.shape = frame.height, frame.width, -1
-        data = cv2.cvtColor(data, cv2.COLOR_YUV2BGR_YUYV)
+    elif frame.pixel_format in PIXEL_FORMATS:
+        data = frame.to_bgr()
+        return QtGui.QImage(data.data, frame.width, frame.height, 3 * frame.width, fmt).copy()
     return QtGui.QImage(frame.data, frame.width, frame.height, fmt)
 
 
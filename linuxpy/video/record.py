@@ -0,0 +1,605 @@
+#
+# This file is part of the linuxpy project
+#
+# Copyright (c) 2023 Tiago Coutinho
+# Distributed under the GPLv3 license. See LICENSE for more info.
+
+"""
+Record V4L2 (Video 4 Linux 2) frames to disk.
+
+A `Recorder` hands frames to a background thread which writes them in
+batches (one `writev` per batch). The queue between both is bounded: when
+the disk stalls, frames are dropped instead of blocking the capture loop.
+
+MJPEG frames are stored in an AVI file (with index) which can be played
+by most video players. Other pixel formats are stored in a headered raw
+stream which can be read back with `RawReader`.
+
+A `RingRecorder` keeps the last N frames in a memory mapped circular file
+("last seconds before the trigger" recording).
+"""
+
+import collections
+import concurrent.futures
+import errno
+import fractions
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+from linuxpy.types import Iterator, Optional, PathLike, Self
+
+from .device import Format, Frame, PixelFormat
+
+COMPRESSED_PIXEL_FORMATS = {PixelFormat.MJPEG, PixelFormat.JPEG}
+
+# writev accepts at most IOV_MAX (1024 on linux) buffers per call
+IOV_MAX = 1024
+
+RecorderStats = collections.namedtuple(
+    "RecorderStats", "frames dropped bytes queue_depth max_queue_depth write_latency max_write_latency"
+)
+
+RawRecord = collections.namedtuple("RawRecord", "sequence timestamp flags data")
+
+# frame data and the v4l2_buffer metadata worth keeping
+Record = collections.namedtuple("Record", "data sequence timestamp_ns flags")
+
+
+def frame_record(frame: Frame) -> Record:
+    """Copy of the frame data and metadata which outlives the driver buffer"""
+    data = frame.data if isinstance(frame.data, bytes) else bytes(frame)
+    timestamp = frame.buff.timestamp
+    timestamp_ns = timestamp.secs * 1_000_000_000 + timestamp.usecs * 1_000
+    return Record(data, frame.frame_nb, timestamp_ns, int(frame.flags))
+
+
+def write_all(fd: int, buffers: list) -> int:
+    """writev all buffers (retrying partial writes). Returns number of bytes written"""
+    total = 0
+    buffers = [memoryview(buff).cast("B") for buff in buffers]
+    while buffers:
+        size = os.writev(fd, buffers[:IOV_MAX])
+        total += size
+        while buffers and size >= buffers[0].nbytes:
+            size -= buffers[0].nbytes
+            buffers.pop(0)
+        if size:
+            buffers[0] = buffers[0][size:]
+    return total
+
+
+class AVIWriter:
+    """
+    AVI 1.0 (RIFF) MJPEG stream. Frame chunks are indexed (idx1) when the
+    file is closed. RIFF sizes are 32 bit so a file is limited to 4 GiB.
+    """
+
+    HEADER_SIZE = 224
+    # offsets (in the header) of the fields patched when the file is closed
+    RIFF_SIZE = 4
+    TOTAL_FRAMES = 48
+    STREAM_LENGTH = 140
+    MOVI_SIZE = 216
+    MOVI = 220
+
+    def __init__(self, fd: int, format: Format, fps: float):
+        self.fd = fd
+        self.format = format
+        self.fps = fps
+        self.index = []
+        self.offset = self.HEADER_SIZE
+
+    def header(self) -> bytes:
+        width, height = self.format.width, self.format.height
+        rate = fractions.Fraction(self.fps).limit_denominator(1001)
+        avih = struct.pack(
+            "<4sI10I16x",
+            b"avih",
+            56,
+            round(1_000_000 / self.fps),  # micro seconds per frame
+            0,  # max bytes per second
+            0,  # padding granularity
+            0x10,  # AVIF_HASINDEX
+            0,  # total frames (patched on close)
+            0,  # initial frames
+            1,  # streams
+            0,  # suggested buffer size
+            width,
+            height,
+        )
+        strh = struct.pack(
+            "<4sI4s4sIHHIIIIIIiI4H",
+            b"strh",
+            56,
+            b"vids",
+            b"MJPG",
+            0,  # flags
+            0,  # priority
+            0,  # language
+            0,  # initial frames
+            rate.denominator,  # scale
+            rate.numerator,  # rate
+            0,  # start
+            0,  # length (patched on close)
+            0,  # suggested buffer size
+            -1,  # quality
+            0,  # sample size
+            0,
+            0,
+            width,
+            height,
+        )
+        strf = struct.pack(
+            "<4sIIiiHH4sIiiII", b"strf", 40, 40, width, height, 1, 24, b"MJPG", width * height * 3, 0, 0, 0, 0
+        )
+        strl = b"LIST" + struct.pack("<I", 4 + len(strh) + len(strf)) + b"strl" + strh + strf
+        hdrl = b"LIST" + struct.pack("<I", 4 + len(avih) + len(strl)) + b"hdrl" + avih + strl
+        header = b"RIFF" + struct.pack("<I", 0) + b"AVI " + hdrl + b"LIST" + struct.pack("<I", 0) + b"movi"
+        assert len(header) == self.HEADER_SIZE
+        return header
+
+    def frame(self, record: Record) -> list:
+        size = len(record.data)
+        chunk = 8 + size + (size & 1)
+        if self.offset + chunk + 16 * (len(self.index) + 1) + 8 > 0xFFFFFFFF:
+            raise OSError(errno.EFBIG, "AVI file size limit reached")
+        # idx1 offsets are relative to the 'movi' fourcc
+        self.index.append((self.offset - self.MOVI, size))
+        self.offset += chunk
+        buffers = [struct.pack("<4sI", b"00dc", size), record.data]
+        if size & 1:
+            buffers.append(b"\x00")
+        return buffers
+
+    def close(self) -> None:
+        index = b"".join(struct.pack("<4sIII", b"00dc", 0x10, offset, size) for offset, size in self.index)
+        write_all(self.fd, [struct.pack("<4sI", b"idx1", len(index)), index])
+        frames = struct.pack("<I", len(self.index))
+        os.pwrite(self.fd, struct.pack("<I", self.offset + len(index)), self.RIFF_SIZE)
+        os.pwrite(self.fd, frames, self.TOTAL_FRAMES)
+        os.pwrite(self.fd, frames, self.STREAM_LENGTH)
+        os.pwrite(self.fd, struct.pack("<I", self.offset - self.MOVI), self.MOVI_SIZE)
+
+
+class RawWriter:
+    """
+    Headered raw stream: a file header with the format followed by one
+    header (size, sequence, timestamp, flags) + data per frame.
+    """
+
+    MAGIC = b"LPYRAW\x00\x01"
+    HEADER = struct.Struct("<8sIIII")  # magic width height pixel_format bytesperline
+    FRAME_HEADER = struct.Struct("<IIqI")  # size sequence timestamp_ns flags
+
+    def __init__(self, fd: int, format: Format, fps: float):
+        self.fd = fd
+        self.format = format
+        self.fps = fps
+
+    def header(self) -> bytes:
+        fmt = self.format
+        return self.HEADER.pack(self.MAGIC, fmt.width, fmt.height, fmt.pixel_format, fmt.bytesperline)
+
+    def frame(self, record: Record) -> list:
+        header = self.FRAME_HEADER.pack(len(record.data), record.sequence, record.timestamp_ns, record.flags)
+        return [header, record.data]
+
+    def close(self) -> None:
+        pass
+
+
+def open_writer(path: PathLike, format: Format, fps: float):
+    """Create the file and write its header. AVI for compressed formats, raw stream otherwise"""
+    writer_class = AVIWriter if format.pixel_format in COMPRESSED_PIXEL_FORMATS else RawWriter
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+    try:
+        writer = writer_class(fd, format, fps)
+        write_all(fd, [writer.header()])
+    except BaseException:
+        os.close(fd)
+        raise
+    return writer
+
+
+class RawReader:
+    """Read back a raw stream written by a `Recorder`"""
+
+    def __init__(self, path: PathLike):
+        self.path = path
+        self.format = None
+
+    def __iter__(self) -> Iterator[RawRecord]:
+        with open(self.path, "rb") as fobj:
+            self._read_header(fobj)
+            while header := fobj.read(RawWriter.FRAME_HEADER.size):
+                size, sequence, timestamp_ns, flags = RawWriter.FRAME_HEADER.unpack(header)
+                yield RawRecord(sequence, timestamp_ns * 1e-9, flags, fobj.read(size))
+
+    def _read_header(self, fobj) -> None:
+        magic, width, height, pixel_format, bytesperline = RawWriter.HEADER.unpack(fobj.read(RawWriter.HEADER.size))
+        if magic != RawWriter.MAGIC:
+            raise ValueError(f"{self.path} is not a linuxpy raw stream")
+        self.format = Format(width, height, PixelFormat(pixel_format), bytesperline)
+
+
+class Recorder:
+    """
+    Write frames to a file from a background thread.
+
+    ```python
+    with VideoCapture(device) as capture:
+        with Recorder("video.avi", capture.get_format(), fps=30) as recorder:
+            for frame in capture:
+                recorder.write(frame)
+    ```
+
+    MJPEG and JPEG frames go to an AVI file, any other format to a raw stream
+    (see `RawReader`). Up to *queue_size* frames wait to be written; frames
+    arriving on a full queue are dropped. The writer thread writes up to
+    *batch* frames per system call.
+    """
+
+    def __init__(self, path: PathLike, format: Format, fps: float = 30, queue_size: int = 32, batch: int = 16):
+        self.path = path
+        self.format = format
+        self.fps = fps
+        self.batch = batch
+        self.error = None
+        self._queue = queue.Queue(queue_size)
+        self._thread = None
+        self._fd = None
+        self._writer = None
+        self.reset_stats()
+
+    def __enter__(self) -> Self:
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def is_compressed(self) -> bool:
+        return self.format.pixel_format in COMPRESSED_PIXEL_FORMATS
+
+    def open(self) -> None:
+        if self._thread is not None:
+            return
+        self._writer = open_writer(self.path, self.format, self.fps)
+        self._fd = self._writer.fd
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name=f"Recorder-{os.fspath(self.path)}", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join()
+        fd, self._fd = self._fd, None
+        try:
+            if self.error is None:
+                self._writer.close()
+        finally:
+            os.close(fd)
+        if self.error is not None:
+            raise self.error
+
+    def write(self, frame: Frame) -> bool:
+        """
+        Queue the frame to be written. Never blocks: returns False if the
+        frame was dropped because the queue is full
+        """
+        if self.error is not None:
+            raise self.error
+        try:
+            self._queue.put_nowait(frame_record(frame))
+        except queue.Full:
+            self._dropped += 1
+            return False
+        self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return True
+
+    def record(self, frames: Iterator[Frame]) -> None:
+        """Write all frames (ex: a `VideoCapture`)"""
+        for frame in frames:
+            self.write(frame)
+
+    @property
+    def stats(self) -> RecorderStats:
+        """Write latency is given in seconds per batch"""
+        latency = self._latency / self._batches if self._batches else 0.0
+        return RecorderStats(
+            self._frames,
+            self._dropped,
+            self._bytes,
+            self._queue.qsize(),
+            self._max_queue_depth,
+            latency,
+            self._max_latency,
+        )
+
+    def reset_stats(self) -> None:
+        self._frames = 0
+        self._dropped = 0
+        self._bytes = 0
+        self._batches = 0
+        self._latency = 0.0
+        self._max_latency = 0.0
+        self._max_queue_depth = 0
+
+    def _next_batch(self) -> tuple[list, bool]:
+        records = [self._queue.get()]
+        while len(records) < self.batch:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = records[-1] is None
+        return [record for record in records if record is not None], stop
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            records, stop = self._next_batch()
+            if not records or self.error is not None:
+                continue
+            try:
+                self._write_batch(records)
+            except Exception as error:
+                self.error = error
+
+    def _write_batch(self, records: list) -> None:
+        buffers = []
+        for record in records:
+            buffers.extend(self._writer.frame(record))
+        start = time.perf_counter()
+        size = write_all(self._fd, buffers)
+        latency = time.perf_counter() - start
+        self._frames += len(records)
+        self._bytes += size
+        self._batches += 1
+        self._latency += latency
+        self._max_latency = max(self._max_latency, latency)
+
+
+RING_MAGIC = b"LPYRING\x01"
+RING_HEADER = struct.Struct("<8sIIIIIIQ")  # magic slots slot_size width height pixel_format bytesperline head
+RING_HEADER_SIZE = 64
+RING_HEAD = 32  # offset of head (number of frames ever written) in the header
+# serial is the frame number + 1. It is zeroed while the slot is being written
+RING_SLOT = struct.Struct("<QIIqI4x")  # serial size sequence timestamp_ns flags
+
+
+def ring_records(memory, duration: Optional[float] = None) -> list[RawRecord]:
+    """Valid records of a ring file (oldest first), optionally only the last *duration* seconds"""
+    _, slots, slot_size, *_, head = RING_HEADER.unpack_from(memory)
+    records = []
+    for number in range(max(0, head - slots), head):
+        offset = RING_HEADER_SIZE + (number % slots) * (RING_SLOT.size + slot_size)
+        serial, size, sequence, timestamp_ns, flags = RING_SLOT.unpack_from(memory, offset)
+        if serial != number + 1:
+            # slot overwritten or interrupted while being written
+            continue
+        data = bytes(memory[offset + RING_SLOT.size : offset + RING_SLOT.size + size])
+        records.append(RawRecord(sequence, timestamp_ns * 1e-9, flags, data))
+    if duration is not None and records:
+        start = records[-1].timestamp - duration
+        records = [record for record in records if record.timestamp >= start]
+    return records
+
+
+def ring_format(memory) -> Format:
+    magic, _, _, width, height, pixel_format, bytesperline, _ = RING_HEADER.unpack_from(memory)
+    if magic != RING_MAGIC:
+        raise ValueError("not a linuxpy ring file")
+    return Format(width, height, PixelFormat(pixel_format), bytesperline)
+
+
+class RingRecorder:
+    """
+    Pre-trigger recorder: frames are continuously written to a fixed size
+    memory mapped circular file so the last *slots* frames are always on
+    disk (even if the process crashes). On trigger the recorded window is
+    copied and exported to a regular file by a background thread while
+    recording goes on.
+
+    ```python
+    with RingRecorder("ring.bin", capture.get_format(), slots=10 * 30) as ring:
+        for frame in capture:
+            ring.write(frame)
+            if alarm():
+                ring.trigger("alarm.avi", duration=5)
+    ```
+
+    Each slot holds up to *slot_size* bytes (default: the image size of the
+    format, which is required if the format has no size). Larger frames are
+    not recorded (see `oversized`).
+    Use `RingReader` to read a ring file.
+    """
+
+    def __init__(self, path: PathLike, format: Format, slots: int, slot_size: int = 0):
+        self.path = path
+        self.format = format
+        self.slots = slots
+        self.slot_size = slot_size or format.size
+        if not self.slot_size:
+            raise ValueError("slot_size is required when the format has no image size")
+        self.frozen = False
+        self.head = 0
+        self.oversized = 0
+        self._memory = None
+
+    def __enter__(self) -> Self:
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def size(self) -> int:
+        """File size in bytes"""
+        return RING_HEADER_SIZE + self.slots * (RING_SLOT.size + self.slot_size)
+
+    def open(self) -> None:
+        if self._memory is not None:
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+        try:
+            os.ftruncate(fd, self.size)
+            self._memory = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        fmt = self.format
+        self.head = 0
+        RING_HEADER.pack_into(
+            self._memory,
+            0,
+            RING_MAGIC,
+            self.slots,
+            self.slot_size,
+            fmt.width,
+            fmt.height,
+            fmt.pixel_format,
+            fmt.bytesperline,
+            self.head,
+        )
+
+    def close(self) -> None:
+        memory, self._memory = self._memory, None
+        if memory is not None:
+            memory.flush()
+            memory.close()
+
+    def write(self, frame: Frame) -> bool:
+        """Store the frame in the ring. Returns False if frozen or the frame doesn't fit a slot"""
+        if self.frozen:
+            return False
+        data = frame.data if frame.data is not None else bytes(frame)
+        size = len(data)
+        if size > self.slot_size:
+            self.oversized += 1
+            return False
+        memory = self._memory
+        offset = RING_HEADER_SIZE + (self.head % self.slots) * (RING_SLOT.size + self.slot_size)
+        start = offset + RING_SLOT.size
+        RING_SLOT.pack_into(memory, offset, 0, 0, 0, 0, 0)
+        memory[start : start + size] = data
+        timestamp = frame.buff.timestamp
+        timestamp_ns = timestamp.secs * 1_000_000_000 + timestamp.usecs * 1_000
+        RING_SLOT.pack_into(memory, offset, self.head + 1, size, frame.frame_nb, timestamp_ns, int(frame.flags))
+        self.head += 1
+        struct.pack_into("<Q", memory, RING_HEAD, self.head)
+        return True
+
+    def freeze(self) -> None:
+        self.frozen = True
+
+    def resume(self) -> None:
+        self.frozen = False
+
+    def records(self, duration: Optional[float] = None) -> list[RawRecord]:
+        """Recorded frames (oldest first), optionally only the last *duration* seconds"""
+        return ring_records(self._memory, duration)
+
+    def export(self, path: PathLike, duration: Optional[float] = None) -> int:
+        """
+        Write the recorded frames (optionally only the last *duration*
+        seconds) to an AVI or raw stream file like `Recorder` would.
+        Returns the number of frames exported
+        """
+        return export_records(path, self.format, self.records(duration))
+
+    def trigger(self, path: PathLike, duration: Optional[float] = None) -> concurrent.futures.Future:
+        """
+        Snapshot the window (optionally only the last *duration* seconds)
+        and export it in a background thread. Recording resumes as soon as
+        the snapshot is taken. Returns a future of the number of frames exported
+        """
+        self.freeze()
+        try:
+            records = self.records(duration)
+        finally:
+            self.resume()
+        future = concurrent.futures.Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(export_records(path, self.format, records))
+            except BaseException as error:
+                future.set_exception(error)
+
+        thread = threading.Thread(target=run, name=f"RingExport-{os.fspath(path)}", daemon=True)
+        thread.start()
+        return future
+
+    def sync(self) -> None:
+        """Flush the ring to disk now instead of waiting for the kernel writeback"""
+        self._memory.flush()
+
+
+class RingReader:
+    """Read a ring file written by a `RingRecorder` (ex: after a crash)"""
+
+    def __init__(self, path: PathLike):
+        self.path = path
+        self.format = None
+
+    def __iter__(self) -> Iterator[RawRecord]:
+        yield from self.records()
+
+    def records(self, duration: Optional[float] = None) -> list[RawRecord]:
+        with open(self.path, "rb") as fobj, mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ) as memory:
+            self.format = ring_format(memory)
+            return ring_records(memory, duration)
+
+    def export(self, path: PathLike, duration: Optional[float] = None) -> int:
+        records = self.records(duration)
+        return export_records(path, self.format, records)
+
+
+def export_records(path: PathLike, format: Format, records: list[RawRecord]) -> int:
+    """Write records to an AVI or raw stream file. The frame rate is estimated from the timestamps"""
+    fps = 30.0
+    if len(records) > 1 and records[-1].timestamp > records[0].timestamp:
+        fps = (len(records) - 1) / (records[-1].timestamp - records[0].timestamp)
+    writer = open_writer(path, format, fps)
+    try:
+        buffers = []
+        for record in records:
+            timestamp_ns = round(record.timestamp * 1e9)
+            buffers.extend(writer.frame(Record(record.data, record.sequence, timestamp_ns, record.flags)))
+        write_all(writer.fd, buffers)
+        writer.close()
+    finally:
+        os.close(writer.fd)
+    return len(records)
+
+
+def read_avi_index(path: PathLike) -> list[tuple[int, int]]:
+    """(file offset, size) of each frame of an AVI file written by a `Recorder`"""
+    with open(path, "rb") as fobj:
+        fobj.seek(AVIWriter.MOVI_SIZE)
+        (movi_size,) = struct.unpack("<I", fobj.read(4))
+        fobj.seek(AVIWriter.MOVI + movi_size)
+        fourcc, size = struct.unpack("<4sI", fobj.read(8))
+        if fourcc != b"idx1":
+            raise ValueError(f"{path} has no AVI index")
+        entries = struct.iter_unpack("<4sIII", fobj.read(size))
+    return [(AVIWriter.MOVI + offset + 8, length) for _, _, offset, length in entries]
+
+
+def iter_avi_frames(path: PathLike) -> Iterator[bytes]:
+    """Frames of an AVI file written by a `Recorder`"""
+    with open(path, "rb") as fobj:
+        for offset, size in read_avi_index(path):
+            fobj.seek(offset)
+            yield fobj.read(size)
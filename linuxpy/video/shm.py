@@ -0,0 +1,390 @@
+#
+# This file is part of the linuxpy project
+#
+# Copyright (c) 2023 Tiago Coutinho
+# Distributed under the GPLv3 license. See LICENSE for more info.
+
+"""
+Share V4L2 (Video 4 Linux 2) frames between processes.
+
+A `SharedFramePublisher` copies each frame into a slot of a ring in
+`multiprocessing.shared_memory`. Any number of `SharedFrameSubscriber`s
+(usually in other processes) attach to the ring by name and get frames whose
+data is a view into the shared memory (no copy, no pickling).
+
+Each slot is protected by a sequence lock: the publisher makes the slot
+sequence odd while it writes and even when done. A subscriber reading a
+frame checks the sequence before and after so it never returns a torn
+frame. Since data is not copied, a slow consumer can still see the slot
+being overwritten later; `SharedFrame.valid` tells if the data is still
+the one of the frame.
+
+Subscribers waiting for a frame sleep on a futex (the low 32 bits of the
+ring head) which the publisher wakes after each frame, so they neither
+burn CPU nor add latency.
+"""
+
+import collections
+import ctypes
+import mmap
+import os
+import platform
+import secrets
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+
+from linuxpy.ctypes import timespec
+from linuxpy.types import Optional, Self
+
+from . import raw
+from .device import Format, Frame, PixelFormat
+
+SHM_PATH = "/dev/shm"
+MAGIC = b"LPYSHM\x00\x01"
+HEADER = struct.Struct("<8sIIQ")  # magic slots slot_size head
+HEADER_SIZE = 64
+HEAD = 16  # offset of head (number of frames published) in the header
+# lock number size width height pixel_format bytesperline sequence timestamp_ns flags
+# (lock is the sequence lock, number the publish count + 1 of the frame in the slot)
+SLOT = struct.Struct("<QQIIIIIIqI12x")
+LOCK = struct.Struct("<Q")
+
+SharedStats = collections.namedtuple("SharedStats", "frames dropped")
+
+# futex(2) system call number (None on unknown architectures: subscribers poll)
+SYS_FUTEX = {
+    "x86_64": 202,
+    "aarch64": 98,
+    "riscv64": 98,
+    "armv6l": 240,
+    "armv7l": 240,
+    "i386": 240,
+    "i686": 240,
+}.get(platform.machine())
+FUTEX_WAIT = 0
+FUTEX_WAKE = 1
+PROT_READ = 1
+MAP_SHARED = 1
+INT_MAX = 2**31 - 1
+
+libc = ctypes.CDLL(None, use_errno=True)
+libc.mmap.restype = ctypes.c_void_p
+libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+
+
+def slot_offset(slot_size: int, index: int) -> int:
+    return HEADER_SIZE + index * (SLOT.size + slot_size)
+
+
+def shm_path(name: str) -> str:
+    return os.path.join(SHM_PATH, name.lstrip("/"))
+
+
+class HeadFutex:
+    """
+    The low 32 bits of the head of a ring used as a futex word. The header
+    is mapped shared so the futex works across processes
+    """
+
+    def __init__(self, name: str):
+        fd = os.open(shm_path(name), os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            address = libc.mmap(None, HEADER_SIZE, PROT_READ, MAP_SHARED, fd, 0)
+        finally:
+            os.close(fd)
+        if address == ctypes.c_void_p(-1).value:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._address = address
+        self._word = ctypes.c_void_p(address + HEAD)
+
+    def close(self) -> None:
+        address, self._address = self._address, None
+        if address is not None:
+            libc.munmap(address, HEADER_SIZE)
+
+    def wait(self, head: int, timeout: Optional[float] = None) -> None:
+        """Sleep until head changes (or timeout, a signal or a spurious wake up)"""
+        # the word is the native view of the first 4 (little endian) bytes of head
+        value = int.from_bytes((head & 0xFFFF_FFFF).to_bytes(4, "little"), sys.byteorder)
+        delay = None
+        if timeout is not None:
+            delay = timespec(int(timeout), int(timeout % 1 * 1_000_000_000))
+            delay = ctypes.byref(delay)
+        libc.syscall(ctypes.c_long(SYS_FUTEX), self._word, ctypes.c_int(FUTEX_WAIT), ctypes.c_uint(value), delay)
+
+    def wake(self) -> None:
+        """Wake up all waiters"""
+        libc.syscall(ctypes.c_long(SYS_FUTEX), self._word, ctypes.c_int(FUTEX_WAKE), ctypes.c_int(INT_MAX))
+
+
+class SharedFrame(Frame):
+    """
+    A frame whose data is a view into the shared memory slot. Use `valid`
+    after processing to know if the publisher overwrote the slot meanwhile
+    """
+
+    __slots__ = ["_memory", "_offset", "_lock"]
+
+    def __init__(self, data, buff: raw.v4l2_buffer, format: Format, memory, offset: int, lock: int):
+        super().__init__(data, buff, format)
+        self._memory = memory
+        self._offset = offset
+        self._lock = lock
+
+    def __bytes__(self):
+        return bytes(self.data)
+
+    @property
+    def valid(self) -> bool:
+        """True if the slot has not been overwritten since the frame was read"""
+        return LOCK.unpack_from(self._memory, self._offset)[0] == self._lock
+
+    def copy(self) -> Optional[Frame]:
+        """Frame with a private copy of the data or None if the slot has already been overwritten"""
+        data = bytes(self.data)
+        if not self.valid:
+            return None
+        return Frame(data, self.buff, self.format)
+
+
+class SharedFramePublisher:
+    """
+    Publish frames to a shared memory ring of *slots* slots of *slot_size*
+    bytes each. Give `name` to the subscribers.
+
+    ```python
+    with VideoCapture(device) as capture:
+        with SharedFramePublisher(format=capture.get_format()) as publisher:
+            start_workers(publisher.name)
+            for frame in capture:
+                publisher.publish(frame)
+    ```
+
+    *slot_size* defaults to the image size of *format*. The shared memory
+    is removed when the publisher is closed.
+    """
+
+    def __init__(
+        self,
+        name: Optional[str] = None,
+        slots: int = 4,
+        slot_size: Optional[int] = None,
+        format: Optional[Format] = None,
+    ):
+        if slot_size is None and format is not None:
+            slot_size = format.size or format.bytesperline * format.height
+        if not slot_size:
+            raise ValueError("slot_size is needed when format has no image size")
+        self.name = name or f"linuxpy-{secrets.token_hex(6)}"
+        self.slots = slots
+        self.slot_size = slot_size
+        self.head = 0
+        self.oversized = 0
+        self._shm = None
+        self._futex = None
+
+    def __enter__(self) -> Self:
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def size(self) -> int:
+        return slot_offset(self.slot_size, self.slots)
+
+    def open(self) -> None:
+        if self._shm is not None:
+            return
+        self._shm = shared_memory.SharedMemory(self.name, create=True, size=self.size)
+        self.head = 0
+        HEADER.pack_into(self._shm.buf, 0, MAGIC, self.slots, self.slot_size, self.head)
+        if SYS_FUTEX is not None:
+            self._futex = HeadFutex(self.name)
+
+    def close(self) -> None:
+        shm, self._shm = self._shm, None
+        if shm is not None:
+            if self._futex is not None:
+                self._futex.close()
+                self._futex = None
+            shm.close()
+            shm.unlink()
+
+    def publish(self, frame: Frame) -> bool:
+        """Copy the frame to the next slot. Returns False if the frame doesn't fit a slot"""
+        data = frame.data if frame.data is not None else bytes(frame)
+        size = len(data)
+        if size > self.slot_size:
+            self.oversized += 1
+            return False
+        memory = self._shm.buf
+        offset = slot_offset(self.slot_size, self.head % self.slots)
+        (lock,) = LOCK.unpack_from(memory, offset)
+        LOCK.pack_into(memory, offset, lock + 1)
+        start = offset + SLOT.size
+        memory[start : start + size] = data
+        width, height, pixel_format, bytesperline, _ = frame.format
+        timestamp = frame.buff.timestamp
+        timestamp_ns = timestamp.secs * 1_000_000_000 + timestamp.usecs * 1_000
+        fields = size, width, height, pixel_format, bytesperline, frame.frame_nb, timestamp_ns, int(frame.flags)
+        SLOT.pack_into(memory, offset, lock + 1, self.head + 1, *fields)
+        LOCK.pack_into(memory, offset, lock + 2)
+        self.head += 1
+        struct.pack_into("<Q", memory, HEAD, self.head)
+        if self._futex is not None:
+            self._futex.wake()
+        return True
+
+
+def attach(name: str) -> mmap.mmap:
+    """
+    Read only map of an existing shared memory. SharedMemory is not used
+    since (before python 3.13) it registers the memory in the resource
+    tracker of the subscriber process which would remove it on exit
+    """
+    fd = os.open(shm_path(name), os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    finally:
+        os.close(fd)
+
+
+class SharedFrameSubscriber:
+    """
+    Read frames published by a `SharedFramePublisher` (usually from
+    another process) without copying them:
+
+    ```python
+    with SharedFrameSubscriber(name) as subscriber:
+        for frame in subscriber:
+            result = infer(frame.array)
+            if frame.valid:
+                ...
+    ```
+
+    Frames are read in order, starting with the next published frame. A
+    subscriber falling more than the number of slots behind skips the
+    oldest frames (accounted as dropped). Frames (and arrays made from
+    them) must be released before closing the subscriber.
+
+    Waiting for a frame sleeps on the ring futex. *poll_interval* is only
+    used on architectures where the futex system call is unknown.
+    """
+
+    def __init__(self, name: str, poll_interval: float = 0.001):
+        self.name = name
+        self.poll_interval = poll_interval
+        self.cursor = 0
+        self.slots = None
+        self.slot_size = None
+        self._map = None
+        self._memory = None
+        self._futex = None
+        self._frames = 0
+        self._dropped = 0
+
+    def __enter__(self) -> Self:
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            yield self.read()
+
+    def open(self) -> None:
+        if self._map is not None:
+            return
+        memory = attach(self.name)
+        magic, self.slots, self.slot_size, head = HEADER.unpack_from(memory)
+        if magic != MAGIC:
+            memory.close()
+            raise ValueError(f"{self.name} is not a linuxpy shared frame ring")
+        self._map = memory
+        self._memory = memoryview(memory)
+        self.cursor = head
+        if SYS_FUTEX is not None:
+            self._futex = HeadFutex(self.name)
+
+    def close(self) -> None:
+        memory, self._map = self._map, None
+        if memory is not None:
+            if self._futex is not None:
+                self._futex.close()
+                self._futex = None
+            self._memory.release()
+            self._memory = None
+            memory.close()
+
+    @property
+    def head(self) -> int:
+        return struct.unpack_from("<Q", self._memory, HEAD)[0]
+
+    @property
+    def lag(self) -> int:
+        """Number of frames published but not yet read"""
+        return min(self.head - self.cursor, self.slots)
+
+    @property
+    def stats(self) -> SharedStats:
+        return SharedStats(self._frames, self._dropped)
+
+    def read(self, timeout: Optional[float] = None) -> Optional[SharedFrame]:
+        """Next frame. Returns None on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            head = self.head
+            if head - self.cursor > self.slots:
+                self._dropped += head - self.slots - self.cursor
+                self.cursor = head - self.slots
+            while self.cursor < head:
+                number, self.cursor = self.cursor, self.cursor + 1
+                frame = self._read_slot(number)
+                if frame is not None:
+                    self._frames += 1
+                    return frame
+                self._dropped += 1
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return None
+            if self._futex is None:
+                time.sleep(self.poll_interval)
+            else:
+                self._futex.wait(head, None if deadline is None else deadline - now)
+
+    def latest(self) -> Optional[SharedFrame]:
+        """Most recently published frame (skipping any unread one) or None if there is none"""
+        head = self.head
+        if head > self.cursor:
+            self._dropped += min(head - self.cursor, self.slots) - 1
+            self.cursor = head - 1
+        return self.read(0)
+
+    def _read_slot(self, number: int) -> Optional[SharedFrame]:
+        memory = self._memory
+        offset = slot_offset(self.slot_size, number % self.slots)
+        while True:
+            lock, slot_number, size, *fields = SLOT.unpack_from(memory, offset)
+            if lock & 1 or slot_number != number + 1:
+                # slot being (or already) reused for a newer frame
+                return None
+            width, height, pixel_format, bytesperline, sequence, timestamp_ns, flags = fields
+            if LOCK.unpack_from(memory, offset)[0] == lock:
+                break
+        buff = raw.v4l2_buffer()
+        buff.bytesused = size
+        buff.sequence = sequence
+        buff.timestamp.secs, nanosecs = divmod(timestamp_ns, 1_000_000_000)
+        buff.timestamp.usecs = nanosecs // 1_000
+        buff.flags = flags
+        fmt = Format(width, height, PixelFormat(pixel_format), bytesperline)
+        start = offset + SLOT.size
+        return SharedFrame(memory[start : start + size], buff, fmt, memory, offset, lock)
@@ -0,0 +1,311 @@
+#
+# This file is part of the linuxpy project
+#
+# Copyright (c) 2023 Tiago Coutinho
+# Distributed under the GPLv3 license. See LICENSE for more info.
+
+"""
+MJPEG over HTTP streaming (`multipart/x-mixed-replace`) with asyncio.
+
+The server is written with the standard library only (no web framework
+needed). Each frame is encoded once and the same encoded image is sent to
+all clients: MJPEG/JPEG frames are passed through untouched, other formats
+go through an encoder (by default PNG, which needs numpy for the pixel
+format conversion; pass `encoder` to use your own JPEG encoder).
+
+Every client only holds the latest encoded image: a slow viewer skips
+images instead of slowing down the camera or the other viewers.
+
+Run `python -m linuxpy.video.stream --device 0` and point a browser to
+http://localhost:8000.
+"""
+
+import argparse
+import asyncio
+import collections
+import logging
+import struct
+import zlib
+
+from linuxpy.types import AsyncIterable, Callable, Optional, Self
+
+from .device import Device, Frame, PixelFormat, VideoCapture
+
+log = logging.getLogger(__name__)
+
+BOUNDARY = b"frame"
+
+INDEX = b"""\
+<!doctype html>
+<html lang="en">
+<head><link rel="icon" href="data:;base64,iVBORw0KGgo="></head>
+<body><img src="/stream" /></body>
+</html>
+"""
+
+REASONS = {200: "OK", 404: "Not Found", 405: "Method Not Allowed", 503: "Service Unavailable"}
+
+# (content type, encoded image)
+Image = collections.namedtuple("Image", "content_type data")
+
+ClientStats = collections.namedtuple("ClientStats", "address sent skipped")
+
+
+def encode_png(frame: Frame) -> Image:
+    """PNG encoding (fast compression level) of any format supported by `linuxpy.video.convert`"""
+    import numpy
+
+    rgb = frame.to_rgb()
+    height, width, _ = rgb.shape
+    # each row starts with the filter type (0: none)
+    rows = numpy.zeros((height, 1 + 3 * width), dtype="u1")
+    rows[:, 1:] = rgb.reshape(height, 3 * width)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    data = b"".join(
+        (
+            b"\x89PNG\r\n\x1a\n",
+            chunk(b"IHDR", header),
+            chunk(b"IDAT", zlib.compress(rows.tobytes(), 1)),
+            chunk(b"IEND", b""),
+        )
+    )
+    return Image("image/png", data)
+
+
+def encode(frame: Frame, encoder: Callable[[Frame], Image] = encode_png) -> Image:
+    if frame.pixel_format in {PixelFormat.MJPEG, PixelFormat.JPEG}:
+        return Image("image/jpeg", bytes(frame))
+    return encoder(frame)
+
+
+class Client:
+    """A viewer. Holds only the latest image not yet sent"""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.address = writer.get_extra_info("peername")
+        self.image = None
+        self.sent = 0
+        self.skipped = 0
+        self.closed = False
+        self._ready = asyncio.Event()
+
+    def offer(self, image: Image) -> None:
+        if self.image is not None:
+            self.skipped += 1
+        self.image = image
+        self._ready.set()
+
+    async def next_image(self) -> Optional[Image]:
+        """Wait for a new image. Returns None when the client is closed"""
+        await self._ready.wait()
+        self._ready.clear()
+        image, self.image = self.image, None
+        return None if self.closed else image
+
+    def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+    @property
+    def stats(self) -> ClientStats:
+        return ClientStats(self.address, self.sent, self.skipped)
+
+
+class StreamServer:
+    """
+    HTTP server streaming the frames of *source* (any async iterable of
+    frames, ex: a `VideoCapture`) as `multipart/x-mixed-replace`.
+
+    ```python
+    async with StreamServer(capture, port=8000) as server:
+        await server.serve_forever()
+    ```
+
+    Routes: `/` (a page showing the stream), `/stream` and `/snapshot`
+    (the latest image).
+    """
+
+    def __init__(
+        self,
+        source: AsyncIterable[Frame],
+        host: Optional[str] = None,
+        port: int = 8000,
+        encoder: Callable[[Frame], Image] = encode_png,
+    ):
+        self.source = source
+        self.host = host
+        self.port = port
+        self.encoder = encoder
+        self.clients = set()
+        self.image = None
+        self.frames = 0
+        self._server = None
+        self._pump = None
+        self._image_ready = None
+
+    async def __aenter__(self) -> Self:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    @property
+    def address(self) -> tuple:
+        return self._server.sockets[0].getsockname()
+
+    async def start(self) -> None:
+        if self._server is not None:
+            return
+        self._image_ready = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self._pump = asyncio.create_task(self._run_source())
+        log.info("streaming on %s:%s", *self.address[:2])
+
+    async def stop(self) -> None:
+        server, self._server = self._server, None
+        if server is None:
+            return
+        self._pump.cancel()
+        server.close()
+        for client in list(self.clients):
+            client.close()
+        await asyncio.gather(self._pump, return_exceptions=True)
+        await server.wait_closed()
+
+    async def serve_forever(self) -> None:
+        await self._pump
+
+    @property
+    def stats(self) -> list[ClientStats]:
+        return [client.stats for client in self.clients]
+
+    async def _run_source(self) -> None:
+        loop = asyncio.get_running_loop()
+        async for frame in self.source:
+            if frame.pixel_format in {PixelFormat.MJPEG, PixelFormat.JPEG}:
+                image = encode(frame)
+            else:
+                # encoding is CPU bound: keep the event loop responsive
+                image = await loop.run_in_executor(None, encode, frame, self.encoder)
+            self.frames += 1
+            self.image = image
+            self._image_ready.set()
+            for client in self.clients:
+                client.offer(image)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # headers are not used
+            parts = request.decode("latin-1").split()
+            if len(parts) != 3:
+                return
+            method, path = parts[0], parts[1].split("?", 1)[0]
+            if method not in {"GET", "HEAD"}:
+                await self._respond(writer, 405)
+            elif path == "/":
+                await self._respond(writer, 200, "text/html", INDEX, method == "HEAD")
+            elif path == "/snapshot":
+                await self._snapshot(writer, method == "HEAD")
+            elif path == "/stream":
+                await self._stream(writer, method == "HEAD")
+            else:
+                await self._respond(writer, 404)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status: int, content_type="text/plain", body=None, head=False) -> None:
+        if body is None:
+            body = REASONS[status].encode()
+        headers = (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(headers.encode())
+        if not head:
+            writer.write(body)
+        await writer.drain()
+
+    async def _snapshot(self, writer, head: bool) -> None:
+        if self.image is None:
+            try:
+                await asyncio.wait_for(self._image_ready.wait(), 5)
+            except asyncio.TimeoutError:
+                await self._respond(writer, 503)
+                return
+        content_type, data = self.image
+        await self._respond(writer, 200, content_type, data, head)
+
+    async def _stream(self, writer, head: bool) -> None:
+        headers = (
+            "HTTP/1.1 200 OK\r\n"
+            f"Content-Type: multipart/x-mixed-replace; boundary={BOUNDARY.decode()}\r\n"
+            "Cache-Control: no-cache, private\r\n"
+            "Pragma: no-cache\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(headers.encode())
+        await writer.drain()
+        if head:
+            return
+        client = Client(writer)
+        log.info("client %s connected", client.address)
+        self.clients.add(client)
+        try:
+            while (image := await client.next_image()) is not None:
+                content_type, data = image
+                part = b"--%s\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n" % (
+                    BOUNDARY,
+                    content_type.encode(),
+                    len(data),
+                )
+                writer.writelines((part, data, b"\r\n"))
+                await writer.drain()
+                client.sent += 1
+        finally:
+            self.clients.discard(client)
+            log.info("client %s disconnected (sent=%d, skipped=%d)", client.address, client.sent, client.skipped)
+
+
+async def serve(device: Device, width: int, height: int, pixel_format: str, host: Optional[str], port: int):
+    with device:
+        capture = VideoCapture(device)
+        if width and height:
+            capture.set_format(width, height, pixel_format)
+        with capture:
+            async with StreamServer(capture, host, port) as server:
+                await server.serve_forever()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="MJPEG over HTTP streaming of a V4L2 device")
+    parser.add_argument("--device", default="0", help="device id or file name (default: 0)")
+    parser.add_argument("--host", default=None, help="interface to listen on (default: all)")
+    parser.add_argument("--port", default=8000, type=int)
+    parser.add_argument("--width", default=0, type=int)
+    parser.add_argument("--height", default=0, type=int)
+    parser.add_argument("--format", default="MJPG", help="pixel format (default: MJPG)")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(args)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)-15s %(levelname)-5s %(name)s: %(message)s")
+    device = Device.from_id(int(args.device)) if args.device.isdigit() else Device(args.device)
+    try:
+        asyncio.run(serve(device, args.width, args.height, args.format, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,992 @@
+#
+# This file is part of the linuxpy project
+#
+# Copyright (c) 2023 Tiago Coutinho
+# Distributed under the GPLv3 license. See LICENSE for more info.
+
+"""
+Fake V4L2 devices to test and benchmark code without a camera.
+
+`FakeCamera` is a working capture driver:
+
+```python
+from linuxpy.video.device import VideoCapture
+from linuxpy.video.testing import FakeCamera
+
+with FakeCamera(width=640, height=480, pixel_format="YUYV", fps=30) as camera:
+    with camera.device() as device:
+        with VideoCapture(device) as capture:
+            for frame in capture:
+                ...
+```
+
+Only the boundary with the kernel is faked: while the camera is active,
+`fcntl.ioctl` calls on its file descriptor are answered by the camera and
+its buffers are memory mapped from a memfd. The device file descriptor is
+the read end of a pipe which becomes readable when a frame is ready so
+select, epoll, asyncio and gevent work unmodified.
+
+Frames are produced every 1/*fps* seconds by a background thread (frames
+produced while no buffer is queued are lost, like with a real camera) or,
+if *fps* is None, as soon as a buffer is queued. A camera without *fps*
+has no frame interval: G_PARM and ENUM_FRAMEINTERVALS fail with EINVAL.
+Buffer timestamps come from CLOCK_MONOTONIC.
+
+Memory map and read capture are supported. In read mode a frame must fit
+the pipe (up to `/proc/sys/fs/pipe-max-size`, 1MiB by default).
+
+`Hardware` (and its memory to memory flavor `M2MHardware`) is a scripted
+device for unit tests: it answers every ioctl with canned values and
+covers what `FakeCamera` doesn't (output, multi-planar, DMABUF, USERPTR,
+controls, events and media requests).
+"""
+
+import collections
+import contextlib
+import ctypes
+import errno
+import fcntl
+import mmap
+import os
+import termios
+import threading
+import time
+from random import randint
+from unittest import mock
+
+from linuxpy.types import Optional, Self, Union
+
+from . import device as video, raw
+from .device import (
+    IOC,
+    MEDIA_IOC_REQUEST_ALLOC,
+    MEDIA_REQUEST_IOC_QUEUE,
+    MEDIA_REQUEST_IOC_REINIT,
+    PACKED_PIXEL_FORMATS,
+    YUV420_PIXEL_FORMATS,
+    Capability,
+    ControlChange,
+    ControlWhich,
+    DecoderCommand,
+    Device,
+    PixelFormat,
+    sleep_until,
+)
+
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+CAPABILITIES = Capability.VIDEO_CAPTURE | Capability.STREAMING | Capability.READWRITE
+
+# (index, sequence, timestamp_ns) of a buffer filled by the camera
+Done = collections.namedtuple("Done", "index sequence timestamp")
+
+
+def image_size(width: int, height: int, pixel_format: PixelFormat) -> tuple[int, int]:
+    """(bytesperline, sizeimage) of an image (compressed formats are given one byte per pixel)"""
+    if pixel_format in PACKED_PIXEL_FORMATS:
+        dtype, channels = PACKED_PIXEL_FORMATS[pixel_format]
+        bytesperline = width * channels * int(dtype[-1])
+        return bytesperline, bytesperline * height
+    if pixel_format in YUV420_PIXEL_FORMATS:
+        return width, width * height * 3 // 2
+    return 0, width * height
+
+
+class FakeCamera:
+    """
+    Fake capture device. Use `device()` (while the camera is active) to get
+    a `Device` bound to it.
+
+    `dropped` counts frames the camera had to drop because no buffer was
+    queued (or, in read mode, because the previous frame was not read yet).
+    """
+
+    def __init__(
+        self,
+        width: int = 640,
+        height: int = 480,
+        pixel_format: Union[PixelFormat, str] = PixelFormat.YUYV,
+        fps: Optional[float] = 30,
+        buffers: int = 4,
+        filename: str = "/dev/video99",
+    ):
+        if isinstance(pixel_format, str):
+            pixel_format = PixelFormat[pixel_format.upper()]
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.fps = fps
+        self.max_buffers = buffers
+        self.filename = filename
+        self.sequence = 0
+        self.dropped = 0
+        self.streaming = False
+        self.fd = None
+        self._writer = None
+        self._memory = None
+        self._buffer_size = 0
+        self._nb_buffers = 0
+        self._queued = collections.deque()
+        self._done = collections.deque()
+        self._lock = threading.Lock()
+        self._stack = None
+        self._thread = None
+        self._running = False
+        self._reading = False
+
+    def __enter__(self) -> Self:
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def image_size(self) -> tuple[int, int]:
+        return image_size(self.width, self.height, self.pixel_format)
+
+    def open(self) -> None:
+        if self._stack is not None:
+            return
+        self.fd, self._writer = os.pipe()
+        os.set_blocking(self.fd, False)
+        self._real_ioctl = fcntl.ioctl
+        self._real_mem_map = video.mem_map
+        stack = contextlib.ExitStack()
+        stack.enter_context(mock.patch.object(fcntl, "ioctl", self._ioctl))
+        stack.enter_context(mock.patch.object(video, "mem_map", self._mem_map))
+        self._stack = stack
+
+    def close(self) -> None:
+        stack, self._stack = self._stack, None
+        if stack is None:
+            return
+        self._stop()
+        stack.close()
+        self._release_buffers()
+        os.close(self.fd)
+        os.close(self._writer)
+        self.fd = self._writer = None
+
+    def device(self, **kwargs) -> Device:
+        """
+        New `Device` bound to the camera. The file descriptor belongs to the
+        camera: closing the device doesn't close it. *kwargs* are passed to
+        `Device` (ex: `io=GeventIO`)
+        """
+        fobj = open(self.fd, "rb", buffering=0, closefd=False)
+        fobj.name = self.filename
+        return Device(fobj, **kwargs)
+
+    # kernel boundary
+
+    def _mem_map(self, fd, length, offset):
+        if fd != self.fd:
+            return self._real_mem_map(fd, length, offset)
+        return mmap.mmap(self._memory, length, offset=offset)
+
+    def _ioctl(self, fd, request, *args):
+        if fd != self.fd:
+            return self._real_ioctl(fd, request, *args)
+        handler = self._handlers.get(request)
+        if handler is None:
+            raise OSError(errno.ENOTTY, os.strerror(errno.ENOTTY))
+        handler(self, *args)
+        return 0
+
+    def _querycap(self, caps):
+        caps.driver = b"linuxpy"
+        caps.card = b"linuxpy fake camera"
+        caps.bus_info = b"platform:linuxpy"
+        caps.version = 6 << 16
+        caps.capabilities = CAPABILITIES | Capability.DEVICE_CAPS
+        caps.device_caps = CAPABILITIES
+
+    def _check_type(self, buffer_type):
+        if buffer_type != raw.BufType.VIDEO_CAPTURE:
+            raise OSError(errno.EINVAL, "only VIDEO_CAPTURE is supported")
+
+    def _enum_fmt(self, fmt):
+        self._check_type(fmt.type)
+        if fmt.index:
+            raise OSError(errno.EINVAL, "no more formats")
+        fmt.pixelformat = self.pixel_format
+        fmt.description = self.pixel_format.name.encode()
+        fmt.flags = 0 if self.image_size[0] else raw.ImageFormatFlag.COMPRESSED
+
+    def _enum_framesizes(self, size):
+        if size.index or size.pixel_format != self.pixel_format:
+            raise OSError(errno.EINVAL, "no more sizes")
+        size.type = raw.Frmsizetypes.DISCRETE
+        size.m1.discrete.width = self.width
+        size.m1.discrete.height = self.height
+
+    def _check_fps(self):
+        if self.fps is None:
+            raise OSError(errno.EINVAL, "no frame interval")
+
+    def _enum_frameintervals(self, interval):
+        if interval.index or (interval.width, interval.height) != (self.width, self.height):
+            raise OSError(errno.EINVAL, "no more intervals")
+        self._check_fps()
+        interval.type = raw.Frmivaltypes.DISCRETE
+        interval.m1.discrete.numerator = 1
+        interval.m1.discrete.denominator = round(self.fps)
+
+    def _fill_format(self, fmt):
+        bytesperline, sizeimage = self.image_size
+        pix = fmt.fmt.pix
+        pix.width, pix.height, pix.pixelformat = self.width, self.height, self.pixel_format
+        pix.bytesperline, pix.sizeimage = bytesperline, sizeimage
+        pix.field = raw.Field.NONE
+
+    def _g_fmt(self, fmt):
+        self._check_type(fmt.type)
+        self._fill_format(fmt)
+
+    def _s_fmt(self, fmt):
+        self._check_type(fmt.type)
+        if self._nb_buffers:
+            raise OSError(errno.EBUSY, "buffers are allocated")
+        pix = fmt.fmt.pix
+        self.width, self.height = pix.width, pix.height
+        self.pixel_format = PixelFormat(pix.pixelformat)
+        self._fill_format(fmt)
+
+    def _g_parm(self, parm):
+        self._check_type(parm.type)
+        self._check_fps()
+        parm.parm.capture.capability = raw.Capability.TIMEPERFRAME
+        parm.parm.capture.timeperframe.numerator = 1
+        parm.parm.capture.timeperframe.denominator = round(self.fps)
+
+    def _s_parm(self, parm):
+        self._check_type(parm.type)
+        frame_time = parm.parm.capture.timeperframe
+        if not frame_time.numerator or not frame_time.denominator:
+            raise OSError(errno.EINVAL, "invalid frame interval")
+        self.fps = frame_time.denominator / frame_time.numerator
+        self._g_parm(parm)
+
+    def _reqbufs(self, req):
+        self._check_type(req.type)
+        if req.memory != raw.Memory.MMAP:
+            raise OSError(errno.EINVAL, "only MMAP is supported")
+        if self.streaming:
+            raise OSError(errno.EBUSY, "streaming")
+        self._release_buffers()
+        count = min(req.count, self.max_buffers)
+        if count:
+            size = -(-self.image_size[1] // mmap.PAGESIZE) * mmap.PAGESIZE
+            self._memory = os.memfd_create("linuxpy-fake-camera", os.MFD_CLOEXEC)
+            os.ftruncate(self._memory, count * size)
+            self._buffer_size = size
+        self._nb_buffers = req.count = count
+        req.capabilities = 1  # V4L2_BUF_CAP_SUPPORTS_MMAP
+
+    def _release_buffers(self):
+        if self._memory is not None:
+            os.close(self._memory)
+        self._memory = None
+        self._nb_buffers = 0
+
+    def _fill_buffer(self, buff, index):
+        buff.index = index
+        buff.memory = raw.Memory.MMAP
+        buff.field = raw.Field.NONE
+        buff.length = self.image_size[1]
+        buff.m.offset = index * self._buffer_size
+
+    def _querybuf(self, buff):
+        self._check_type(buff.type)
+        if buff.index >= self._nb_buffers:
+            raise OSError(errno.EINVAL, "invalid buffer index")
+        self._fill_buffer(buff, buff.index)
+
+    def _qbuf(self, buff):
+        self._check_type(buff.type)
+        if buff.index >= self._nb_buffers or buff.memory != raw.Memory.MMAP:
+            raise OSError(errno.EINVAL, "invalid buffer")
+        with self._lock:
+            self._queued.append(buff.index)
+            if self.streaming and self.fps is None:
+                self._produce()
+
+    def _dqbuf(self, buff):
+        self._check_type(buff.type)
+        if not self.streaming:
+            raise OSError(errno.EINVAL, "not streaming")
+        # one byte in the pipe per buffer done (blocks on a blocking device)
+        os.read(self.fd, 1)
+        with self._lock:
+            if not self._done:
+                # stream stopped while waiting
+                raise OSError(errno.EINVAL, "not streaming")
+            done = self._done.popleft()
+        self._fill_buffer(buff, done.index)
+        buff.bytesused = self.image_size[1]
+        buff.sequence = done.sequence
+        buff.flags = raw.BufferFlag.TIMESTAMP_MONOTONIC | raw.BufferFlag.TSTAMP_SRC_SOE
+        buff.timestamp.secs, nanosecs = divmod(done.timestamp, 1_000_000_000)
+        buff.timestamp.usecs = nanosecs // 1_000
+
+    def _streamon(self, buffer_type):
+        self._check_type(buffer_type.value)
+        if self.streaming:
+            return
+        self.streaming = True
+        if self.fps is None:
+            with self._lock:
+                while self._queued:
+                    self._produce()
+        else:
+            self._start(self._run_streaming)
+
+    def _streamoff(self, buffer_type):
+        self._check_type(buffer_type.value)
+        self.streaming = False
+        self._stop()
+        with self._lock:
+            self._queued.clear()
+            self._done.clear()
+        # discard pending "frame ready" bytes
+        with contextlib.suppress(BlockingIOError):
+            while os.read(self.fd, 4096):
+                pass
+
+    _handlers = {
+        IOC.QUERYCAP: _querycap,
+        IOC.ENUM_FMT: _enum_fmt,
+        IOC.ENUM_FRAMESIZES: _enum_framesizes,
+        IOC.ENUM_FRAMEINTERVALS: _enum_frameintervals,
+        IOC.G_FMT: _g_fmt,
+        IOC.S_FMT: _s_fmt,
+        IOC.TRY_FMT: _g_fmt,
+        IOC.G_PARM: _g_parm,
+        IOC.S_PARM: _s_parm,
+        IOC.REQBUFS: _reqbufs,
+        IOC.QUERYBUF: _querybuf,
+        IOC.QBUF: _qbuf,
+        IOC.DQBUF: _dqbuf,
+        IOC.STREAMON: _streamon,
+        IOC.STREAMOFF: _streamoff,
+    }
+
+    # frame production
+
+    def _produce(self):
+        """Fill the oldest queued buffer (lock must be held)"""
+        if not self._queued:
+            self.dropped += 1
+            return
+        index = self._queued.popleft()
+        self._done.append(Done(index, self.sequence, time.monotonic_ns()))
+        self.sequence += 1
+        os.write(self._writer, b"\x01")
+
+    def _start(self, target):
+        self._running = True
+        self._thread = threading.Thread(target=target, name="FakeCamera", daemon=True)
+        self._thread.start()
+
+    def _stop(self):
+        self._running = False
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _ticks(self):
+        period = round(1_000_000_000 / (self.fps or 1_000))
+        deadline = time.monotonic_ns()
+        while self._running:
+            deadline += period
+            sleep_until(deadline)
+            yield
+
+    def _run_streaming(self):
+        for _ in self._ticks():
+            with self._lock:
+                self._produce()
+
+    def start_reading(self) -> None:
+        """
+        Start producing frames for read mode capture (`VideoCapture(device,
+        source=Capability.READWRITE)`). A real driver starts on the first
+        read(); here it must be done explicitly
+        """
+        if self._reading:
+            return
+        size = self.image_size[1]
+        if fcntl.fcntl(self._writer, F_SETPIPE_SZ, size) < size:
+            raise OSError(errno.EMSGSIZE, "frame doesn't fit the pipe")
+        self._reading = True
+        self._start(self._run_reading)
+
+    def _pending_bytes(self) -> int:
+        count = bytearray(4)
+        self._real_ioctl(self._writer, termios.FIONREAD, count)
+        return int.from_bytes(count, "little")
+
+    def _run_reading(self):
+        frame = bytes(self.image_size[1])
+        ticks = self._ticks()
+        while self._running:
+            if self.fps is not None:
+                next(ticks, None)
+            elif self._pending_bytes():
+                time.sleep(0.0001)
+                continue
+            if self._pending_bytes():
+                self.dropped += 1
+                continue
+            # the whole frame fits the pipe so readers never see part of it
+            os.write(self._writer, frame)
+            self.sequence += 1
+        self._reading = False
+
+
+# keep a reference to the real mmap since Hardware patches it
+_real_mmap = mmap.mmap
+
+
+def _plane_map(data):
+    """Anonymous memory map holding a copy of data"""
+    memory = _real_mmap(-1, len(data))
+    memory.write(data)
+    return memory
+
+
+class _FrameMap(mmap.mmap):
+    """Memory map of a Hardware frame (reading the whole map gives the frame itself)"""
+
+    def __new__(cls, hardware):
+        self = super().__new__(cls, -1, len(hardware.frame))
+        self.write(hardware.frame)
+        self.hardware = hardware
+        return self
+
+    def __getitem__(self, item):
+        assert item.start is None
+        assert item.stop == len(self.hardware.frame)
+        assert item.step is None
+        return self.hardware.frame
+
+
+class Hardware:
+    """
+    Scripted fake device for unit tests. While active, opening any file
+    through `linuxpy.io` gives a mock file object and every ioctl, mmap and
+    select goes through this object, which answers with canned values:
+
+    - capture (single or multi-planar with `planes`) of a fixed RGB24 640x480
+      `frame` with MMAP, USERPTR and DMABUF export
+    - integer/boolean controls (brightness, contrast, white balance),
+      extended controls (`ext_values`), events (`events`, `push_ctrl_event`),
+      media requests, frame rate and EDID
+
+    Extra flags for a control can be given in `control_flags` (control id:
+    flags). Unlike `FakeCamera` there is no real file descriptor so it can't
+    be used with the event loop.
+    """
+
+    def __init__(self, filename="/dev/video39"):
+        self.filename = filename
+        self.fd = None
+        self.fds = set()
+        self.fobj = None
+        self.input0_name = b"my camera"
+        self.driver = b"mock"
+        self.card = b"mock camera"
+        self.bus_info = b"mock:usb"
+        self.version = 5 << 16 | 4 << 8 | 12
+        self.version_str = "5.4.12"
+        self.video_capture_state = "OFF"
+        self.blocking = None
+        self.frame = 640 * 480 * 3 * b"\x01"
+        self.fps_capture = 10
+        self.fps_output = 20
+        self.brightness = 55
+        self.contrast = 12
+        self.queued = 0
+        self.exported = []
+        self.userptrs = {}
+        self.capabilities = raw.Capability.STREAMING | raw.Capability.VIDEO_CAPTURE
+        self.planes = None
+        self.ext_values = {}  # extended control id: value (int or bytes payload)
+        self.control_flags = {}  # control id: extra flags reported by QUERY_EXT_CTRL
+        self.events = []
+        self.subscriptions = set()
+        self.requests = {}  # request fd: {"controls": {id: value}, "buffers": [index]}
+        self.edid = bytes(range(0, 256))  # Its not valid edid, just random data for testing
+
+    def __enter__(self):
+        self.stack = contextlib.ExitStack()
+        ioctl = mock.patch("linuxpy.ioctl.fcntl.ioctl", self.ioctl)
+        opener = mock.patch("linuxpy.io.open", self.open)
+        mmap = mock.patch("linuxpy.video.device.mmap.mmap", self.mmap)
+        select = mock.patch("linuxpy.io.IO.select", self.select)
+        blocking = mock.patch("linuxpy.device.os.get_blocking", self.get_blocking)
+        self.stack.enter_context(ioctl)
+        self.stack.enter_context(opener)
+        self.stack.enter_context(mmap)
+        self.stack.enter_context(select)
+        self.stack.enter_context(blocking)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stack.close()
+
+    def open(self, filename, mode, buffering=-1, opener=None):
+        self.fd = randint(100, 1000)
+        self.fds.add(self.fd)
+        self.fobj = mock.MagicMock()
+        self.fobj.__enter__.return_value = self.fobj
+        self.fobj.fileno.return_value = self.fd
+        self.fobj.get_blocking.return_value = False
+        self.fobj.closed = False
+        return self.fobj
+
+    def get_blocking(self, fd):
+        assert fd in self.fds
+        return self.fobj.get_blocking()
+
+    @property
+    def closed(self):
+        return self.fd is not None
+
+    def ioctl(self, fd, ioc, arg=None):  # noqa: C901
+        # assert self.fd == fd
+        if ioc == MEDIA_IOC_REQUEST_ALLOC:
+            request_fd = os.memfd_create("request")
+            self.fds.add(request_fd)
+            self.requests[request_fd] = {"controls": {}, "buffers": []}
+            arg.value = request_fd
+        elif ioc == MEDIA_REQUEST_IOC_QUEUE:
+            request = self.requests[fd]
+            self.brightness = request["controls"].get(9963776, self.brightness)
+        elif ioc == MEDIA_REQUEST_IOC_REINIT:
+            self.requests[fd] = {"controls": {}, "buffers": []}
+        elif isinstance(arg, raw.v4l2_input):
+            if arg.index > 0:
+                raise OSError(errno.EINVAL, "ups!")
+            arg.name = self.input0_name
+            arg.type = raw.InputType.CAMERA
+        elif isinstance(arg, raw.v4l2_query_ext_ctrl):
+            if arg.index == 0:
+                arg.name = b"brightness"
+                arg.type = raw.CtrlType.INTEGER
+                arg.id = 9963776
+                arg.minimum = 10
+                arg.maximum = 127
+                arg.step = 1
+                arg.default_value = 64
+            elif arg.index == 1:
+                arg.name = b"contrast"
+                arg.type = raw.CtrlType.INTEGER
+                arg.id = 9963777
+                arg.flags = raw.ControlFlag.READ_ONLY
+            elif arg.index == 2:
+                arg.name = b"white_balance_automatic"
+                arg.type = raw.CtrlType.BOOLEAN
+                arg.id = 9963788
+                arg.flags = raw.ControlFlag.DISABLED
+            else:
+                raise OSError(errno.EINVAL, "ups!")
+            arg.flags |= self.control_flags.get(arg.id, 0)
+        elif isinstance(arg, raw.v4l2_ext_controls):
+            self.ext_controls(ioc, arg)
+        elif isinstance(arg, raw.v4l2_event_subscription):
+            if ioc == raw.IOC.SUBSCRIBE_EVENT:
+                self.subscriptions.add(arg.id)
+                if arg.flags & 1 and arg.id in {9963776, 9963777, 9963788}:
+                    value = {9963776: self.brightness, 9963777: self.contrast}.get(arg.id, 0)
+                    self.push_ctrl_event(arg.id, ControlChange.VALUE | ControlChange.FLAGS, value=value)
+            elif arg.type == raw.EventType.ALL:
+                self.subscriptions.clear()
+            else:
+                self.subscriptions.discard(arg.id)
+        elif isinstance(arg, raw.v4l2_event):
+            if not self.events:
+                raise OSError(errno.ENOENT, "no events")
+            event = self.events.pop(0)
+            ctypes.memmove(ctypes.addressof(arg), ctypes.addressof(event), ctypes.sizeof(event))
+            arg.pending = len(self.events)
+        elif isinstance(arg, raw.v4l2_capability):
+            arg.driver = self.driver
+            arg.card = self.card
+            arg.bus_info = self.bus_info
+            arg.version = self.version
+            arg.capabilities = self.capabilities
+        elif isinstance(arg, raw.v4l2_format):
+            if ioc == raw.IOC.G_FMT and arg.type == raw.BufType.VIDEO_CAPTURE_MPLANE:
+                arg.fmt.pix_mp.width = 640
+                arg.fmt.pix_mp.height = 480
+                arg.fmt.pix_mp.pixelformat = raw.PixelFormat.NV12M
+                arg.fmt.pix_mp.num_planes = len(self.planes)
+            elif ioc == raw.IOC.G_FMT:
+                arg.fmt.pix.width = 640
+                arg.fmt.pix.height = 480
+                arg.fmt.pix.pixelformat = raw.PixelFormat.RGB24
+                arg.fmt.pix.bytesperline = 640 * 3
+        elif isinstance(arg, raw.v4l2_buffer):
+            if ioc == raw.IOC.QUERYBUF:
+                if arg.type == raw.BufType.VIDEO_CAPTURE_MPLANE:
+                    arg.length = len(self.planes)
+                    for index, plane in enumerate(self.planes):
+                        arg.m.planes[index].length = len(plane)
+                        arg.m.planes[index].m.mem_offset = index << 20
+            elif ioc == raw.IOC.QBUF:
+                self.queued += 1
+                if arg.flags & raw.BufferFlag.REQUEST_FD:
+                    self.requests[arg.request_fd]["buffers"].append(arg.index)
+                if arg.memory == raw.Memory.USERPTR:
+                    assert arg.length >= len(self.frame)
+                    self.userptrs[arg.index] = arg.m.userptr
+            elif ioc == raw.IOC.DQBUF:
+                arg.index = 0
+                if arg.memory == raw.Memory.USERPTR:
+                    ctypes.memmove(self.userptrs.pop(0), self.frame, len(self.frame))
+                if arg.type == raw.BufType.VIDEO_CAPTURE_MPLANE:
+                    arg.length = len(self.planes)
+                    for index, plane in enumerate(self.planes):
+                        arg.m.planes[index].bytesused = len(plane)
+                else:
+                    arg.bytesused = len(self.frame)
+                arg.sequence = 123
+                arg.timestamp.secs = 123
+                arg.timestamp.usecs = 456789
+        elif isinstance(arg, raw.v4l2_exportbuffer):
+            fd = os.memfd_create(f"dmabuf{arg.index}")
+            os.write(fd, self.frame)
+            self.exported.append(fd)
+            arg.fd = fd
+        elif isinstance(arg, raw.v4l2_edid):
+            # Our mock doesn't support pad != 0 at the moment
+            assert arg.pad == 0
+            # Documentation for VIDIOC_G_EDID states that this is maximum value defined by the standard
+            assert arg.blocks <= 256
+            if ioc == raw.IOC.S_EDID:
+                assert arg.start_block == 0
+                self.edid = arg.edid[: arg.blocks * 128]
+            elif ioc == raw.IOC.G_EDID:
+                if arg.blocks == 0 and arg.start_block == 0:
+                    arg.blocks = len(self.edid) // 128
+                else:
+                    blocks_to_copy = len(self.edid) // 128 - arg.start_block
+                    if blocks_to_copy == 0:
+                        raise OSError(errno.ENODATA, "ups!")
+                    blocks_to_copy = min(blocks_to_copy, arg.blocks)
+                    for i in range(blocks_to_copy * 128):
+                        arg.edid[i] = self.edid[arg.start_block * 128 + i]
+                    arg.blocks = blocks_to_copy
+            else:
+                raise OSError(errno.EINVAL, "ups!")
+        elif ioc == raw.IOC.STREAMON:
+            assert arg.value in {raw.BufType.VIDEO_CAPTURE, raw.BufType.VIDEO_CAPTURE_MPLANE}
+            self.video_capture_state = "ON"
+        elif ioc == raw.IOC.STREAMOFF:
+            assert arg.value in {raw.BufType.VIDEO_CAPTURE, raw.BufType.VIDEO_CAPTURE_MPLANE}
+            self.video_capture_state = "OFF"
+        elif ioc == raw.IOC.G_PARM:
+            if arg.type == raw.BufType.VIDEO_CAPTURE:
+                arg.parm.capture.timeperframe.numerator = 1
+                arg.parm.capture.timeperframe.denominator = self.fps_capture
+            elif arg.type == raw.BufType.VIDEO_OUTPUT:
+                arg.parm.output.timeperframe.numerator = 1
+                arg.parm.output.timeperframe.denominator = self.fps_output
+        elif ioc == raw.IOC.S_PARM:
+            if arg.type == raw.BufType.VIDEO_CAPTURE:
+                assert arg.parm.capture.timeperframe.numerator == 1
+                self.fps_capture = arg.parm.capture.timeperframe.denominator
+            elif arg.type == raw.BufType.VIDEO_OUTPUT:
+                assert arg.parm.output.timeperframe.numerator == 1
+                self.fps_output = arg.parm.output.timeperframe.denominator
+        elif ioc == raw.IOC.G_CTRL:
+            if arg.id == 9963776:
+                arg.value = self.brightness
+            elif arg.id == 9963777:
+                arg.value = self.contrast
+            elif arg.id == 9963788:
+                arg.value = 0
+            else:
+                raise OSError(errno.EINVAL, "ups!")
+        elif ioc == raw.IOC.S_CTRL:
+            if arg.id == 9963776:
+                self.brightness = arg.value
+            elif arg.id == 9963777:
+                self.contrast = arg.value
+            else:
+                raise OSError(errno.EINVAL, "ups!")
+        return 0
+
+    def push_ctrl_event(self, id, changes, **fields):
+        event = raw.v4l2_event(type=raw.EventType.CTRL, id=id)
+        event.u.ctrl.changes = changes
+        event.u.ctrl.type = raw.CtrlType.INTEGER
+        for name, value in fields.items():
+            setattr(event.u.ctrl, name, value)
+        self.events.append(event)
+
+    def ext_controls(self, ioc, arg):
+        if arg.which == ControlWhich.REQUEST:
+            controls = self.requests[arg.request_fd]["controls"]
+            for i in range(arg.count):
+                ctrl = arg.controls[i]
+                if ioc == raw.IOC.G_EXT_CTRLS:
+                    ctrl.value = controls[ctrl.id]
+                elif ioc == raw.IOC.S_EXT_CTRLS:
+                    controls[ctrl.id] = ctrl.value
+            return
+        values = {9963776: self.brightness, 9963777: self.contrast, 9963788: 0, **self.ext_values}
+        for i in range(arg.count):
+            ctrl = arg.controls[i]
+            if ctrl.id not in values:
+                arg.error_idx = i
+                raise OSError(errno.EINVAL, "ups!")
+            value = values[ctrl.id]
+            if ioc == raw.IOC.G_EXT_CTRLS:
+                if isinstance(value, bytes):
+                    ctypes.memmove(ctrl.ptr, value, len(value))
+                    ctrl.size = len(value)
+                else:
+                    ctrl.value64 = value
+            elif ioc == raw.IOC.TRY_EXT_CTRLS and ctrl.id == 9963776:
+                ctrl.value = min(max(ctrl.value, 10), 127)
+        if ioc != raw.IOC.S_EXT_CTRLS:
+            return
+        # validate everything before applying anything (atomic)
+        for i in range(arg.count):
+            if arg.controls[i].id == 9963777:
+                arg.error_idx = arg.count
+                raise OSError(errno.EACCES, "read-only")
+        for i in range(arg.count):
+            ctrl = arg.controls[i]
+            if ctrl.id == 9963776:
+                self.brightness = ctrl.value
+            elif ctrl.size:
+                self.ext_values[ctrl.id] = ctypes.string_at(ctrl.ptr, ctrl.size)
+            else:
+                self.ext_values[ctrl.id] = ctrl.value64
+
+    def mmap(self, fd, length, offset):
+        assert fd in self.fds or fd in self.exported
+        if self.planes is not None:
+            plane = self.planes[offset >> 20]
+            assert length == len(plane)
+            return _plane_map(plane)
+        return _FrameMap(self)
+
+    def select(self, readers, writers, other, timeout=None):
+        assert (readers or writers or other)[0].fileno() in self.fds
+        return readers, writers, other
+
+
+class M2MHardware(Hardware):
+    """
+    Memory to memory fake: each input buffer gives one capture buffer with
+    the input bytes reversed. With *decoder* it accepts the decoder STOP
+    command and marks the last buffer. A source change is simulated before
+    processing input number *resize_at*. *output_planes* gives the
+    (sizeimage, memory length) of each plane of a multi-planar output queue
+    """
+
+    def __init__(self, decoder=True, resize_at=None, output_planes=None):
+        super().__init__("/dev/video40")
+        self.output_planes = output_planes
+        self.capabilities = raw.Capability.STREAMING | raw.Capability.VIDEO_M2M
+        self.decoder = decoder
+        self.resize_at = resize_at
+        self.capture_size = 16
+        self.memory = {}  # mmap offset: memory
+        self.streaming = set()
+        self.inputs = []  # (index, data) queued in OUTPUT
+        self.input_timestamps = []
+        self.output_stamps = {}  # output index: timestamp of its last QBUF (given back on DQBUF)
+        self.output_done = []
+        self.capture_free = []
+        self.capture_done = []  # (index, bytesused, flags)
+        self.processed = 0
+        self.stopping = False
+        self.last_sent = False
+        self.resizing = False
+        self.pipe = None
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.pipe is not None:
+            for fd in self.pipe:
+                os.close(fd)
+        return super().__exit__(exc_type, exc_value, tb)
+
+    def poll_output(self):
+        """
+        Make the device fd a pipe which is writable only while an output
+        buffer is done, so the event loop can wait on it
+        """
+        self.pipe = os.pipe()
+        for fd in self.pipe:
+            os.set_blocking(fd, False)
+        self.fds.add(self.pipe[1])
+        self.fobj.fileno.return_value = self.pipe[1]
+        self.sync_pipe()
+
+    def sync_pipe(self):
+        if self.pipe is None:
+            return
+        read_end, write_end = self.pipe
+        with contextlib.suppress(BlockingIOError):
+            while True:
+                if self.output_done:
+                    os.read(read_end, 1 << 16)
+                else:
+                    os.write(write_end, bytes(1 << 16))
+
+    def complete_output(self, index):
+        self.output_done.append(index)
+        self.sync_pipe()
+
+    def ioctl(self, fd, ioc, arg):
+        if isinstance(arg, raw.v4l2_requestbuffers):
+            self.request_buffers(arg)
+        elif isinstance(arg, raw.v4l2_buffer):
+            self.buffer(ioc, arg)
+        elif isinstance(arg, raw.v4l2_format):
+            if arg.type == raw.BufType.VIDEO_CAPTURE and ioc == raw.IOC.G_FMT:
+                arg.fmt.pix.width = self.capture_size
+                arg.fmt.pix.height = 1
+                arg.fmt.pix.pixelformat = raw.PixelFormat.GREY
+                arg.fmt.pix.bytesperline = self.capture_size
+                arg.fmt.pix.sizeimage = self.capture_size
+            elif arg.type == raw.BufType.VIDEO_OUTPUT and ioc == raw.IOC.G_FMT:
+                arg.fmt.pix.width = 64
+                arg.fmt.pix.height = 1
+                arg.fmt.pix.pixelformat = raw.PixelFormat.GREY
+                arg.fmt.pix.bytesperline = 64
+                arg.fmt.pix.sizeimage = 64
+            elif arg.type == raw.BufType.VIDEO_OUTPUT_MPLANE and ioc == raw.IOC.G_FMT:
+                arg.fmt.pix_mp.width = 4
+                arg.fmt.pix_mp.height = 1
+                arg.fmt.pix_mp.pixelformat = raw.PixelFormat.YUV420M
+                arg.fmt.pix_mp.num_planes = len(self.output_planes)
+                for index, (sizeimage, _) in enumerate(self.output_planes):
+                    arg.fmt.pix_mp.plane_fmt[index].sizeimage = sizeimage
+        elif isinstance(arg, raw.v4l2_fmtdesc):
+            raise OSError(errno.EINVAL, "ups!")
+        elif isinstance(arg, raw.v4l2_decoder_cmd):
+            if not self.decoder:
+                raise OSError(errno.ENOTTY, "not a decoder")
+            assert arg.cmd == DecoderCommand.STOP
+            self.stopping = True
+        elif isinstance(arg, raw.v4l2_encoder_cmd):
+            raise OSError(errno.ENOTTY, "not an encoder")
+        elif ioc in {raw.IOC.STREAMON, raw.IOC.STREAMOFF}:
+            buffer_type = raw.BufType(arg.value)
+            if ioc == raw.IOC.STREAMON:
+                self.streaming.add(buffer_type)
+            else:
+                self.streaming.discard(buffer_type)
+                if buffer_type == raw.BufType.VIDEO_CAPTURE:
+                    self.capture_free.clear()
+                    self.capture_done.clear()
+                    self.last_sent = self.resizing = False
+        else:
+            return super().ioctl(fd, ioc, arg)
+        return 0
+
+    def offset(self, buffer_type, index):
+        return (buffer_type << 24) | (index << 12)
+
+    def request_buffers(self, arg):
+        for offset in [offset for offset in self.memory if offset >> 24 == arg.type]:
+            del self.memory[offset]
+        if arg.type == raw.BufType.VIDEO_OUTPUT_MPLANE:
+            for index in range(arg.count):
+                for plane, (_, length) in enumerate(self.output_planes):
+                    self.memory[self.offset(arg.type, index) | plane << 8] = _real_mmap(-1, length)
+            return
+        size = self.capture_size if arg.type == raw.BufType.VIDEO_CAPTURE else 64
+        for index in range(arg.count):
+            self.memory[self.offset(arg.type, index)] = _real_mmap(-1, size)
+
+    def buffer(self, ioc, arg):
+        if ioc == raw.IOC.QUERYBUF and arg.type == raw.BufType.VIDEO_OUTPUT_MPLANE:
+            arg.length = len(self.output_planes)
+            for plane, (_, length) in enumerate(self.output_planes):
+                arg.m.planes[plane].length = length
+                arg.m.planes[plane].m.mem_offset = self.offset(arg.type, arg.index) | plane << 8
+        elif ioc == raw.IOC.QUERYBUF:
+            offset = self.offset(arg.type, arg.index)
+            arg.length = len(self.memory[offset])
+            arg.m.offset = offset
+        elif ioc == raw.IOC.QBUF:
+            if arg.type == raw.BufType.VIDEO_OUTPUT_MPLANE:
+                offset = self.offset(arg.type, arg.index)
+                planes = [arg.m.planes[plane] for plane in range(len(self.output_planes))]
+                data = [self.memory[offset | index << 8][: plane.bytesused] for index, plane in enumerate(planes)]
+                self.inputs.append((arg.index, data))
+            elif arg.type == raw.BufType.VIDEO_OUTPUT:
+                if arg.memory == raw.Memory.USERPTR:
+                    data = ctypes.string_at(arg.m.userptr, arg.bytesused)
+                elif arg.memory == raw.Memory.DMABUF:
+                    data = os.pread(arg.m.fd, arg.bytesused, 0)
+                else:
+                    data = self.memory[self.offset(arg.type, arg.index)][: arg.bytesused]
+                self.inputs.append((arg.index, data))
+                self.input_timestamps.append(arg.timestamp.secs * 1_000_000 + arg.timestamp.usecs)
+                self.output_stamps[arg.index] = (arg.timestamp.secs, arg.timestamp.usecs)
+            else:
+                self.capture_free.append(arg.index)
+        elif ioc == raw.IOC.DQBUF:
+            if arg.type in {raw.BufType.VIDEO_OUTPUT, raw.BufType.VIDEO_OUTPUT_MPLANE}:
+                if not self.output_done:
+                    raise OSError(errno.EAGAIN, "no output buffer")
+                arg.index = self.output_done.pop(0)
+                arg.timestamp.secs, arg.timestamp.usecs = self.output_stamps.get(arg.index, (0, 0))
+                self.sync_pipe()
+            elif self.capture_done:
+                arg.index, arg.bytesused, arg.flags = self.capture_done.pop(0)
+            elif self.last_sent:
+                raise OSError(errno.EPIPE, "last buffer already dequeued")
+            else:
+                raise OSError(errno.EAGAIN, "no capture buffer")
+
+    def run(self):
+        streaming = {raw.BufType.VIDEO_OUTPUT, raw.BufType.VIDEO_CAPTURE} <= self.streaming
+        while streaming and self.capture_free and not self.resizing:
+            if self.inputs:
+                if self.processed == self.resize_at:
+                    self.capture_size *= 2
+                    self.resizing = True
+                    self.events.append(raw.v4l2_event(type=raw.EventType.SOURCE_CHANGE))
+                    self.capture_done.append((self.capture_free.pop(0), 0, raw.BufferFlag.LAST))
+                    self.last_sent = True
+                    self.resize_at = None
+                    break
+                index, data = self.inputs.pop(0)
+                capture_index = self.capture_free.pop(0)
+                memory = self.memory[self.offset(raw.BufType.VIDEO_CAPTURE, capture_index)]
+                memory[: len(data)] = data[::-1]
+                flags = raw.BufferFlag.LAST if self.stopping and not self.inputs else 0
+                self.capture_done.append((capture_index, len(data), flags))
+                self.output_done.append(index)
+                self.processed += 1
+                self.last_sent = bool(flags)
+            elif self.stopping and not self.last_sent:
+                self.capture_done.append((self.capture_free.pop(0), 0, raw.BufferFlag.LAST))
+                self.last_sent = True
+            else:
+                break
+
+    def mmap(self, fd, length, offset):
+        if fd in self.exported:
+            return _real_mmap(fd, length, offset=offset)
+        assert fd in self.fds
+        memory = self.memory[offset]
+        assert length == len(memory)
+        return memory
+
+    def select(self, readers, writers, other, timeout=None):
+        self.run()
+        readable = readers if self.capture_done or self.last_sent else []
+        writable = writers if self.output_done else []
+        exceptional = other if self.events else []
+        return readable, writable, exceptional
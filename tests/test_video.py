@@ -4,9 +4,16 @@
 # Copyright (c) 2023 Tiago Coutinho
 # Distributed under the GPLv3 license. See LICENSE for more info.
 
+import asyncio
+import collections
+import json
+import multiprocessing
 import os
 import subprocess
-from contextlib import ExitStack, contextmanager
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from errno import EINVAL
 from functools import cache
 from inspect import isgenerator
@@ -23,19 +30,54 @@ except ImportError:
     numpy = None
 
 from linuxpy.device import device_number
-from linuxpy.video import raw
+from linuxpy.ioctl import ioctl
+from linuxpy.video import raw, record, stream
+from linuxpy.video.benchmark import benchmark
 from linuxpy.video.device import (
     BufferType,
     Capability,
+    ControlCache,
+    ControlChange,
     ControlClass,
     Device,
+    DmaBuf,
+    DropPolicy,
+    EventReader,
+    Format,
+    Frame,
+    FrameGrouper,
+    FrameReader,
+    FrameRing,
+    FrameWriter,
+    InfoCache,
+    LagStats,
+    LazyInfo,
+    LeasedFrame,
+    M2MSession,
+    MediaDevice,
     Memory,
+    MultiCapture,
+    PacedOutput,
+    PacingStats,
     PixelFormat,
+    PoolBuffers,
+    UserPtr,
+    V4L2Error,
     VideoCapture,
     VideoOutput,
+    WritableFrame,
+    get_ext_controls,
     iter_devices,
+    iter_video_capture_nodes,
     iter_video_files,
+    iter_video_nodes,
+    iter_video_output_nodes,
+    set_ext_controls,
 )
+from linuxpy.video.record import RawReader, Recorder, RingReader, RingRecorder, export_records, iter_avi_frames
+from linuxpy.video.shm import SHM_PATH, SharedFramePublisher, SharedFrameSubscriber
+from linuxpy.video.stream import StreamServer
+from linuxpy.video.testing import FakeCamera, Hardware, M2MHardware
 
 
 @contextmanager
@@ -50,195 +92,32 @@ def video_files(paths=("/dev/video99")):
                 yield paths
 
 
-class MemoryMap:
-    def __init__(self, hardware):
-        self.hardware = hardware
-
-    def __getitem__(self, item):
-        assert item.start is None
-        assert item.stop == len(self.hardware.frame)
-        assert item.step is None
-        return self.hardware.frame
-
-    def close(self):
-        pass
-
-
-class Hardware:
-    def __init__(self, filename="/dev/video39"):
-        self.filename = filename
-        self.fd = None
-        self.fobj = None
-        self.input0_name = b"my camera"
-        self.driver = b"mock"
-        self.card = b"mock camera"
-        self.bus_info = b"mock:usb"
-        self.version = 5 << 16 | 4 << 8 | 12
-        self.version_str = "5.4.12"
-        self.video_capture_state = "OFF"
-        self.blocking = None
-        self.frame = 640 * 480 * 3 * b"\x01"
-        self.fps_capture = 10
-        self.fps_output = 20
-        self.brightness = 55
-        self.contrast = 12
-        self.edid = bytes(range(0, 256))  # Its not valid edid, just random data for testing
-
-    def __enter__(self):
-        self.stack = ExitStack()
-        ioctl = mock.patch("linuxpy.ioctl.fcntl.ioctl", self.ioctl)
-        opener = mock.patch("linuxpy.io.open", self.open)
-        mmap = mock.patch("linuxpy.video.device.mmap.mmap", self.mmap)
-        select = mock.patch("linuxpy.io.IO.select", self.select)
-        blocking = mock.patch("linuxpy.device.os.get_blocking", self.get_blocking)
-        self.stack.enter_context(ioctl)
-        self.stack.enter_context(opener)
-        self.stack.enter_context(mmap)
-        self.stack.enter_context(select)
-        self.stack.enter_context(blocking)
-        return self
-
-    def __exit__(self, exc_type, exc_value, tb):
-        self.stack.close()
-
-    def open(self, filename, mode, buffering=-1, opener=None):
-        self.fd = randint(100, 1000)
-        self.fobj = mock.Mock()
-        self.fobj.fileno.return_value = self.fd
-        self.fobj.get_blocking.return_value = False
-        self.fobj.closed = False
-        return self.fobj
-
-    def get_blocking(self, fd):
-        assert self.fd == fd
-        return self.fobj.get_blocking()
-
-    @property
-    def closed(self):
-        return self.fd is not None
-
-    def ioctl(self, fd, ioc, arg):  # noqa: C901
-        # assert self.fd == fd
-        if isinstance(arg, raw.v4l2_input):
-            if arg.index > 0:
-                raise OSError(EINVAL, "ups!")
-            arg.name = self.input0_name
-            arg.type = raw.InputType.CAMERA
-        elif isinstance(arg, raw.v4l2_query_ext_ctrl):
-            if arg.index == 0:
-                arg.name = b"brightness"
-                arg.type = raw.CtrlType.INTEGER
-                arg.id = 9963776
-                arg.minimum = 10
-                arg.maximum = 127
-                arg.step = 1
-                arg.default_value = 64
-            elif arg.index == 1:
-                arg.name = b"contrast"
-                arg.type = raw.CtrlType.INTEGER
-                arg.id = 9963777
-                arg.flags = raw.ControlFlag.READ_ONLY
-            elif arg.index == 2:
-                arg.name = b"white_balance_automatic"
-                arg.type = raw.CtrlType.BOOLEAN
-                arg.id = 9963788
-                arg.flags = raw.ControlFlag.DISABLED
-            else:
-                raise OSError(EINVAL, "ups!")
-        elif isinstance(arg, raw.v4l2_capability):
-            arg.driver = self.driver
-            arg.card = self.card
-            arg.bus_info = self.bus_info
-            arg.version = self.version
-            arg.capabilities = raw.Capability.STREAMING | raw.Capability.VIDEO_CAPTURE
-        elif isinstance(arg, raw.v4l2_format):
-            if ioc == raw.IOC.G_FMT:
-                arg.fmt.pix.width = 640
-                arg.fmt.pix.height = 480
-                arg.fmt.pix.pixelformat = raw.PixelFormat.RGB24
-        elif isinstance(arg, raw.v4l2_buffer):
-            if ioc == raw.IOC.QUERYBUF:
-                pass
-            elif ioc == raw.IOC.DQBUF:
-                arg.index = 0
-                arg.bytesused = len(self.frame)
-                arg.sequence = 123
-                arg.timestamp.secs = 123
-                arg.timestamp.usecs = 456789
-        elif isinstance(arg, raw.v4l2_edid):
-            # Our mock doesn't support pad != 0 at the moment
-            assert arg.pad == 0
-            # Documentation for VIDIOC_G_EDID states that this is maximum value defined by the standard
-            assert arg.blocks <= 256
-            if ioc == raw.IOC.S_EDID:
-                assert arg.start_block == 0
-                self.edid = arg.edid[: arg.blocks * 128]
-            elif ioc == raw.IOC.G_EDID:
-                if arg.blocks == 0 and arg.start_block == 0:
-                    arg.blocks = len(self.edid) // 128
-                else:
-                    blocks_to_copy = len(self.edid) // 128 - arg.start_block
-                    if blocks_to_copy == 0:
-                        raise OSError(ENODATA, "ups!")
-                    blocks_to_copy = min(blocks_to_copy, arg.blocks)
-                    for i in range(blocks_to_copy * 128):
-                        arg.edid[i] = self.edid[arg.start_block * 128 + i]
-                    arg.blocks = blocks_to_copy
-            else:
-                raise OSError(EINVAL, "ups!")
-        elif ioc == raw.IOC.STREAMON:
-            assert arg.value == raw.BufType.VIDEO_CAPTURE
-            self.video_capture_state = "ON"
-        elif ioc == raw.IOC.STREAMOFF:
-            assert arg.value == raw.BufType.VIDEO_CAPTURE
-            self.video_capture_state = "OFF"
-        elif ioc == raw.IOC.G_PARM:
-            if arg.type == raw.BufType.VIDEO_CAPTURE:
-                arg.parm.capture.timeperframe.numerator = 1
-                arg.parm.capture.timeperframe.denominator = self.fps_capture
-            elif arg.type == raw.BufType.VIDEO_OUTPUT:
-                arg.parm.output.timeperframe.numerator = 1
-                arg.parm.output.timeperframe.denominator = self.fps_output
-        elif ioc == raw.IOC.S_PARM:
-            if arg.type == raw.BufType.VIDEO_CAPTURE:
-                assert arg.parm.capture.timeperframe.numerator == 1
-                self.fps_capture = arg.parm.capture.timeperframe.denominator
-            elif arg.type == raw.BufType.VIDEO_OUTPUT:
-                assert arg.parm.output.timeperframe.numerator == 1
-                self.fps_output = arg.parm.output.timeperframe.denominator
-        elif ioc == raw.IOC.G_CTRL:
-            if arg.id == 9963776:
-                arg.value = self.brightness
-            elif arg.id == 9963777:
-                arg.value = self.contrast
-            elif arg.id == 9963788:
-                arg.value = 0
-            else:
-                raise OSError(EINVAL, "ups!")
-        elif ioc == raw.IOC.S_CTRL:
-            if arg.id == 9963776:
-                self.brightness = arg.value
-            elif arg.id == 9963777:
-                self.contrast = arg.value
-            else:
-                raise OSError(EINVAL, "ups!")
-        return 0
-
-    def mmap(self, fd, length, offset):
-        assert self.fd == fd
-        return MemoryMap(self)
-
-    def select(self, readers, writers, other, timeout=None):
-        assert readers[0].fileno() == self.fd
-        return readers, writers, other
-
-
 @fixture
 def hardware():
     with Hardware() as hardware:
         yield hardware
 
 
+@fixture
+def fake_camera():
+    with FakeCamera(640, 480, "RGB24", fps=None, buffers=2) as camera:
+        yield camera
+
+
+def assert_fake_frame(frame, camera):
+    """Helper to check a frame captured from a FakeCamera"""
+    assert frame.width == 640
+    assert frame.height == 480
+    assert frame.pixel_format == PixelFormat.RGB24
+    assert frame.type == BufferType.VIDEO_CAPTURE
+    assert 0 <= frame.frame_nb < camera.sequence
+    assert frame.timestamp <= time.monotonic()
+    assert len(frame) == frame.nbytes == 640 * 480 * 3
+    assert bytes(frame) == bytes(640 * 480 * 3)
+    if numpy:
+        assert frame.array.shape == (480, 640, 3)
+
+
 def assert_frame(frame, camera):
     """Helper to compare frame with hardware frame"""
     assert frame.data == camera.frame
@@ -253,7 +132,8 @@ def assert_frame(frame, camera):
     assert len(frame) == len(camera.frame)
     assert frame.nbytes == len(camera.frame)
     if numpy:
-        assert numpy.all(frame.array == numpy.frombuffer(camera.frame, dtype="u1"))
+        assert frame.array.shape == (480, 640, 3)
+        assert numpy.all(frame.array == numpy.frombuffer(camera.frame, dtype="u1").reshape(480, 640, 3))
 
 
 @test("device number")
@@ -483,6 +363,1544 @@ def _(camera=hardware):
                 break
 
 
+@test("leased video capture acquisition")
+def _(camera=fake_camera):
+    with camera.device() as device:
+        # without fps the camera fills a buffer as soon as it is queued
+        with VideoCapture(device, lease=True) as video_capture:
+            queued = camera.sequence
+            frame = next(iter(video_capture))
+            assert isinstance(frame, LeasedFrame)
+            assert isinstance(frame.data, memoryview)
+            assert_fake_frame(frame, camera)
+            assert not frame.released
+            assert camera.sequence == queued
+            frame.release()
+            assert frame.released
+            assert camera.sequence == queued + 1
+            frame.release()
+            assert camera.sequence == queued + 1
+
+            with next(iter(video_capture)) as frame:
+                assert camera.sequence == queued + 1
+            assert camera.sequence == queued + 2
+
+            frame = next(iter(video_capture))
+        assert frame.released
+        assert camera.sequence == queued + 2
+        assert not camera.streaming
+
+
+@skip(when=numpy is None, reason="numpy is not installed")
+@test("leased frame is not given back while its array is alive")
+def _(camera=fake_camera):
+    with camera.device() as device:
+        with VideoCapture(device, lease=True) as video_capture:
+            frame = next(iter(video_capture))
+            array = frame.array
+            queued = camera.sequence
+            with raises(BufferError):
+                frame.release()
+            assert not frame.released
+            assert camera.sequence == queued
+            del array
+            frame.release()
+            assert frame.released
+            assert camera.sequence == queued + 1
+
+            # garbage collection doesn't give it back either
+            frame = next(iter(video_capture))
+            array = frame.array
+            del frame
+            assert camera.sequence == queued + 1
+            del array
+
+            frame = next(iter(video_capture))
+            array = frame.array
+        # buffers are freed even if some memory is still referenced
+        assert frame.released
+        assert not camera.streaming
+        assert camera._nb_buffers == 0
+        assert array.shape == (480, 640, 3)
+        assert not array.any()
+
+
+@test("DMABUF export and import")
+def _(camera=hardware):
+    with Device(camera.filename) as device:
+        with VideoCapture(device) as source:
+            fds = source.buffer.export_buffers()
+            assert len(fds) == 2
+            assert fds == camera.exported
+            assert source.buffer.export_buffers() is fds
+
+            with VideoCapture(device, source=Memory.DMABUF, pool=fds) as capture:
+                assert isinstance(capture.buffer, DmaBuf)
+                queued = camera.queued
+                frame = next(iter(capture))
+                assert_frame(frame, camera)
+                assert frame.memory == Memory.DMABUF
+                assert camera.queued == queued + 1
+        for fd in fds:
+            with raises(OSError):
+                os.fstat(fd)
+
+
+@test("DMABUF output write")
+def _():
+    pool = [os.memfd_create(f"output{index}") for index in range(2)]
+    for fd in pool:
+        os.ftruncate(fd, 64)
+    with M2MHardware() as hardware:
+        hardware.exported = pool
+        with Device(hardware.filename) as device:
+            with VideoOutput(device, sink=Memory.DMABUF, pool=pool) as output:
+                assert isinstance(output.buffer, DmaBuf)
+                output.write(b"hello")
+                output.write(memoryview(b"world"))
+                assert hardware.inputs == [(0, b"hello"), (1, b"world")]
+                # slots are queued as they are, without copy
+                hardware.output_done.append(0)
+                output.buffer.write_buffer(0, 4)
+                assert hardware.inputs[-1] == (0, b"hell")
+                assert os.pread(pool[1], 5, 0) == b"world"
+    for fd in pool:
+        os.close(fd)
+
+
+@test("USERPTR capture into caller owned buffers")
+def _(camera=hardware):
+    pool = [bytearray(len(camera.frame)) for _ in range(3)]
+    with Device(camera.filename) as device:
+        with VideoCapture(device, source=Memory.USERPTR, pool=pool) as capture:
+            assert isinstance(capture.buffer, UserPtr)
+            assert set(camera.userptrs) == {0, 1, 2}
+            with next(iter(capture)) as frame:
+                assert frame.memory == Memory.USERPTR
+                assert_frame(frame, camera)
+                assert pool[frame.index] == camera.frame
+                assert 0 not in camera.userptrs
+            assert 0 in camera.userptrs
+
+    with raises(V4L2Error):
+        UserPtr(VideoCapture(device), [b"read only"])
+
+
+@test("incomplete pool buffers fail on creation")
+def _(camera=hardware):
+    class Incomplete(PoolBuffers):
+        memory_type = Memory.USERPTR
+
+        def memory(self, index):
+            return self.pool[index]
+
+    with Device(camera.filename) as device:
+        with raises(TypeError):
+            Incomplete(VideoCapture(device), [bytearray(8)])
+
+
+@test("multi-planar video capture acquisition")
+def _(camera=hardware, lease=each(False, True)):
+    camera.capabilities |= raw.Capability.VIDEO_CAPTURE_MPLANE
+    camera.planes = [640 * 480 * b"\x01", 640 * 240 * b"\x02"]
+    with Device(camera.filename) as device:
+        capture = VideoCapture(device, buffer_type=BufferType.VIDEO_CAPTURE_MPLANE, lease=lease)
+        with capture:
+            frame = next(iter(capture))
+            assert frame.type == BufferType.VIDEO_CAPTURE_MPLANE
+            assert frame.pixel_format == PixelFormat.NV12M
+            assert len(frame.planes) == 2
+            assert [bytes(plane) for plane in frame.planes] == camera.planes
+            assert bytes(frame) == b"".join(camera.planes)
+            assert len(frame) == frame.nbytes == 640 * 480 * 3 // 2
+            if lease:
+                assert all(isinstance(plane, memoryview) for plane in frame.planes)
+                queued = camera.queued
+                frame.release()
+                assert camera.queued == queued + 1
+            else:
+                assert frame.data == b"".join(camera.planes)
+
+    camera.capabilities = raw.Capability.STREAMING | raw.Capability.VIDEO_CAPTURE
+    with Device(camera.filename) as device:
+        with raises(V4L2Error):
+            with VideoCapture(device, buffer_type=BufferType.VIDEO_CAPTURE_MPLANE):
+                pass
+
+
+def sequence_frames(*sequences):
+    fmt = Format(640, 480, PixelFormat.RGB24)
+    for sequence in sequences:
+        buff = raw.v4l2_buffer()
+        buff.sequence = sequence
+        yield Frame(b"", buff, fmt)
+
+
+@test("frame reader counts frames lost in sequence gaps")
+def _(camera=hardware):
+    with Device(camera.filename) as device:
+        frames = sequence_frames(10, 11, 14, 15, 20)
+        reader = FrameReader(device, lambda: next(frames))
+        assert [reader.read().frame_nb for _ in range(5)] == [10, 11, 14, 15, 20]
+        assert reader.stats == (5, 0, 6)
+        reader.reset_stats()
+        assert reader.stats == (0, 0, 0)
+
+
+def mock_reader_loop(reader):
+    loop = asyncio.get_running_loop()
+    reader._loop = mock.Mock()
+    reader._loop.create_future = loop.create_future
+    reader._selector = mock.Mock()
+    reader._buffer = collections.deque()
+
+
+async def feed_reader(reader, nb_frames):
+    mock_reader_loop(reader)
+    for _ in range(nb_frames):
+        if reader._paused:
+            break
+        reader._on_event()
+    result = []
+    while reader._buffer:
+        result.append((await reader.aread()).frame_nb)
+    return result
+
+
+@test("frame reader drop policy")
+async def _(
+    camera=hardware,
+    policy=each(DropPolicy.LATEST, DropPolicy.DROP_OLDEST, DropPolicy.DROP_NEWEST, DropPolicy.BLOCK),
+    expected=each([4], [3, 4], [0, 1], [0, 1]),
+    dropped=each(4, 3, 3, 0),
+):
+    with Device(camera.filename) as device:
+        frames = sequence_frames(*range(5))
+        reader = FrameReader(device, lambda: next(frames), max_queue_size=2, drop_policy=policy)
+        assert await feed_reader(reader, 5) == expected
+        assert reader.stats.dropped == dropped
+        assert reader.stats.lost == 0
+        if policy == DropPolicy.BLOCK:
+            assert reader.stats.frames == 2
+            reader._loop.remove_reader.assert_called_once()
+            reader._loop.add_reader.assert_called_once()
+            assert not reader._paused
+
+
+@test("frame reader hands frames to a waiting consumer and reports lag")
+async def _(camera=hardware):
+    with Device(camera.filename) as device:
+        released, sequences = [], iter(range(10))
+        fmt = Format(640, 480, PixelFormat.RGB24)
+
+        def lease():
+            buff = raw.v4l2_buffer()
+            buff.sequence = next(sequences)
+            buff.flags = raw.BufferFlag.TIMESTAMP_MONOTONIC
+            now = time.monotonic() - 0.5
+            buff.timestamp.secs, buff.timestamp.usecs = int(now), int(now % 1 * 1_000_000)
+            return LeasedFrame(memoryview(b""), buff, fmt, released.append)
+
+        reader = FrameReader(device, lease, max_queue_size=2, drop_policy=DropPolicy.BLOCK)
+        mock_reader_loop(reader)
+        consumer = asyncio.create_task(reader.aread())
+        await asyncio.sleep(0)
+        reader._on_event()
+        frame = await consumer
+        assert frame.frame_nb == 0
+        queued, delay, max_delay = reader.lag
+        assert queued == 0
+        assert 0.5 <= delay < 5
+        assert max_delay == delay
+        frame.release()
+        assert len(released) == 1
+
+        reader._on_event()
+        reader._on_event()
+        assert reader._paused
+        assert reader.lag.queued == 2
+        assert (await reader.aread()).frame_nb == 1
+        assert not reader._paused
+
+        # errors reach the consumer in order
+        reader.raw_read = mock.Mock(side_effect=OSError(EINVAL, "invalid"))
+        reader._on_event()
+        assert (await reader.aread()).frame_nb == 2
+        with raises(OSError):
+            await reader.aread()
+
+        # leased frames still queued are given back on exit
+        reader.raw_read = lease
+        reader._on_event()
+        await reader.__aexit__(None, None, None)
+        assert released[-1].sequence == 3
+        reader.reset_stats()
+        assert reader.lag == LagStats(0, 0.0, 0.0)
+
+
+@test("frame ring fan-out to subscribers")
+def _(camera=hardware):
+    with Device(camera.filename) as device:
+        ring = FrameRing(VideoCapture(device), size=4)
+        # drive the ring by hand to make the test deterministic
+        ring._running = True
+        fast, slow = ring.subscribe(), ring.subscribe()
+        for frame in sequence_frames(*range(6)):
+            ring._publish(frame)
+            assert fast.read().frame_nb == frame.frame_nb
+        assert fast.stats == (6, 0, 0)
+        assert slow.lag == 4
+        assert [slow.read().frame_nb for _ in range(4)] == [2, 3, 4, 5]
+        assert slow.stats == (4, 2, 0)
+        assert slow.read(timeout=0.01) is None
+        ring._running = False
+        assert slow.read() is None
+        assert list(slow) == []
+
+        with raises(V4L2Error):
+            FrameRing(VideoCapture(device, lease=True))
+
+
+@test("frame ring background capture")
+async def _(camera=fake_camera):
+    with camera.device() as device:
+        with FrameRing(VideoCapture(device), size=4) as ring:
+            subscriber = ring.subscribe()
+            frame = subscriber.read(timeout=1)
+            assert_fake_frame(frame, camera)
+            async for frame in ring.subscribe():
+                assert_fake_frame(frame, camera)
+                break
+        assert not ring.is_running
+        assert ring.error is None
+        assert not camera.streaming
+
+
+def timestamp_frames(*timestamps):
+    for frame, timestamp in zip(sequence_frames(*range(len(timestamps))), timestamps):
+        frame.buff.timestamp.secs = int(timestamp)
+        frame.buff.timestamp.usecs = round((timestamp % 1) * 1_000_000)
+        yield frame
+
+
+@test("frame grouper matches timestamps within tolerance")
+def _():
+    grouper = FrameGrouper(2, tolerance=0.005, depth=2)
+    left = list(timestamp_frames(1.0, 1.1, 1.2, 1.3, 1.4))
+    right = list(timestamp_frames(1.003, 1.15, 1.202, 1.5))
+    assert grouper.push(0, left[0]) is None
+    assert grouper.push(1, right[0]) == (left[0], right[0])
+    assert grouper.push(0, left[1]) is None
+    # 1.1 and 1.15 can't be matched
+    assert grouper.push(1, right[1]) is None
+    assert grouper.dropped == 1
+    assert grouper.push(0, left[2]) is None
+    assert grouper.dropped == 2
+    assert grouper.push(1, right[2]) == (left[2], right[2])
+    assert grouper.push(0, left[3]) is None
+    assert grouper.push(0, left[4]) is None
+    assert grouper.push(1, right[3]) is None
+    assert grouper.dropped == 4
+
+
+@test("multi capture reads ready devices from a single epoll")
+def _():
+    with FakeCamera(64, 48, "GREY", fps=None, buffers=2) as left_camera:
+        with FakeCamera(64, 48, "GREY", fps=None, buffers=2) as right_camera:
+            with left_camera.device() as left, right_camera.device() as right:
+                captures = [VideoCapture(left), VideoCapture(right)]
+                with MultiCapture(captures) as multi:
+                    assert left_camera.streaming and right_camera.streaming
+                    ready = multi.read(timeout=1)
+                    assert {capture for capture, _ in ready} == set(captures)
+                    for _, frame in ready:
+                        assert len(frame) == 64 * 48
+                    # read() only takes one frame per device: both have more
+                    assert len(multi.read(timeout=1)) == 2
+                    group = next(multi.groups(tolerance=1))
+                    assert len(group) == 2
+                    assert all(frame.pixel_format == PixelFormat.GREY for frame in group)
+                    assert multi.grouper.dropped == 0
+                assert not left_camera.streaming
+                assert not right_camera.streaming
+
+
+def yuv_to_rgb(y, u, v):
+    c, d, e = 298 * (y - 16) + 128, u - 128, v - 128
+    return tuple(min(max(x >> 8, 0), 255) for x in (c + 409 * e, c - 100 * d - 208 * e, c + 516 * d))
+
+
+def pack_yuv(pixel_format, y, u, v):
+    """Pack planes into pixel_format. u and v have 4:2:2 or 4:2:0 resolution"""
+    height, width = len(y), len(y[0])
+    if pixel_format in {PixelFormat.YUYV, PixelFormat.UYVY}:
+        data = []
+        for row in range(height):
+            for col in range(0, width, 2):
+                y0, y1, cb, cr = y[row][col], y[row][col + 1], u[row][col // 2], v[row][col // 2]
+                data += [y0, cb, y1, cr] if pixel_format == PixelFormat.YUYV else [cb, y0, cr, y1]
+        return bytes(data)
+    data = [value for line in y for value in line]
+    u = [value for line in u[::2] for value in line]
+    v = [value for line in v[::2] for value in line]
+    if pixel_format == PixelFormat.YUV420:
+        return bytes(data + u + v)
+    first, second = (u, v) if pixel_format == PixelFormat.NV12 else (v, u)
+    return bytes(data + [value for pair in zip(first, second) for value in pair])
+
+
+@skip(when=numpy is None, reason="numpy is not installed")
+@test("convert YUV formats")
+def _(
+    pixel_format=each(PixelFormat.YUYV, PixelFormat.UYVY, PixelFormat.NV12, PixelFormat.NV21, PixelFormat.YUV420),
+):
+    from linuxpy.video.convert import convert
+
+    width, height = 6, 4
+    y = [[randint(0, 255) for _ in range(width)] for _ in range(height)]
+    # chroma is sampled at half the horizontal resolution (4:2:0 formats ignore odd rows)
+    u = [[randint(0, 255) for _ in range(width // 2)] for _ in range(height)]
+    v = [[randint(0, 255) for _ in range(width // 2)] for _ in range(height)]
+    if pixel_format not in {PixelFormat.YUYV, PixelFormat.UYVY}:
+        u = [u[row & ~1] for row in range(height)]
+        v = [v[row & ~1] for row in range(height)]
+    data = pack_yuv(pixel_format, y, u, v)
+    expected = [
+        [yuv_to_rgb(y[row][col], u[row][col // 2], v[row][col // 2]) for col in range(width)] for row in range(height)
+    ]
+    rgb = convert(data, width, height, pixel_format)
+    assert rgb.shape == (height, width, 3)
+    assert rgb.tolist() == [[list(pixel) for pixel in line] for line in expected]
+    out = numpy.empty((height, width, 3), dtype="u1")
+    assert convert(data, width, height, pixel_format, "BGR", out) is out
+    assert numpy.array_equal(out, rgb[..., ::-1])
+    assert convert(data, width, height, pixel_format, "GRAY").tolist() == y
+
+
+@skip(when=numpy is None, reason="numpy is not installed")
+@test("convert YUV 4:2:0 formats of odd size")
+def _(
+    pixel_format=each(PixelFormat.NV12, PixelFormat.NV21, PixelFormat.YUV420),
+    bytesperline=each(6, 6, 0),
+):
+    from linuxpy.video.convert import convert
+
+    width, height = 5, 3
+    # chroma planes are rounded up: 3x2 (u, v) pairs, the last ones cover cut cells
+    y = [[randint(0, 255) for _ in range(width)] for _ in range(height)]
+    u = [[randint(0, 255) for _ in range(3)] for _ in range(2)]
+    v = [[randint(0, 255) for _ in range(3)] for _ in range(2)]
+    stride = bytesperline or width
+    data = [value for line in y for value in line + [0] * (stride - width)]
+    if pixel_format == PixelFormat.YUV420:
+        data += [value for plane in (u, v) for line in plane for value in line]
+    else:
+        first, second = (u, v) if pixel_format == PixelFormat.NV12 else (v, u)
+        data += [value for a, b in zip(first, second) for pair in zip(a, b) for value in pair]
+    expected = [
+        [list(yuv_to_rgb(y[row][col], u[row // 2][col // 2], v[row // 2][col // 2])) for col in range(width)]
+        for row in range(height)
+    ]
+    rgb = convert(bytes(data), width, height, pixel_format, bytesperline=bytesperline)
+    assert rgb.tolist() == expected
+    assert convert(bytes(data), width, height, pixel_format, "GRAY", bytesperline=bytesperline).tolist() == y
+
+
+@skip(when=numpy is None, reason="numpy is not installed")
+@test("convert RGB formats")
+def _():
+    from linuxpy.video.convert import convert
+
+    data = bytes([0x00, 0xF8, 0xE0, 0x07, 0x1F, 0x00, 0xFF, 0xFF])
+    rgb = convert(data, 4, 1, PixelFormat.RGB565)
+    assert rgb.tolist() == [[[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 255]]]
+    assert convert(data, 4, 1, PixelFormat.RGB565, "GRAY").tolist() == [[77, 149, 29, 255]]
+    data = bytes(range(12))
+    assert convert(data, 2, 2, PixelFormat.BGR24).tolist() == [[[2, 1, 0], [5, 4, 3]], [[8, 7, 6], [11, 10, 9]]]
+    padded = bytes([0, 1, 2, 3, 4, 5, 99, 99, 6, 7, 8, 9, 10, 11, 99, 99])
+    rgb = convert(padded, 2, 2, PixelFormat.RGB24, bytesperline=8)
+    assert rgb.tolist() == [[[0, 1, 2], [3, 4, 5]], [[6, 7, 8], [9, 10, 11]]]
+    assert convert(data, 4, 3, PixelFormat.GREY).tolist() == [[[i] * 3 for i in range(j, j + 4)] for j in (0, 4, 8)]
+
+
+@skip(when=numpy is None, reason="numpy is not installed")
+@test("convert bayer formats")
+def _(
+    pixel_format=each(PixelFormat.SBGGR8, PixelFormat.SGBRG8, PixelFormat.SGRBG8, PixelFormat.SRGGB8),
+    pattern=each("BGGR", "GBRG", "GRBG", "RGGB"),
+):
+    from linuxpy.video.convert import convert
+
+    # a uniform color must be reconstructed everywhere
+    color = {"R": 200, "G": 100, "B": 50}
+    width, height = 6, 4
+    data = bytes(color[pattern[(row % 2) * 2 + col % 2]] for row in range(height) for col in range(width))
+    rgb = convert(data, width, height, pixel_format)
+    assert numpy.all(rgb == [200, 100, 50])
+
+
+@skip(when=numpy is None, reason="numpy is not installed")
+@test("convert errors")
+def _():
+    from linuxpy.video.convert import convert
+
+    with raises(ValueError):
+        convert(bytes(8), 2, 2, PixelFormat.MJPEG)
+    with raises(ValueError):
+        convert(bytes(8), 2, 2, PixelFormat.YUYV, "HSV")
+    with raises(ValueError):
+        convert(bytes(8), 2, 2, PixelFormat.YUYV, out=numpy.empty((2, 2), dtype="u1"))
+    with raises(ValueError):
+        convert(bytes(8), 2, 2, PixelFormat.YUYV, out=numpy.empty((2, 2, 3), dtype="f4"))
+    with raises(ValueError):
+        convert(bytes(6), 3, 1, PixelFormat.YUYV)
+    with raises(ValueError):
+        convert(bytes(9), 3, 3, PixelFormat.SRGGB8)
+
+
+@skip(when=numpy is None, reason="numpy is not installed")
+@test("frame array is a shaped view honoring bytesperline")
+def _():
+    data = bytearray(range(24))
+    frame = Frame(data, raw.v4l2_buffer(), Format(4, 2, PixelFormat.YUYV, bytesperline=12))
+    array = frame.array
+    assert array.shape == (2, 4, 2)
+    assert array.strides == (12, 2, 1)
+    assert array[1].ravel().tolist() == list(range(12, 20))
+    data[12] = 255
+    assert array[1, 0, 0] == 255
+
+    frame = Frame(bytes(range(8)), raw.v4l2_buffer(), Format(2, 2, PixelFormat.Y16))
+    assert frame.array.dtype == numpy.dtype("<u2")
+    assert frame.array.tolist() == [[0x0100, 0x0302], [0x0504, 0x0706]]
+
+    frame = Frame(bytes(24), raw.v4l2_buffer(), Format(4, 4, PixelFormat.NV12, bytesperline=4))
+    assert frame.array.shape == (6, 4)
+
+    frame = Frame(bytes(10), raw.v4l2_buffer(), Format(4, 4, PixelFormat.MJPEG))
+    assert frame.array.shape == (10,)
+
+
+@skip(when=numpy is None, reason="numpy is not installed")
+@test("frame to rgb")
+def _(camera=hardware):
+    with Device(camera.filename) as device:
+        for frame in device:
+            expected = numpy.frombuffer(camera.frame, dtype="u1").reshape(480, 640, 3)
+            assert numpy.array_equal(frame.to_rgb(), expected)
+            out = numpy.empty((480, 640, 3), dtype="u1")
+            assert frame.to_rgb(out=out) is out
+            assert numpy.array_equal(out, expected)
+            assert numpy.array_equal(frame.to_bgr(), expected[..., ::-1])
+            assert frame.to_gray().shape == (480, 640)
+            assert numpy.shares_memory(frame.array, numpy.frombuffer(frame.data, dtype="u1"))
+            break
+
+
+def recorded_frames(pixel_format, count):
+    fmt = Format(4, 2, pixel_format, 12)
+    for index in range(count):
+        buff = raw.v4l2_buffer()
+        buff.sequence = 10 + index
+        buff.timestamp.secs = 100 + index
+        buff.timestamp.usecs = 500_000
+        buff.flags = raw.BufferFlag.KEYFRAME
+        yield Frame(bytes([index]) * (24 + index), buff, fmt)
+
+
+@test("recorder writes MJPEG frames to an indexed AVI file")
+def _():
+    frames = list(recorded_frames(PixelFormat.MJPEG, 5))
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "video.avi"
+        with Recorder(path, frames[0].format, fps=30, batch=2) as recorder:
+            assert recorder.is_compressed
+            recorder.record(frames)
+        data = path.read_bytes()
+        assert data[:4] == b"RIFF" and data[8:12] == b"AVI "
+        assert int.from_bytes(data[4:8], "little") == len(data) - 8
+        assert int.from_bytes(data[48:52], "little") == 5
+        assert list(iter_avi_frames(path)) == [frame.data for frame in frames]
+    stats = recorder.stats
+    assert stats.frames == 5
+    assert stats.dropped == 0
+    assert stats.bytes == sum(8 + len(frame.data) + len(frame.data) % 2 for frame in frames)
+    assert stats.queue_depth == 0
+    assert stats.max_write_latency >= stats.write_latency > 0
+
+
+@test("recorder writes raw frames with their metadata")
+def _():
+    frames = list(recorded_frames(PixelFormat.YUYV, 3))
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "video.raw"
+        with Recorder(path, frames[0].format) as recorder:
+            assert not recorder.is_compressed
+            recorder.record(frames)
+        reader = RawReader(path)
+        records = list(reader)
+    assert reader.format == Format(4, 2, PixelFormat.YUYV, 12)
+    assert [record.data for record in records] == [frame.data for frame in frames]
+    assert [record.sequence for record in records] == [10, 11, 12]
+    assert [record.timestamp for record in records] == [100.5, 101.5, 102.5]
+    assert all(record.flags == raw.BufferFlag.KEYFRAME for record in records)
+
+
+@test("recorder drops frames instead of blocking when the disk stalls")
+def _():
+    frames = list(recorded_frames(PixelFormat.GREY, 4))
+    gate = threading.Event()
+    write_all = record.write_all
+
+    def stalled_write(fd, buffers):
+        gate.wait()
+        return write_all(fd, buffers)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "video.raw"
+        with Recorder(path, frames[0].format, queue_size=2, batch=1) as recorder:
+            with mock.patch("linuxpy.video.record.write_all", stalled_write):
+                assert recorder.write(frames[0])
+                while recorder.stats.queue_depth:
+                    time.sleep(0.001)
+                assert recorder.write(frames[1])
+                assert recorder.write(frames[2])
+                assert not recorder.write(frames[3])
+                assert recorder.stats.queue_depth == 2
+                gate.set()
+        assert [record.data for record in RawReader(path)] == [frame.data for frame in frames[:3]]
+    stats = recorder.stats
+    assert stats.frames == 3
+    assert stats.dropped == 1
+    assert stats.max_queue_depth == 2
+
+
+@test("ring recorder keeps the last frames in a memory mapped file")
+def _():
+    frames = list(recorded_frames(PixelFormat.GREY, 5))
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "ring.bin"
+        with RingRecorder(path, frames[0].format, slots=3, slot_size=32) as ring:
+            assert path.stat().st_size == ring.size
+            for frame in frames:
+                assert ring.write(frame)
+            assert [record.sequence for record in ring.records()] == [12, 13, 14]
+            assert [record.data for record in ring.records(duration=1)] == [frames[3].data, frames[4].data]
+            # the ring is readable from another process while recording (ex: after a crash)
+            reader = RingReader(path)
+            assert [record.data for record in reader] == [frame.data for frame in frames[2:]]
+            assert reader.format == frames[0].format
+            assert not ring.write(list(recorded_frames(PixelFormat.GREY, 10))[-1])
+            assert ring.oversized == 1
+
+
+@test("ring recorder slots default to the format image size")
+def _():
+    # 4:2:0 images are 1.5 bytes per pixel although bytesperline == width
+    fmt = Format(4, 2, PixelFormat.YUV420, 4, 12)
+    frames = [
+        Frame(bytes([index]) * 12, frame.buff, fmt) for index, frame in enumerate(recorded_frames(fmt.pixel_format, 3))
+    ]
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "ring.bin"
+        with RingRecorder(path, fmt, slots=2) as ring:
+            assert ring.slot_size == 12
+            for frame in frames:
+                assert ring.write(frame)
+            assert ring.oversized == 0
+            assert [record.data for record in ring.records()] == [frame.data for frame in frames[1:]]
+        with raises(ValueError):
+            RingRecorder(path, Format(4, 2, PixelFormat.YUV420, 4), slots=2)
+
+
+@test("ring recorder trigger exports the pre-trigger window")
+def _(pixel_format=each(PixelFormat.GREY, PixelFormat.MJPEG)):
+    frames = list(recorded_frames(pixel_format, 6))
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "ring.bin"
+        output = Path(folder) / "event"
+        with RingRecorder(path, frames[0].format, slots=4, slot_size=32) as ring:
+            for frame in frames[:5]:
+                ring.write(frame)
+            ring.freeze()
+            assert not ring.write(frames[5])
+            ring.resume()
+            assert ring.trigger(output, duration=2).result(5) == 3
+            assert not ring.frozen
+        if pixel_format == PixelFormat.MJPEG:
+            assert list(iter_avi_frames(output)) == [frame.data for frame in frames[2:5]]
+        else:
+            records = list(RawReader(output))
+            assert [record.data for record in records] == [frame.data for frame in frames[2:5]]
+            assert [record.timestamp for record in records] == [102.5, 103.5, 104.5]
+
+
+def read_shared_frames(name, count, ready, results):
+    with SharedFrameSubscriber(name) as subscriber:
+        ready.set()
+        frames = [subscriber.read(timeout=5) for _ in range(count)]
+        results.put([(frame.frame_nb, bytes(frame)) for frame in frames])
+        del frames
+
+
+@test("shared memory frames are zero-copy views guarded by a sequence lock")
+def _():
+    frames = list(recorded_frames(PixelFormat.RGB24, 6))
+    with SharedFramePublisher(slots=2, slot_size=32) as publisher:
+        with SharedFrameSubscriber(publisher.name) as subscriber:
+            assert subscriber.read(timeout=0) is None
+            publisher.publish(frames[0])
+            frame = subscriber.read(timeout=0)
+            assert isinstance(frame.data, memoryview)
+            assert bytes(frame) == frames[0].data
+            assert frame.format == frames[0].format
+            assert frame.frame_nb == 10
+            assert frame.timestamp == 100.5
+            assert frame.flags == raw.BufferFlag.KEYFRAME
+            assert frame.valid
+            if numpy:
+                assert frame.array.shape == (2, 4, 3)
+                assert not frame.array.flags.writeable
+            assert frame.copy().data == frames[0].data
+            for other in frames[1:5]:
+                publisher.publish(other)
+            # slot has been reused
+            assert not frame.valid
+            assert frame.copy() is None
+            assert subscriber.lag == 2
+            assert subscriber.read(timeout=0).frame_nb == 13
+            assert subscriber.stats == (2, 2)
+            publisher.publish(frames[5])
+            assert subscriber.latest().frame_nb == 15
+            assert subscriber.stats == (3, 3)
+            assert not publisher.publish(list(recorded_frames(PixelFormat.RGB24, 10))[-1])
+            assert publisher.oversized == 1
+            del frame
+    assert not (Path(SHM_PATH) / publisher.name).exists()
+
+
+@test("shared memory frames reach other processes")
+def _():
+    context = multiprocessing.get_context("fork")
+    frames = list(recorded_frames(PixelFormat.GREY, 3))
+    ready, results = context.Event(), context.Queue()
+    with SharedFramePublisher(slots=4, slot_size=32) as publisher:
+        worker = context.Process(target=read_shared_frames, args=(publisher.name, 3, ready, results))
+        worker.start()
+        assert ready.wait(5)
+        for frame in frames:
+            publisher.publish(frame)
+        assert results.get(timeout=5) == [(frame.frame_nb, frame.data) for frame in frames]
+        worker.join(5)
+    assert worker.exitcode == 0
+
+
+@test("shared memory subscribers sleep until a frame is published")
+def _():
+    frames = list(recorded_frames(PixelFormat.GREY, 1))
+    with SharedFramePublisher(format=frames[0].format) as publisher:
+        assert publisher.slot_size == len(frames[0].data)
+        # a polling subscriber would only see the frame after poll_interval
+        with SharedFrameSubscriber(publisher.name, poll_interval=10) as subscriber:
+            timer = threading.Timer(0.1, publisher.publish, (frames[0],))
+            timer.start()
+            start = time.monotonic()
+            frame = subscriber.read(timeout=5)
+            assert time.monotonic() - start < 2
+            assert bytes(frame) == frames[0].data
+            assert subscriber.read(timeout=0.1) is None
+            timer.join()
+            del frame
+    with raises(ValueError):
+        SharedFramePublisher(format=frames[0].format._replace(bytesperline=0, size=0))
+
+
+@test("ring recorder keeps recording while a trigger is exported")
+def _():
+    frames = list(recorded_frames(PixelFormat.GREY, 6))
+    exporting, done = threading.Event(), threading.Event()
+
+    def slow_export(*args):
+        exporting.set()
+        assert done.wait(5)
+        return export_records(*args)
+
+    with tempfile.TemporaryDirectory() as folder:
+        output = Path(folder) / "event"
+        with RingRecorder(Path(folder) / "ring.bin", frames[0].format, slots=4, slot_size=32) as ring:
+            for frame in frames[:3]:
+                ring.write(frame)
+            with mock.patch.object(record, "export_records", slow_export):
+                future = ring.trigger(output)
+                assert exporting.wait(5)
+                assert not future.done()
+                for frame in frames[3:]:
+                    assert ring.write(frame)
+                done.set()
+                assert future.result(5) == 3
+        records = list(RawReader(output))
+        assert [record.data for record in records] == [frame.data for frame in frames[:3]]
+
+
+async def queued_frames(queue):
+    while (frame := await queue.get()) is not None:
+        yield frame
+
+
+async def http_get(address, path):
+    reader, writer = await asyncio.open_connection(*address[:2])
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: test\r\n\r\n".encode())
+    status = (await reader.readline()).decode()
+    headers = {}
+    while line := (await reader.readline()).strip():
+        key, value = line.decode().split(":", 1)
+        headers[key.lower()] = value.strip()
+    return reader, writer, int(status.split()[1]), headers
+
+
+async def read_part(reader):
+    assert await reader.readline() == b"--" + stream.BOUNDARY + b"\r\n"
+    headers = {}
+    while line := (await reader.readline()).strip():
+        key, value = line.decode().split(":", 1)
+        headers[key.lower()] = value.strip()
+    data = await reader.readexactly(int(headers["content-length"]))
+    assert await reader.readexactly(2) == b"\r\n"
+    return headers["content-type"], data
+
+
+async def wait_clients(server, count):
+    while len(server.clients) < count:
+        await asyncio.sleep(0.001)
+
+
+@test("stream server passes MJPEG frames through to every client")
+async def _():
+    frames = list(recorded_frames(PixelFormat.MJPEG, 3))
+    queue = asyncio.Queue()
+    async with StreamServer(queued_frames(queue), host="127.0.0.1", port=0) as server:
+        clients = [await http_get(server.address, "/stream") for _ in range(2)]
+        for _, _, status, headers in clients:
+            assert status == 200
+            assert headers["content-type"] == "multipart/x-mixed-replace; boundary=frame"
+        await wait_clients(server, 2)
+        for frame in frames:
+            await queue.put(frame)
+            for reader, *_ in clients:
+                assert await read_part(reader) == ("image/jpeg", frame.data)
+        assert sorted(stats.sent for stats in server.stats) == [3, 3]
+        _, writer, status, headers = await http_get(server.address, "/snapshot")
+        assert status == 200
+        assert headers["content-length"] == str(len(frames[-1].data))
+        writer.close()
+        _, writer, status, _ = await http_get(server.address, "/unknown")
+        assert status == 404
+        writer.close()
+    for _, writer, *_ in clients:
+        writer.close()
+
+
+@test("stream server encodes raw frames once for all clients")
+async def _():
+    encoded = []
+
+    def encoder(frame):
+        encoded.append(frame.frame_nb)
+        return stream.Image("image/x-test", bytes(frame)[:4])
+
+    frames = list(recorded_frames(PixelFormat.GREY, 2))
+    queue = asyncio.Queue()
+    async with StreamServer(queued_frames(queue), host="127.0.0.1", port=0, encoder=encoder) as server:
+        clients = [await http_get(server.address, "/stream") for _ in range(3)]
+        await wait_clients(server, 3)
+        for frame in frames:
+            await queue.put(frame)
+            for reader, *_ in clients:
+                assert await read_part(reader) == ("image/x-test", frame.data[:4])
+    assert encoded == [frame.frame_nb for frame in frames]
+    for _, writer, *_ in clients:
+        writer.close()
+
+
+@test("stream client only keeps the latest image")
+async def _():
+    writer = mock.Mock()
+    writer.get_extra_info.return_value = ("127.0.0.1", 5000)
+    client = stream.Client(writer)
+    images = [stream.Image("image/jpeg", bytes([i])) for i in range(3)]
+    for image in images:
+        client.offer(image)
+    assert await client.next_image() is images[-1]
+    assert client.stats == stream.ClientStats(("127.0.0.1", 5000), 0, 2)
+    client.close()
+    assert await client.next_image() is None
+
+
+@test("fake camera capture")
+async def _():
+    with FakeCamera(64, 48, "GREY", fps=200, buffers=3) as camera:
+        with camera.device() as device:
+            assert device.info.card == "linuxpy fake camera"
+            assert device.get_format(BufferType.VIDEO_CAPTURE) == Format(64, 48, PixelFormat.GREY, 64, 64 * 48)
+            with VideoCapture(device, size=3) as capture:
+                frames = [frame for _, frame in zip(range(5), capture)]
+            assert [len(frame) for frame in frames] == 5 * [64 * 48]
+            sequences = [frame.frame_nb for frame in frames]
+            assert sequences == sorted(sequences)
+            assert all(frame.timestamp <= time.monotonic() for frame in frames)
+
+            with VideoCapture(device, lease=True, drop_policy=DropPolicy.BLOCK) as capture:
+                count = 0
+                async for frame in capture:
+                    frame.release()
+                    count += 1
+                    if count == 5:
+                        break
+                assert capture.stats.dropped == 0
+
+            camera.start_reading()
+            with VideoCapture(device, source=Capability.READWRITE) as capture:
+                assert [len(frame) for _, frame in zip(range(3), capture)] == 3 * [64 * 48]
+
+
+@test("fake camera without fps has no frame interval")
+def _():
+    with FakeCamera(64, 48, "GREY", fps=None) as camera:
+        with camera.device() as device:
+            with raises(OSError) as error:
+                device.get_fps(BufferType.VIDEO_CAPTURE)
+            assert error.raised.errno == EINVAL
+            sizes = [size for size in device.info.frame_sizes if size.pixel_format == PixelFormat.GREY]
+            assert [(size.width, size.height, size.min_fps) for size in sizes] == [(64, 48, 0)]
+            parm = raw.v4l2_streamparm(type=BufferType.VIDEO_CAPTURE)
+            parm.parm.capture.timeperframe.numerator = 1
+            with raises(OSError) as error:
+                ioctl(device.fileno(), raw.IOC.S_PARM, parm)
+            assert error.raised.errno == EINVAL
+            assert camera.fps is None
+            device.set_fps(BufferType.VIDEO_CAPTURE, 25)
+            assert device.get_fps(BufferType.VIDEO_CAPTURE) == 25
+
+
+@test("fake camera dequeue fails if the stream stops meanwhile")
+def _(camera=fake_camera):
+    with camera.device() as device:
+        with VideoCapture(device) as capture:
+            assert camera.streaming
+            # a frame is signaled but streamoff ran before it was taken
+            with camera._lock:
+                camera._done.clear()
+            with raises(OSError) as error:
+                capture.buffer.raw_read()
+            assert error.raised.errno == EINVAL
+
+
+@test("capture benchmark")
+def _(mode=each("read", "mmap", "lease", "async")):
+    result = benchmark(mode, frames=20, alloc_frames=5, width=32, height=16, pixel_format="GREY")
+    assert result.mode == mode
+    assert result.frames == 20
+    assert result.fps > 0
+    assert result.cpu > 0
+    # tiny frames: anything close to a MiB per frame is not per frame work
+    assert 0 <= result.alloc < 1 << 20
+    if mode == "read":
+        assert result.latency is None
+    else:
+        assert 0 <= result.latency <= result.max_latency
+
+
+@test("lazy device info")
+def _(camera=hardware):
+    with Device(camera.filename) as device:
+        expected = device.info
+    with mock.patch("linuxpy.ioctl.fcntl.ioctl", side_effect=camera.ioctl) as ioctl:
+        with Device(camera.filename, lazy=True) as device:
+            assert ioctl.call_count == 1
+            assert isinstance(device.info, LazyInfo)
+            assert device.info.driver == expected.driver
+            assert device.info.version == expected.version
+            assert device.info.buffers == expected.buffers
+            assert ioctl.call_count == 1
+            assert device.info.inputs == expected.inputs
+            count = ioctl.call_count
+            assert device.info.inputs == expected.inputs
+            assert ioctl.call_count == count
+            assert device.controls.brightness.value == 55
+            assert device.controls is device.controls
+            info = device.info.materialize()
+            assert info.formats == expected.formats
+            assert info.frame_sizes == expected.frame_sizes
+            assert len(info.controls) == len(expected.controls)
+
+
+@test("info cache skips enumeration of known devices")
+def _(camera=hardware):
+    with tempfile.TemporaryDirectory() as path:
+        cache = InfoCache(path)
+        with Device(camera.filename, cache=cache) as device:
+            expected = device.info
+            assert device.controls.brightness.value == 55
+        assert len(list(Path(path).glob("*.json"))) == 1
+        with mock.patch("linuxpy.video.device.read_info") as read_info:
+            with Device(camera.filename, cache=cache) as device:
+                read_info.assert_not_called()
+                assert device.info.driver == expected.driver
+                assert device.info.formats == expected.formats
+                assert device.info.inputs == expected.inputs
+                assert [ctrl.id for ctrl in device.info.controls] == [ctrl.id for ctrl in expected.controls]
+                assert device.controls.brightness.value == 55
+                assert device.controls.brightness.minimum == 10
+        # a different driver version is a different device
+        camera.version += 1
+        with Device(camera.filename, cache=cache) as device:
+            assert device.info.version == "5.4.13"
+        assert len(list(Path(path).glob("*.json"))) == 2
+        cache.clear()
+        assert not list(Path(path).glob("*.json"))
+
+
+@test("info cache does not keep dynamic state")
+def _():
+    with Hardware() as camera:
+        camera.control_flags[9963776] = raw.ControlFlag.INACTIVE | raw.ControlFlag.SLIDER
+        with tempfile.TemporaryDirectory() as path:
+            cache = InfoCache(path)
+            with Device(camera.filename, cache=cache) as device:
+                assert device.controls.brightness.is_flagged_inactive
+            (filename,) = Path(path).glob("*.json")
+            controls = json.loads(filename.read_text())["controls"]
+            assert controls[0]["name"] == "brightness"
+            assert controls[0]["flags"] == raw.ControlFlag.SLIDER
+            camera.brightness_flags = 0
+            camera.input0_name = b"renamed"
+            with Device(camera.filename, cache=cache) as device:
+                brightness = device.controls.brightness
+                assert brightness.is_flagged_slider
+                assert not brightness.is_flagged_inactive
+                brightness.value = 70
+                assert camera.brightness == 70
+                assert device.info.inputs[0].name == "renamed"
+
+
+@test("info cache ignores invalid entries")
+def _(camera=hardware):
+    with tempfile.TemporaryDirectory() as path:
+        cache = InfoCache(path)
+        with Device(camera.filename, cache=cache) as device:
+            expected = device.info
+        (filename,) = Path(path).glob("*.json")
+        filename.write_bytes(b"garbage")
+        with Device(camera.filename, cache=cache) as device:
+            assert device.info.formats == expected.formats
+        assert cache.load(filename.stem) is not None
+
+
+@contextmanager
+def fake_sysfs(*nodes, driver="uvcvideo"):
+    """Creates a fake /sys/class/video4linux tree with the given (name, index) nodes"""
+    with tempfile.TemporaryDirectory() as path:
+        root = Path(path)
+        usb = root / "devices" / "usb1" / "1-1:1.0"
+        (root / "bus" / "usb" / "drivers" / driver).mkdir(parents=True)
+        usb.mkdir(parents=True)
+        (usb / "driver").symlink_to(root / "bus" / "usb" / "drivers" / driver)
+        (usb / "subsystem").symlink_to(root / "bus" / "usb")
+        classes = root / "class" / "video4linux"
+        classes.mkdir(parents=True)
+        for minor, (name, index) in enumerate(nodes):
+            node = classes / f"video{minor}"
+            node.mkdir()
+            (node / "name").write_text(f"{name}\n")
+            (node / "index").write_text(f"{index}\n")
+            (node / "uevent").write_text(f"MAJOR=81\nMINOR={minor}\nDEVNAME=video{minor}\n")
+            (node / "device").symlink_to(usb)
+        yield classes
+
+
+@test("discover video nodes from sysfs")
+def _():
+    with fake_sysfs(("cam", 0), ("cam", 1)) as path:
+        with mock.patch("linuxpy.video.device.IO.open") as opener:
+            nodes = list(iter_video_nodes(path))
+            assert [node.filename for node in nodes] == [Path("/dev/video0"), Path("/dev/video1")]
+            assert [node.index for node in nodes] == [0, 1]
+            assert nodes[0].name == "cam"
+            assert nodes[0].driver == "uvcvideo"
+            assert nodes[0].bus == "usb"
+            assert nodes[0].devnum == (81 << 8)
+            opener.assert_not_called()
+        device = nodes[1].device(lazy=True)
+        assert isinstance(device, Device)
+        assert device.filename == Path("/dev/video1")
+        assert device.lazy
+
+
+@test("filter sysfs video nodes by capability")
+def _(camera=hardware):
+    with fake_sysfs(("cam", 0), ("cam", 1), driver="vivid") as path:
+        with mock.patch("linuxpy.ioctl.fcntl.ioctl", side_effect=camera.ioctl) as ioctl:
+            nodes = list(iter_video_capture_nodes(path))
+            assert len(nodes) == 2
+            assert ioctl.call_count == 2
+            assert nodes[0].capabilities == camera.capabilities
+            assert ioctl.call_count == 2
+            assert list(iter_video_output_nodes(path)) == []
+
+
+@test("filter sysfs video nodes of known drivers without opening them")
+def _():
+    with mock.patch("linuxpy.video.device.IO.open") as opener:
+        with fake_sysfs(("cam", 0), ("cam", 1), ("cam", 0)) as path:
+            nodes = list(iter_video_capture_nodes(path))
+            assert [node.filename for node in nodes] == [Path("/dev/video0"), Path("/dev/video2")]
+            assert Capability.META_CAPTURE in list(iter_video_nodes(path))[1].sysfs_capabilities
+            assert list(iter_video_output_nodes(path)) == []
+        with fake_sysfs(("hantro-vpu-dec", 0), driver="hantro-vpu") as path:
+            assert list(iter_video_capture_nodes(path)) == []
+            assert list(iter_video_output_nodes(path)) == []
+        with fake_sysfs(("rkisp1_mainpath", 0), ("rkisp1_params", 1), driver="rkisp1") as path:
+            assert list(iter_video_capture_nodes(path)) == []
+            node = next(iter_video_nodes(path))
+            assert node.has_capability(Capability.VIDEO_CAPTURE_MPLANE)
+        opener.assert_not_called()
+
+
+@test("batched controls")
+def _(camera=hardware):
+    with Device(camera.filename) as device:
+        controls = device.controls
+        with mock.patch("linuxpy.ioctl.fcntl.ioctl", side_effect=camera.ioctl) as ioctl:
+            assert controls.get_values() == {"brightness": 55, "contrast": 12, "white_balance_automatic": False}
+            assert ioctl.call_count == 1
+            assert controls.get_values("brightness", 9963777) == {"brightness": 55, "contrast": 12}
+            assert controls.try_values({"brightness": 100}) == {"brightness": 100}
+            assert camera.brightness == 55
+            assert controls.set_values({controls.brightness: 100}) == {"brightness": 100}
+            assert camera.brightness == 100
+            ioctl.reset_mock()
+            controls.set_to_default()
+            assert ioctl.call_count == 1
+            assert camera.brightness == 64
+            with raises(AttributeError):
+                controls.set_values({"brightness": 20, "contrast": 1})
+            assert camera.brightness == 64
+
+
+@test("extended controls with 64 bit and compound values")
+def _(camera=hardware):
+    payload = raw.ControlFlag.HAS_PAYLOAD
+    int64 = raw.v4l2_query_ext_ctrl(id=0x009A0901, name=b"int64", type=raw.CtrlType.INTEGER64)
+    string = raw.v4l2_query_ext_ctrl(
+        id=0x009A0902, name=b"string", type=raw.CtrlType.STRING, flags=payload, elem_size=16, elems=1
+    )
+    area = raw.v4l2_query_ext_ctrl(
+        id=0x009A0903, name=b"area", type=raw.CtrlType.AREA, flags=payload, elem_size=8, elems=1
+    )
+    unknown = raw.v4l2_query_ext_ctrl(id=0x009A0904, name=b"unknown", type=raw.CtrlType.INTEGER)
+    camera.ext_values = {int64.id: 0, string.id: bytes(16), area.id: bytes(8)}
+    infos = [int64, string, area]
+    with Device(camera.filename) as device:
+        set_ext_controls(device, infos, [2**40, "hello", raw.v4l2_area(640, 480)])
+        assert camera.ext_values[int64.id] == 2**40
+        value64, text, data = get_ext_controls(device, infos)
+        assert value64 == 2**40
+        assert text == "hello"
+        assert raw.v4l2_area.from_buffer_copy(data).height == 480
+        with raises(ValueError):
+            set_ext_controls(device, [string], ["way too long for this control"])
+        with raises(OSError) as error:
+            get_ext_controls(device, [int64, unknown])
+        assert "unknown" in str(error.raised)
+        with raises(OSError):
+            set_ext_controls(device, [int64, device.controls.contrast._info], [1, 2])
+        assert camera.ext_values[int64.id] == 2**40
+
+
+@test("control cache serves values from events")
+def _(camera=hardware):
+    with Device(camera.filename) as device:
+        brightness = device.controls.brightness
+        with ControlCache(device) as cache:
+            assert camera.subscriptions == {9963776, 9963777, 9963788}
+            assert device.control_cache is cache
+            with mock.patch("linuxpy.ioctl.fcntl.ioctl", side_effect=camera.ioctl) as ioctl:
+                assert brightness.value == 55
+                assert device.controls.contrast.value == 12
+                camera.push_ctrl_event(9963776, ControlChange.VALUE, value=77)
+                camera.push_ctrl_event(9963776, ControlChange.RANGE, minimum=0, maximum=100, step=2, default_value=50)
+                assert brightness.value == 77
+                assert brightness.maximum == 100
+                assert brightness.step == 2
+                assert brightness.default == 50
+                camera.push_ctrl_event(9963776, ControlChange.FLAGS, flags=raw.ControlFlag.INACTIVE)
+                assert brightness.value == 77
+                assert brightness.is_flagged_inactive
+                assert raw.IOC.G_CTRL not in [call.args[1] for call in ioctl.call_args_list]
+            assert cache.events == 6
+        assert device.control_cache is None
+        assert not camera.subscriptions
+        assert brightness.value == 55
+
+
+@test("control cache skips volatile controls and keeps other events")
+def _():
+    with Hardware() as camera:
+        camera.control_flags[9963776] = raw.ControlFlag.VOLATILE
+        with Device(camera.filename) as device:
+            with ControlCache(device) as cache:
+                assert camera.subscriptions == {9963777, 9963788}
+                camera.brightness = 66
+                assert device.controls.brightness.value == 66
+                camera.events.append(raw.v4l2_event(type=raw.EventType.SOURCE_CHANGE))
+                camera.push_ctrl_event(9963777, ControlChange.VALUE, value=13)
+                assert cache.update() == 2
+                assert cache.values[9963777] == 13
+                event = EventReader(device).read()
+                assert event.type == raw.EventType.SOURCE_CHANGE
+                assert not cache.other_events
+
+
+@test("media request applies controls and buffers when submitted")
+def _(camera=hardware):
+    with Device(camera.filename) as device, MediaDevice("/dev/media0") as media:
+        with media.request(device) as request:
+            fd = request.fileno()
+            assert fd in camera.requests
+            assert request.set_controls({"brightness": 100}) == {"brightness": 100}
+            request.queue_buffer(raw.v4l2_buffer(type=BufferType.VIDEO_CAPTURE, memory=Memory.MMAP, index=1))
+            assert camera.requests[fd] == {"controls": {9963776: 100}, "buffers": [1]}
+            assert camera.brightness == 55
+            request.submit()
+            assert request.wait(0)
+            assert camera.brightness == 100
+            assert request.get_controls("brightness") == {"brightness": 100}
+            request.reinit()
+            assert not request.submitted
+            assert camera.requests[fd] == {"controls": {}, "buffers": []}
+        assert request.fileno() is None
+        with raises(OSError):
+            os.fstat(fd)
+
+
+def m2m_inputs(count):
+    return [bytes(range(index, index + 8)) for index in range(count)]
+
+
+@test("m2m session pipelines input against output buffers")
+def _(decoder=each(True, False)):
+    inputs = m2m_inputs(10)
+    with M2MHardware(decoder=decoder) as hardware:
+        with Device(hardware.filename) as device:
+            session = M2MSession(device, size=3)
+            with session:
+                assert hardware.streaming == {BufferType.VIDEO_OUTPUT, BufferType.VIDEO_CAPTURE}
+                frames = [bytes(frame) for frame in session.process(inputs)]
+                assert session.done
+                assert session.queued == session.processed == 10
+                assert session.read() is None
+            assert not hardware.streaming
+    assert frames == [data[::-1] for data in inputs]
+
+
+@test("video output buffers are filled in place")
+def _():
+    with M2MHardware() as hardware:
+        with Device(hardware.filename) as device:
+            with VideoOutput(device, size=2) as output:
+                hardware.inputs.clear()
+                hardware.output_done.extend([0, 1])
+                frame = output.acquire()
+                assert isinstance(frame, WritableFrame)
+                frame.data[:4] = b"abcd"
+                frame.commit(4)
+                assert frame.released
+                with raises(V4L2Error):
+                    frame.commit()
+                with output.acquire() as frame:
+                    frame.array[:, :3] = list(b"xyz")
+                assert hardware.inputs == [(0, b"abcd"), (1, b"xyz" + bytes(61))]
+
+                # a buffer released without commit is reused by the next acquire
+                hardware.output_done.append(0)
+                with raises(RuntimeError):
+                    with output.acquire() as frame:
+                        raise RuntimeError("render failed")
+                assert len(hardware.inputs) == 2
+                with output.acquire() as frame:
+                    assert frame.index == 0
+                    frame.data[:2] = b"ok"
+                    frame.commit(2)
+                assert hardware.inputs[-1] == (0, b"ok")
+
+            with VideoOutput(device, sink=Capability.READWRITE) as output:
+                with raises(V4L2Error):
+                    output.acquire()
+
+
+@test("multi-planar output data is split by plane image size")
+def _():
+    # planes memory is padded: 6 + 3 bytes of image in 16 + 8 bytes buffers
+    with M2MHardware(output_planes=[(6, 16), (3, 8)]) as hardware:
+        with Device(hardware.filename) as device:
+            with VideoOutput(device, size=2, buffer_type=BufferType.VIDEO_OUTPUT_MPLANE) as output:
+                assert output.buffer.plane_sizes == [6, 3]
+                hardware.inputs.clear()
+                hardware.output_done.extend([0, 1])
+                output.write(b"YYYYYYUVW")
+                assert hardware.inputs == [(0, [b"YYYYYY", b"UVW"])]
+                with raises(V4L2Error):
+                    output.write(bytes(10))
+                with output.acquire() as frame:
+                    assert [plane.nbytes for plane in frame.planes] == [6, 3]
+                    frame.commit(frame.fill(b"yyyyyyu"))
+                assert hardware.inputs[-1] == (1, [b"yyyyyy", b"u"])
+
+
+@test("m2m session refuses data larger than the input buffers")
+def _():
+    with M2MHardware() as hardware:
+        with Device(hardware.filename) as device:
+            with M2MSession(device, size=2) as session:
+                with raises(V4L2Error):
+                    session.feed(bytes(65))
+                assert session.queued == 0
+                assert session.feed(bytes(64))
+
+
+@test("video output write uses buffers released without commit")
+def _():
+    with M2MHardware() as hardware:
+        with Device(hardware.filename) as device:
+            with VideoOutput(device, size=2) as output:
+                hardware.inputs.clear()
+                hardware.output_done.extend([0, 1])
+                frames = [output.acquire(), output.acquire()]
+                for frame in frames:
+                    frame.release()
+                assert len(output.buffer.free) == 2
+                output.write(b"one")
+                output.write(b"two")
+                assert not output.buffer.free
+                assert output.buffer.in_flight == 2
+                assert sorted(hardware.inputs) == [(0, b"two"), (1, b"one")]
+                hardware.output_done.append(1)
+                frame = output.acquire()
+                frame.release()
+                output.write(b"three")
+                assert hardware.inputs[-1] == (1, b"three")
+
+
+@test("async video output keeps all buffers in flight")
+async def _():
+    with M2MHardware() as hardware:
+        with Device(hardware.filename) as device:
+            with VideoOutput(device, size=2) as output:
+                completed = 0
+
+                async def driver_done():
+                    # the driver is done with the oldest queued buffer
+                    nonlocal completed
+                    hardware.output_done.append(hardware.inputs[completed][0])
+                    completed += 1
+
+                inputs = [bytes([index]) * (index + 1) for index in range(5)]
+                async with FrameWriter(output) as writer:
+                    writer._writable = driver_done
+                    for data in inputs:
+                        await writer.write(data)
+                        assert writer.in_flight == 2
+                    assert writer.frames == 5
+                assert writer.in_flight == 0
+                # the 2 initial empty buffers then the data in order
+                assert [data for _, data in hardware.inputs] == [b"", b""] + inputs
+                assert completed == 7
+
+            with VideoOutput(device, sink=Capability.READWRITE) as output:
+                with raises(V4L2Error):
+                    async with FrameWriter(output):
+                        pass
+
+
+@test("async video output waits for the driver in the event loop")
+async def _(sink=each(Capability.STREAMING, Memory.DMABUF, Memory.USERPTR)):
+    pool = None
+    if sink == Memory.USERPTR:
+        pool = [bytearray(64) for _ in range(2)]
+    elif sink == Memory.DMABUF:
+        pool = [os.memfd_create(f"output{index}") for index in range(2)]
+        for fd in pool:
+            os.ftruncate(fd, 64)
+
+    async def driver():
+        # the driver is done with queued buffers in order, from time to time
+        completed = 0
+        while True:
+            await asyncio.sleep(0.001)
+            if completed < len(hardware.inputs):
+                hardware.complete_output(hardware.inputs[completed][0])
+                completed += 1
+
+    inputs = [bytes([index]) * (index + 1) for index in range(5)]
+    with M2MHardware() as hardware:
+        hardware.exported = pool if sink == Memory.DMABUF else []
+        with Device(hardware.filename) as device:
+            with VideoOutput(device, size=2, sink=sink, pool=pool) as output:
+                queued = len(hardware.inputs)
+                hardware.poll_output()
+                task = asyncio.create_task(driver())
+                try:
+                    async with FrameWriter(output) as writer:
+                        for data in inputs:
+                            await writer.write(data)
+                finally:
+                    task.cancel()
+                assert writer.in_flight == 0
+                assert writer.waits > 0
+                assert [data for _, data in hardware.inputs[queued:]] == inputs
+                # the blocking path takes over the buffers left by drain
+                output.write(b"sync")
+                assert hardware.inputs[-1][1] == b"sync"
+    if sink == Memory.DMABUF:
+        for fd in pool:
+            os.close(fd)
+
+
+class FakeClock:
+    """CLOCK_MONOTONIC which only moves when slept on or advanced by hand"""
+
+    def __init__(self, now=1_000_000_000):
+        self.now = now
+
+    def monotonic_ns(self):
+        return self.now
+
+    def sleep_until(self, deadline):
+        self.now = max(self.now, deadline)
+
+    @contextmanager
+    def patch(self):
+        with mock.patch("linuxpy.video.device.time.monotonic_ns", self.monotonic_ns):
+            with mock.patch("linuxpy.video.device.sleep_until", self.sleep_until):
+                yield self
+
+
+@test("video output stamps every queued buffer")
+def _(sink=each(Capability.STREAMING, Memory.USERPTR)):
+    pool = [bytearray(64) for _ in range(2)] if sink == Memory.USERPTR else None
+    with M2MHardware() as hardware, FakeClock().patch() as clock:
+        with Device(hardware.filename) as device:
+            with VideoOutput(device, size=2, sink=sink, pool=pool) as output:
+                hardware.input_timestamps.clear()
+                hardware.output_done.extend(10 * [0, 1])
+                # dequeued buffers come back with the timestamp of their previous round
+                for index in range(4):
+                    clock.now += 1_000_000
+                    output.write(bytes([index]) * 8)
+                clock.now += 1_000_000
+                with output.acquire() as frame:
+                    frame.fill(b"acquired")
+                assert hardware.input_timestamps == [1_001_000 + 1_000 * index for index in range(5)]
+
+
+@test("paced video output")
+def _(sink=each(Capability.STREAMING, Memory.USERPTR)):
+    pool = [bytearray(64) for _ in range(2)] if sink == Memory.USERPTR else None
+    with M2MHardware() as hardware, FakeClock().patch() as clock:
+        with Device(hardware.filename) as device:
+            with VideoOutput(device, size=2, sink=sink, pool=pool) as output:
+                hardware.inputs.clear()
+                hardware.input_timestamps.clear()
+                hardware.output_done.extend(10 * [0, 1])
+                paced = PacedOutput(output, fps=100)
+                for index in range(5):
+                    paced.write(bytes([index]) * 8)
+                assert clock.now == 1_040_000_000
+                assert [data for _, data in hardware.inputs] == [bytes([index]) * 8 for index in range(5)]
+                # buffers are stamped with their scheduled time
+                stamps = hardware.input_timestamps
+                assert stamps == [1_000_000 + 10_000 * index for index in range(5)]
+                assert paced.stats == PacingStats(5, 0, 0, 0.0, 0.0)
+
+                # a late frame doesn't make the following ones burst
+                clock.now += 55_000_000
+                paced.write(b"late")
+                paced.write(memoryview(b"next").cast("B", (2, 2)))
+                frames, late, skipped, jitter, max_jitter = paced.stats
+                assert (frames, late, skipped) == (7, 1, 4)
+                assert isclose(jitter, 0.045 / 7)
+                assert isclose(max_jitter, 0.045)
+                assert stamps[-3:] == [1_040_000, 1_050_000, 1_100_000]
+                assert hardware.inputs[-1][1] == b"next"
+                with raises(V4L2Error):
+                    paced.write(bytes(65))
+                paced.reset()
+                assert paced.stats == PacingStats(0, 0, 0, 0.0, 0.0)
+
+            with VideoOutput(device, sink=Capability.READWRITE) as output:
+                with raises(V4L2Error):
+                    PacedOutput(output, fps=100).write(b"frame")
+
+
+@test("m2m session feed, drain and read")
+def _():
+    inputs = m2m_inputs(3)
+    with M2MHardware() as hardware:
+        with Device(hardware.filename) as device:
+            with M2MSession(device, size=2) as session:
+                assert session.feed(inputs[0])
+                assert session.feed(inputs[1])
+                assert not session.feed(inputs[2])
+                assert bytes(session.read()) == inputs[0][::-1]
+                assert session.feed(inputs[2])
+                session.drain()
+                with raises(V4L2Error):
+                    session.feed(inputs[0])
+                assert [bytes(frame) for frame in session] == [data[::-1] for data in inputs[1:]]
+                assert session.done
+
+
+@test("m2m session keeps other event subscriptions")
+def _():
+    with M2MHardware() as hardware:
+        with Device(hardware.filename) as device:
+            with ControlCache(device) as cache:
+                with M2MSession(device) as session:
+                    hardware.push_ctrl_event(9963776, ControlChange.VALUE, value=99)
+                    assert len(list(session.process(m2m_inputs(2)))) == 2
+                    # the control event was consumed by the session
+                    assert not hardware.events
+                    assert cache.values[9963776] == 99
+                assert hardware.subscriptions == {9963776, 9963777, 9963788}
+                assert device.controls.brightness.value == 99
+
+
+@test("m2m session reallocates capture buffers on source change")
+def _():
+    inputs = m2m_inputs(6)
+    with M2MHardware(resize_at=2) as hardware:
+        with Device(hardware.filename) as device:
+            with M2MSession(device) as session:
+                assert session.buffer.format.width == 16
+                frames = list(session.process(inputs))
+                assert session.source_changes == 1
+                assert session.buffer.format.width == 32
+    assert [bytes(frame) for frame in frames] == [data[::-1] for data in inputs]
+    assert [frame.width for frame in frames] == 2 * [16] + 4 * [32]
+
+
+@test("m2m session needs a non-blocking m2m device")
+def _(camera=hardware):
+    with Device(camera.filename) as device:
+        with raises(V4L2Error):
+            M2MSession(device).open()
+    with M2MHardware() as hardware:
+        with Device(hardware.filename) as device:
+            hardware.fobj.get_blocking.return_value = True
+            with raises(V4L2Error):
+                M2MSession(device).open()
+
+
 @test("get edid")
 def _(display=hardware):
     with Device(display.filename) as device: